@@ -1,53 +1,136 @@
-import heapq
 from dataclasses import dataclass, field
-from fsm import Record
+from typing import Optional
+from fsm import Record, Priority
+from pqueue import BucketQueue, PrioritizedRecord
+from track import record_coords, simplify
 from datetime import datetime
 import ujson
 
 CACHE_FILE = "blackbox.json"
 
+# приблизний розмір обгортки запису у файлі: {"r":"","p":-1,"t":1740424826},
+RECORD_OVERHEAD = 32
 
-@dataclass(order=True)
-class PrioritizedRecord:
-    priority: int
-    timestamp: int
-    # record: Record = field(compare=False)  # Exclude `Record` from sorting
-    record: str = field(compare=False)  # Exclude `Record` from sorting
+
+def record_size(r: PrioritizedRecord) -> int:
+    return len(r.record) + RECORD_OVERHEAD
 
 
 @dataclass
 class BlackBox:
     timeout: int = 10
-    queue: list = field(default_factory=list)
+    queue: BucketQueue = field(default_factory=BucketQueue)
+    max_records: Optional[int] = None  # None = без обмеження
+    max_bytes: Optional[int] = None  # бюджет і для RAM, і для файлу
+    thin_interval: int = 0  # >0: проріджувати LOW-позиції до 1 запису на N секунд
+    evicted: dict = field(default_factory=dict)  # Priority -> кількість витіснених
+    thinned: int = 0
+    simplified: int = 0
+    _bytes: int = field(init=False, default=0)
 
     def __post_init__(self):
         self._load_from_file()
+        self._enforce_limits()
+
+    @property
+    def size(self):
+        return self._bytes
+
+    @property
+    def dropped(self):
+        """Загальна кількість втрачених записів (витіснення + проріджування)."""
+        return sum(self.evicted.values()) + self.thinned
 
     def on_record(self, r: Record):
         timestamp = int(datetime.now().timestamp())
-        priority = -r.priority
-        heapq.heappush(
-            # self.queue, PrioritizedRecord(priority, timestamp, r)
-            self.queue, PrioritizedRecord(priority, timestamp, r.full) # TODO: raw msg
-        )  # Negative priority for max-heap
+        # record = PrioritizedRecord(r.priority, timestamp, r)
+        record = PrioritizedRecord(r.priority, timestamp, r.full)  # TODO: raw msg
+        self.queue.push(record)
+        self._bytes += record_size(record)
+        self._enforce_limits()
         self._save_to_file()
 
     def peek(self, n=1):
-        """Повертає кілька записів з найвищим пріоритетом стану, а потім часу."""
-        if len(self.queue) >= n:
-            # Повертає список з перших n записів
-            return [self.queue[i].record for i in range(n)]
-        return []
-            
+        """Повертає до n записів з найвищим пріоритетом стану, а потім часу."""
+        return [r.record for r in self.queue.peek(n)]
+
     def confirm(self, n=1):
-        """Видаляє кілька записів після успішної відправки."""
-        confirmed_records = []
-        for _ in range(n):
-            if self.queue:
-                confirmed_records.append(heapq.heappop(self.queue))  # Видаляємо запис з найвищим пріоритетом
+        """Видаляє кілька записів після успішної відправки."""
+        confirmed_records = self.queue.pop(n)  # Видаляємо записи з найвищим пріоритетом
+        for r in confirmed_records:
+            self._bytes -= record_size(r)
         self._save_to_file()
         return confirmed_records
-        
+
+    def simplify(self, tolerance):
+        """Спрощує трек LOW-позицій (Douglas-Peucker) перед відправкою.
+
+        Записи без координат лишаються і розбивають трек на окремі ділянки.
+        """
+        kept = []
+        run = []
+        removed = 0
+        for r in self.queue.bucket(Priority.LOW):
+            point = record_coords(r.record)
+            if point is None:
+                removed += self._simplify_run(run, kept, tolerance)
+                kept.append(r)
+            else:
+                run.append((r, point))
+        removed += self._simplify_run(run, kept, tolerance)
+
+        if removed:
+            self.queue.replace(Priority.LOW, kept)
+            self.simplified += removed
+            self._save_to_file()
+        return removed
+
+    def _simplify_run(self, run, kept, tolerance):
+        indexes = simplify([point for _, point in run], tolerance)
+        for i in indexes:
+            kept.append(run[i][0])
+        for i in set(range(len(run))).difference(indexes):
+            self._bytes -= record_size(run[i][0])
+        removed = len(run) - len(indexes)
+        run.clear()
+        return removed
+
+    def _over_limits(self):
+        if self.max_records is not None and len(self.queue) > self.max_records:
+            return True
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            return True
+        return False
+
+    def _enforce_limits(self):
+        """Витісняє записи, поки черга не вкладеться в ліміти."""
+        if not self._over_limits():
+            return
+        if self.thin_interval > 0:
+            self._thin()
+        while self.queue and self._over_limits():
+            self._evict_one()
+
+    def _thin(self):
+        """Проріджує LOW-позиції за часом замість видалення цілих діапазонів."""
+        last = None
+        kept = []
+        for r in self.queue.bucket(Priority.LOW):
+            if last is not None and r.timestamp - last < self.thin_interval:
+                self._bytes -= record_size(r)
+                self.thinned += 1
+                continue
+            last = r.timestamp
+            kept.append(r)
+        self.queue.replace(Priority.LOW, kept)
+
+    def _evict_one(self):
+        """Видаляє найстаріший запис з найнижчим пріоритетом."""
+        r = self.queue.pop_lowest()
+        self._bytes -= record_size(r)
+        priority = Priority(r.priority)
+        self.evicted[priority] = self.evicted.get(priority, 0) + 1
+
     def _load_from_file(self):
         """Завантаження подій з файлу при старті."""
         try:
@@ -59,9 +142,11 @@ class BlackBox:
                     # timestamp = int(item["timestamp"])  # Час зберігається в timestamp
                     # priority = item["priority"]
                     record = item['r']  # TODO: raw msg
-                    timestamp = int(item["p"])  # Час зберігається в timestamp
-                    priority = item["t"]
-                    heapq.heappush(self.queue, PrioritizedRecord(priority, timestamp, record))
+                    timestamp = int(item["t"])  # Час зберігається в timestamp
+                    priority = -item["p"]  # у файлі пріоритет від'ємний, як у старій купі
+                    r = PrioritizedRecord(priority, timestamp, record)
+                    self.queue.push(r)
+                    self._bytes += record_size(r)
         except (OSError, ValueError):
             pass  # Якщо файл відсутній або пошкоджений
 
@@ -75,7 +160,7 @@ class BlackBox:
                 # "priority": r.priority,
                 # "timestamp": r.timestamp
                 "r": r.record,  # TODO: raw msg
-                "p": r.priority,
+                "p": -r.priority,
                 "t": r.timestamp
             } for r in self.queue], f)
 
@@ -3,6 +3,7 @@ import re
 import socket
 import threading
 import time
+import zlib
 from queue import Queue
 from threading import Thread
 
@@ -13,6 +14,7 @@ from WialonIPS.fsm import IOElement, Operand, Priority
 from blackbox import BlackBox
 from crc16 import crc16
 from fsm import IOObserver
+from track import ReportingPolicy
 
 __version__ = "2.0"
 
@@ -36,11 +38,27 @@ DATA_QUERY_FMT = "#D#{body}{crc}\r\n"
 COORDS_ANSWER_REGEX = re.compile("^#ASD#(\d+)\r\n$", re.IGNORECASE)
 DATA_ANSWER_REGEX = re.compile("^#AD#(\d+)\r\n$", re.IGNORECASE)
 
+# the firmware does not import _wialonips: #B# and compressed framing are copies of
+# Protocol.build_black_box_packet and framing.compress_frame, tests/test_device.py pins them together
+BLACKBOX_QUERY_FMT = "#B#{body}{crc}\r\n"
+BLACKBOX_ANSWER_REGEX = re.compile("^#AB#(\d+)\r\n$", re.IGNORECASE)
+
+COMPRESSED_MARKER = b"\xff"
+MAX_COMPRESSED_LEN = 0xFFFF
+
 
 def crc(body):
     return f"{crc16(body):0X}"
 
 
+def compress(packet):
+    """0xFF + uint16 LE length + zlib data, or `packet` if that is not smaller."""
+    data = zlib.compress(packet)
+    if len(data) > MAX_COMPRESSED_LEN or len(data) + 3 >= len(packet):
+        return packet
+    return COMPRESSED_MARKER + len(data).to_bytes(2, "little") + data
+
+
 def join_fields(*fields):
     print(fields)
     return ";".join(NOT_ALLOWED if f is None else str(f) for f in fields) + ";"
@@ -61,10 +79,14 @@ def join_params(**params):
 
 
 class Device:
-    def __init__(self, observer, blackbox):
+    def __init__(self, observer, blackbox, policy=None, batch_size=1, compress_threshold=None):
         self.observer = observer or IOObserver()
         self.blackbox = blackbox or BlackBox()
         self.observer.on_event = self.blackbox.on_record
+        # None keeps the fixed 5s position / 10s event schedule
+        self.policy = policy
+        self.batch_size = batch_size  # >1: upload the backlog as #B# batches
+        self.compress_threshold = compress_threshold  # bytes, None = never compress
 
         self.socket = None
         self.resp_queue = Queue()
@@ -89,8 +111,10 @@ class Device:
 
     @property
     def coords(self):
-        ts, lat, lon, *other = geo.get()
+        return self._coords(*geo.get())
 
+    @staticmethod
+    def _coords(ts, lat, lon, *other):
         cdt = dt.dt() if ts is None else dt.utc2dt(ts)
         return (*cdt, *geo.dec2ddmm(lat, True), *geo.dec2ddmm(lon, False), *other)
 
@@ -98,7 +122,7 @@ class Device:
         if not self.socket:
             raise Exception("Socket is not opened")
 
-        buf = message.encode(ENCODING)
+        buf = message if isinstance(message, bytes) else message.encode(ENCODING)
 
         self.socket.send(buf)
         print(">>>", buf)
@@ -138,7 +162,14 @@ class Device:
             print("Socket closed")
 
     def send_records(self):
+        # only a policy that asks for it, and only once LOW positions queued up
+        if self.policy is not None and self.policy.simplify_tolerance \
+                and len(self.blackbox.queue.bucket(Priority.LOW)) > 2:
+            self.blackbox.simplify(self.policy.simplify_tolerance)
         while len(self.blackbox.queue) > 0:
+            if self.batch_size > 1:
+                self.send_batch()
+                continue
             for rec in self.blackbox.peek(1):
                 # body = rec.full
                 body = rec # TODO: raw msg
@@ -152,6 +183,19 @@ class Device:
                     if code == "1":
                         self.blackbox.confirm(1)
 
+    def send_batch(self):
+        recs = self.blackbox.peek(self.batch_size)
+        body = "".join((rec[:-1] if rec.endswith(";") else rec) + "|" for rec in recs)
+        packet = BLACKBOX_QUERY_FMT.format(
+            body=body,
+            crc=crc(body.encode(ENCODING))
+        ).encode(ENCODING)
+        if self.compress_threshold is not None and len(packet) > self.compress_threshold:
+            packet = compress(packet)
+        self.send(packet)
+        if match := self.wait_resp(BLACKBOX_ANSWER_REGEX, timeout=1):
+            self.blackbox.confirm(int(match.group(1)))
+
     def write_loop(self):
         while self.socket:
             try:
@@ -188,10 +232,20 @@ class Device:
             return stop_event  # Allows stopping the thread if needed
 
         def random_param1():
-            observer.upd_param('param1', random.randrange(1, 10))
-
-        stop_t1 = repeat_task(5, observer.upd_positional, *device.coords)
-        stop_t2 = repeat_task(10, observer.event)
+            self.observer.upd_param('param1', random.randrange(1, 10))
+
+        def report_position():
+            fix = geo.get()
+            ts, lat, lon, speed, course = fix[:5]
+            if self.policy.should_report(time.time() if ts is None else ts, lat, lon, speed, course):
+                self.observer.upd_positional(*self._coords(*fix))
+                self.observer.event()
+
+        if self.policy is None:
+            stop_t1 = repeat_task(5, lambda: self.observer.upd_positional(*self.coords))
+            stop_t2 = repeat_task(10, self.observer.event)
+        else:
+            stop_t1 = repeat_task(self.policy.sample_interval, report_position)
         stop_t3 = repeat_task(15, random_param1)
 
     def run_poling(self):
@@ -222,9 +276,10 @@ if __name__ == '__main__':
         priority=Priority.HIGH,
         event_only=True
     )
+    observer = observer.compile()
     observer.upd_positional(ibutton="wispdriver")
     blackbox = BlackBox()
-    device = Device(observer, blackbox)
+    device = Device(observer, blackbox, ReportingPolicy(simplify_tolerance=20))
 
     try:
         device.run_poling()
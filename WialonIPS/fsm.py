@@ -73,6 +73,18 @@ def _str(i):
     return 'NA' if i is None else str(i)
 
 
+def _type(v):
+    if isinstance(v, int):
+        return 1
+    elif isinstance(v, float):
+        return 2
+    return 3
+
+
+def _param(k, v):
+    return f'{k}:{_type(v)}:{_str(v)}'
+
+
 @dataclass(order=True)
 class Record:
     priority: Priority = Priority.LOW
@@ -80,27 +92,27 @@ class Record:
     io: tuple[int, int] = 0
     adc: list[float] = field(default_factory=list)
     params: dict[str, Any] = field(default_factory=dict)
-    
+    # wire bodies pre-encoded by CompiledIOObserver
+    _short: Optional[str] = field(default=None, repr=False, compare=False)
+    _full: Optional[str] = field(default=None, repr=False, compare=False)
+
     @property
     def short(self):
+        if self._short is not None:
+            return self._short
         return ";".join(_str(i) for i in tuple(self.positional.values())[:10]) + ";"
         
     @property
     def full(self):
-        
-        def t(v):
-            if isinstance(v, int):
-                return 1
-            elif isinstance(v, float):
-                return 2
-            return 3
+        if self._full is not None:
+            return self._full
 
         positional = ";".join(_str(i) for i in tuple(self.positional.values())[:10])
         hdop = _str(self.positional.get('hdop'))
         ibutton = _str(self.positional.get('ibutton'))
         io = ";".join(_str(i) for i in self.io)
         adc = ",".join(_str(i) for i in self.adc) if self.adc else _str(None)
-        par = ",".join(f'{k}:{t(v)}:{_str(v)}' for k, v in self.params.items())
+        par = ",".join(_param(k, v) for k, v in self.params.items())
 
         return ";".join((
             positional,
@@ -183,6 +195,47 @@ def els2bitmask(els):
     return bitmask
 
 
+def iter_bits(mask):
+    """Yields indexes of the set bits of `mask`, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Bitmask:
+    """Packed state of a list of binary IOElements, kept in sync on update."""
+
+    __slots__ = ("mask", "unset", "size")
+
+    def __init__(self, els=()):
+        self.reset(els)
+
+    def reset(self, els):
+        self.size = len(els)
+        self.mask = els2bitmask(els)
+        self.unset = 0  # bits whose element has no value yet
+        for i, el in enumerate(els):
+            if el.value is None:
+                self.unset |= 1 << i
+
+    def set(self, bit, value):
+        b = 1 << bit
+        if value is None:
+            self.unset |= b
+            self.mask &= ~b
+            return
+        self.unset &= ~b
+        if value > 0:
+            self.mask |= b
+        else:
+            self.mask &= ~b
+
+    def changed(self, mask):
+        """Bits a per-bit update to `mask` could change."""
+        return ((mask ^ self.mask) | self.unset) & ((1 << self.size) - 1)
+
+
 def not_event_only(els):
     return [el for el in els if not el.event_only]
 
@@ -196,6 +249,7 @@ class IOObserver:
     params: dict[str, IOElement] = field(init=False, default_factory=dict)
 
     _evt_only: list[IOElement] = field(init=False)
+    _bits: tuple[Bitmask, Bitmask] = field(init=False, default_factory=lambda: (Bitmask(), Bitmask()))
 
     on_event: Optional[Callable[[Record], None]] = None
 
@@ -231,35 +285,53 @@ class IOObserver:
         if callable(self.on_event):
             self.on_event(record)
 
+    def _packed(self, i):
+        els = self.outputs if i else self.inputs
+        bits = self._bits[i]
+        if bits.size != len(els):  # elements were added or removed
+            bits.reset(els)
+        return bits
+
     @property
     def io(self):
         if self.inputs:
-            inp = els2bitmask(self.inputs)
+            inp = self._packed(0).mask
         else:
             inp = None
         if self.outputs:
-            out = els2bitmask(self.outputs)
+            out = self._packed(1).mask
         else:
             out = None
         return inp, out
 
-    def upd_input(self, bit, v):
-        if 0 <= bit <= len(self.inputs):
-            el = self.inputs[bit]
+    def _upd_bit(self, i, bit, v):
+        els = self.outputs if i else self.inputs
+        if 0 <= bit < len(els):
+            bits = self._packed(i)
+            el = els[bit]
             if el.priority is Priority.NONE:
                 return
 
-            if el.upd(v) and el.priority > Priority.LOW:
+            triggered = el.upd(v)
+            bits.set(bit, el.value)
+            if triggered and el.priority > Priority.LOW:
                 self.event(el.priority)
 
+    def upd_input(self, bit, v):
+        self._upd_bit(0, bit, v)
+
     def upd_output(self, bit, v):
-        if 0 <= bit <= len(self.outputs):
-            el = self.outputs[bit]
-            if el.priority is Priority.NONE:
-                return
+        self._upd_bit(1, bit, v)
 
-            if el.upd(v) and el.priority > Priority.LOW:
-                self.event(el.priority)
+    def upd_inputs_mask(self, mask):
+        """Same as `upd_input` for every changed bit of `mask`, lowest first."""
+        for bit in iter_bits(self._packed(0).changed(mask)):
+            self._upd_bit(0, bit, (mask >> bit) & 1)
+
+    def upd_outputs_mask(self, mask):
+        """Same as `upd_output` for every changed bit of `mask`, lowest first."""
+        for bit in iter_bits(self._packed(1).changed(mask)):
+            self._upd_bit(1, bit, (mask >> bit) & 1)
 
     def upd_adc(self, idx, v):
         if 0 <= idx <= len(self.adc):
@@ -303,16 +375,14 @@ class IOObserver:
             
     def upd_positional(self, *args, **kwargs):
         priority = Priority.LOW
+        els = tuple(self.positional.values())
         
-        for i, v in enumerate(args):
-            if 0 <= i < len(self.positional.values()):
-                
-                el = tuple(self.positional.values())[i]
-                
-                el.upd(v)
-                
-                if el.priority > priority:
-                    priority = el.priority
+        for el, v in zip(els, args):
+            
+            el.upd(v)
+            
+            if el.priority > priority:
+                priority = el.priority
         
         for key, v in kwargs.items():
             if key in self.positional:
@@ -326,6 +396,302 @@ class IOObserver:
         if priority > Priority.LOW:
             self.event(priority)
 
+    def compile(self):
+        """Returns a slot-indexed observer over the current element layout."""
+        return CompiledIOObserver(self)
+
+
+class CompiledIOObserver:
+    """IOObserver with fixed integer slots for every element.
+
+    Positional, input, output, ADC and param elements are laid out in one
+    flat array; updates write the new value into its slot and mark it dirty,
+    and `event()` rebuilds only the parts of the record whose slots changed.
+    Each slot also keeps its encoded wire fragment, so the record body is a
+    join of cached strings rather than a re-stringification of every field.
+    The element layout and the operands and priorities of positional elements
+    are frozen at compile time, call `IOObserver.compile()` again after
+    changing them.
+    """
+
+    def __init__(self, observer: IOObserver):
+        self.positional = observer.positional
+        self.inputs = observer.inputs
+        self.outputs = observer.outputs
+        self.adc = observer.adc
+        self.params = observer.params
+        self.on_event = observer.on_event
+
+        els = list(self.positional.values())
+        self._inp0 = len(els)
+        els.extend(self.inputs)
+        self._out0 = len(els)
+        els.extend(self.outputs)
+        self._adc0 = len(els)
+        els.extend(self.adc)
+        self._par0 = len(els)
+        els.extend(self.params.values())
+
+        self._els = els
+        self._values = [el.value for el in els]
+        self._pos_keys = tuple(self.positional)
+        self._pos_slots = {k: i for i, k in enumerate(self._pos_keys)}
+        self._par_keys = tuple(self.params)
+        self._par_slots = {k: self._par0 + i for i, k in enumerate(self._par_keys)}
+        self._pos_monitored = tuple(el.operand is Operand.MONITORING for el in self.positional.values())
+        # highest priority among the first n positional elements
+        self._pos_priority = [Priority.LOW]
+        for el in self.positional.values():
+            self._pos_priority.append(max(self._pos_priority[-1], el.priority))
+        self._hdop_slot = self._pos_slots.get('hdop')
+        self._ibutton_slot = self._pos_slots.get('ibutton')
+        # params that can get into a record: (slot, key, event_only)
+        self._reported = tuple(
+            (self._par0 + i, k, el.event_only)
+            for i, (k, el) in enumerate(self.params.items())
+            if el.priority > Priority.NONE
+        )
+
+        self._in_bits = Bitmask(self.inputs)
+        self._out_bits = Bitmask(self.outputs)
+
+        self._dirty = set(range(len(els)))
+        self._evt_only = set()
+        self._positional = None
+        self._io = None
+        self._adc = None
+
+        # encoded fragments, None while stale
+        self._frags = [None] * len(els)
+        self._pos_wire = None
+        self._io_wire = None
+        self._adc_wire = None
+        self._par_wire = None  # params without the event-only ones
+
+    def clear_event(self):
+        self._evt_only.clear()
+
+    def _upd(self, slot, v):
+        values = self._values
+        if v == values[slot]:
+            return False  # the element holds `v` already, its upd() could not trigger
+        el = self._els[slot]
+        triggered = el.upd(v)
+        if el.value != values[slot]:
+            values[slot] = el.value
+            self._dirty.add(slot)
+            if self._inp0 <= slot < self._out0:
+                self._in_bits.set(slot - self._inp0, el.value)
+            elif self._out0 <= slot < self._adc0:
+                self._out_bits.set(slot - self._out0, el.value)
+        return triggered
+
+    def _flush(self):
+        """Drops cached record parts whose slots changed since the last event."""
+        frags = self._frags
+        for slot in self._dirty:
+            frags[slot] = None
+            if slot < self._inp0:
+                self._positional = None
+                self._pos_wire = None
+            elif slot < self._adc0:
+                self._io = None
+                self._io_wire = None
+            elif slot < self._par0:
+                self._adc = None
+                self._adc_wire = None
+            else:
+                self._par_wire = None
+        self._dirty.clear()
+
+    def _frag(self, slot):
+        frag = self._frags[slot]
+        if frag is None:
+            v = self._values[slot]
+            if slot < self._par0:
+                frag = _str(v)
+            else:
+                frag = _param(self._par_keys[slot - self._par0], v)
+            self._frags[slot] = frag
+        return frag
+
+    def _encode(self, evt):
+        """Returns (short, full) wire bodies joined from cached fragments."""
+        frag = self._frag
+
+        if self._pos_wire is None:
+            self._pos_wire = ";".join([frag(i) for i in range(min(10, self._inp0))])
+        if self._io_wire is None:
+            self._io_wire = ";".join(_str(i) for i in self._io)
+        if self._adc_wire is None:
+            if self._par0 > self._adc0:
+                self._adc_wire = ",".join([frag(i) for i in range(self._adc0, self._par0)])
+            else:
+                self._adc_wire = _str(None)
+        if self._par_wire is None:
+            self._par_wire = ",".join([frag(slot) for slot, _, event_only in self._reported if not event_only])
+
+        if evt:
+            par = ",".join([frag(slot) for slot, _, event_only in self._reported if not event_only or slot in evt])
+        else:
+            par = self._par_wire
+
+        hdop = _str(None) if self._hdop_slot is None else frag(self._hdop_slot)
+        ibutton = _str(None) if self._ibutton_slot is None else frag(self._ibutton_slot)
+
+        full = ";".join((
+            self._pos_wire,
+            hdop,
+            self._io_wire,
+            self._adc_wire,
+            ibutton,
+            par
+        )) + ";"
+        return self._pos_wire + ";", full
+
+    def event(self, priority=Priority.LOW):
+        self._flush()
+        values = self._values
+
+        if self._positional is None:
+            self._positional = dict(zip(self._pos_keys, values))
+        if self._io is None:
+            self._io = self._masks()
+        if self._adc is None:
+            self._adc = values[self._adc0:self._par0]
+
+        evt = self._evt_only
+        short, full = self._encode(evt)
+        record = Record(
+            priority,
+            self._positional,
+            self._io,
+            self._adc,
+            {k: values[slot] for slot, k, event_only in self._reported if not event_only or slot in evt},
+            short,
+            full,
+        )
+        self.clear_event()
+
+        if callable(self.on_event):
+            self.on_event(record)
+
+    def _masks(self):
+        return (
+            self._in_bits.mask if self.inputs else None,
+            self._out_bits.mask if self.outputs else None,
+        )
+
+    @property
+    def io(self):
+        return self._masks()  # the bitmasks follow every update, only records need the flush
+
+    def _upd_indexed(self, slot, v):
+        el = self._els[slot]
+        if el.priority is Priority.NONE:
+            return
+
+        if self._upd(slot, v) and el.priority > Priority.LOW:
+            self.event(el.priority)
+
+    def upd_input(self, bit, v):
+        if 0 <= bit < len(self.inputs):
+            self._upd_indexed(self._inp0 + bit, v)
+
+    def upd_output(self, bit, v):
+        if 0 <= bit < len(self.outputs):
+            self._upd_indexed(self._out0 + bit, v)
+
+    def _upd_mask(self, base, bits, mask):
+        els, values = self._els, self._values
+        for bit in iter_bits(bits.changed(mask)):
+            slot = base + bit
+            el = els[slot]
+            if el.priority is Priority.NONE:
+                continue
+            triggered = el.upd((mask >> bit) & 1)
+            if el.value != values[slot]:
+                values[slot] = el.value
+                self._dirty.add(slot)
+                bits.set(bit, el.value)
+            if triggered and el.priority > Priority.LOW:
+                self.event(el.priority)
+
+    def upd_inputs_mask(self, mask):
+        """Same as `upd_input` for every changed bit of `mask`, lowest first."""
+        self._upd_mask(self._inp0, self._in_bits, mask)
+
+    def upd_outputs_mask(self, mask):
+        """Same as `upd_output` for every changed bit of `mask`, lowest first."""
+        self._upd_mask(self._out0, self._out_bits, mask)
+
+    def upd_adc(self, idx, v):
+        if 0 <= idx < len(self.adc):
+            self._upd_indexed(self._adc0 + idx, v)
+
+    def upd_param(self, key, v):
+        slot = self._par_slots.get(key)
+        if slot is None:
+            return
+        el = self._els[slot]
+        if el.priority is Priority.NONE:
+            return
+
+        if self._upd(slot, v):
+            if el.event_only:
+                self._evt_only.add(slot)
+
+            if el.priority > Priority.LOW:
+                self.event(el.priority)
+
+    def upd_params(self, **kwargs):
+        priority = Priority.NONE
+        for key, v in kwargs.items():
+            slot = self._par_slots.get(key)
+            if slot is None:
+                continue
+            el = self._els[slot]
+            if el.priority is Priority.NONE:
+                continue
+
+            if self._upd(slot, v):
+                if el.event_only:
+                    self._evt_only.add(slot)
+
+            if el.priority > priority:
+                priority = el.priority
+
+        if priority > Priority.LOW:
+            self.event(priority)
+
+    def upd_positional(self, *args, **kwargs):
+        n = min(len(args), self._inp0)
+        values, els, frags, monitored = self._values, self._els, self._frags, self._pos_monitored
+        changed = False
+        for slot, v, held in zip(range(n), args, values):
+            if v == held:  # most fields of a fix repeat the last one
+                continue
+            if monitored[slot]:  # upd() would only store it
+                els[slot].value = values[slot] = v
+                frags[slot] = None
+                changed = True
+            else:
+                self._upd(slot, v)
+        if changed:
+            self._positional = None
+            self._pos_wire = None
+        priority = self._pos_priority[n]
+
+        for key, v in kwargs.items():
+            slot = self._pos_slots.get(key)
+            if slot is not None:
+                self._upd(slot, v)
+                if self._els[slot].priority > priority:
+                    priority = self._els[slot].priority
+
+        if priority > Priority.LOW:
+            self.event(priority)
+
 
 if __name__ == "__main__":
     o = IOObserver(on_event=print)
@@ -352,3 +718,76 @@ if __name__ == "__main__":
     o.upd_positional(220225)
     o.event()
 
+    import time
+
+    def best(run, make, repeat=5):
+        """Lowest us/op of `repeat` runs, each on a fresh observer from `make`."""
+        return min(run(make()) for _ in range(repeat))
+
+    def compare(label, run, make):
+        plain = best(run, make)
+        compiled = best(run, lambda: make().compile())
+        print(f"{label:34}: IOObserver {plain:5.1f} us, CompiledIOObserver {compiled:5.1f} us, "
+              f"{plain / compiled:.1f}x")
+
+    def bench_update(observer, n=10_000):
+        observer.on_event = None
+        t = time.perf_counter()
+        for i in range(n):
+            observer.upd_positional("220225", f"{i:06d}", "5027.282", "N", "03031.428", "E", i % 90, i % 360, 100, 7)
+            observer.upd_input(i % 32, i & 1)
+            observer.upd_param("param1", i % 5)
+            if i % 10 == 0:
+                observer.event()
+        return (time.perf_counter() - t) * 1e6 / n
+
+    def io_observer():
+        observer = IOObserver()
+        observer.outputs.extend(IOElement() for _ in range(32))
+        observer.inputs.extend(IOElement() for _ in range(32))
+        observer.adc.extend(IOElement() for _ in range(2))
+        for i in range(2):
+            observer.params[f"param{i + 1}"] = IOElement(priority=Priority.LOW)
+        return observer
+
+    compare("fix + input + param, update", bench_update, io_observer)
+
+    def bench_encoding(observer, n=10_000):
+        bodies = []
+        observer.on_event = lambda r: bodies.append(r.full)
+        t = time.perf_counter()
+        for i in range(n):
+            observer.upd_positional("220225", f"{i:06d}", f"5027.{i % 1000:03d}", "N", "03031.428", "E")
+            observer.upd_params(p0=i % 7, p1=float(i % 3))
+            observer.event()
+        return (time.perf_counter() - t) * 1e6 / n
+
+    def params_observer():
+        observer = IOObserver()
+        for i in range(50):
+            observer.params[f"p{i}"] = IOElement(value=i * 1.5 if i % 2 else i, priority=Priority.LOW)
+        return observer
+
+    compare("50 params, encoded record", bench_encoding, params_observer)
+
+    def bench_mask(observer, bulk, n=10_000):
+        observer.on_event = None
+        t = time.perf_counter()
+        for i in range(n):
+            mask = (i * 2654435761) & 0x10F  # a few inputs toggling
+            if bulk:
+                observer.upd_inputs_mask(mask)
+            else:
+                for bit in range(32):
+                    observer.upd_input(bit, (mask >> bit) & 1)
+            observer.io
+        return (time.perf_counter() - t) * 1e6 / n
+
+    def inputs_observer():
+        observer = IOObserver()
+        observer.inputs.extend(IOElement(value=0, priority=Priority.LOW, operand=Operand.ON_CHANGE)
+                               for _ in range(32))
+        return observer
+
+    compare("32 inputs, register read per bit", lambda o: bench_mask(o, False), inputs_observer)
+    compare("32 inputs, register read as mask", lambda o: bench_mask(o, True), inputs_observer)
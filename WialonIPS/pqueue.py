@@ -0,0 +1,117 @@
+from collections import deque
+from dataclasses import dataclass
+
+from fsm import Priority
+
+
+@dataclass
+class PrioritizedRecord:
+    priority: int
+    timestamp: int
+    # record: Record
+    record: str  # TODO: raw msg
+
+
+class BucketQueue:
+    """Priority queue with one FIFO deque per `Priority` level.
+
+    Records come out highest priority first, oldest first within a level.
+    Push and pop are O(1), ordered peek of k records is O(k).
+    """
+
+    def __init__(self, levels=len(Priority)):
+        self._buckets = [deque() for _ in range(levels)]
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        for bucket in reversed(self._buckets):
+            yield from bucket
+
+    def bucket(self, priority):
+        return self._buckets[priority]
+
+    def push(self, r: PrioritizedRecord):
+        self._buckets[r.priority].append(r)
+        self._len += 1
+
+    def peek(self, n=1):
+        out = []
+        for bucket in reversed(self._buckets):
+            for r in bucket:
+                if len(out) >= n:
+                    return out
+                out.append(r)
+        return out
+
+    def pop(self, n=1):
+        out = []
+        for bucket in reversed(self._buckets):
+            while bucket and len(out) < n:
+                out.append(bucket.popleft())
+            if len(out) >= n:
+                break
+        self._len -= len(out)
+        return out
+
+    def pop_lowest(self):
+        """Removes the oldest record of the lowest non-empty priority."""
+        for bucket in self._buckets:
+            if bucket:
+                self._len -= 1
+                return bucket.popleft()
+        raise IndexError("pop from empty queue")
+
+    def replace(self, priority, records):
+        bucket = self._buckets[priority]
+        self._len += len(records) - len(bucket)
+        bucket.clear()
+        bucket.extend(records)
+
+
+if __name__ == "__main__":
+    import heapq
+    import random
+    import time
+    from dataclasses import field
+
+    @dataclass(order=True)
+    class HeapRecord:
+        priority: int
+        timestamp: int
+        record: str = field(compare=False)
+
+    N, K = 100_000, 50
+    samples = [(random.choice(list(Priority)), i, f"rec{i}") for i in range(N)]
+
+    t = time.perf_counter()
+    heap = []
+    for p, ts, rec in samples:
+        heapq.heappush(heap, HeapRecord(-p, ts, rec))
+    push_heap = time.perf_counter() - t
+    t = time.perf_counter()
+    while heap:
+        heapq.nsmallest(K, heap)
+        for _ in range(min(K, len(heap))):
+            heapq.heappop(heap)
+    drain_heap = time.perf_counter() - t
+
+    t = time.perf_counter()
+    q = BucketQueue()
+    for p, ts, rec in samples:
+        q.push(PrioritizedRecord(p, ts, rec))
+    push_bucket = time.perf_counter() - t
+    t = time.perf_counter()
+    while q:
+        q.peek(K)
+        q.pop(K)
+    drain_bucket = time.perf_counter() - t
+
+    print(f"{N} records, batches of {K}")
+    print(f"heapq:  push {push_heap * 1e6 / N:.2f} us/rec, peek+confirm {drain_heap * 1e6 / N:.2f} us/rec")
+    print(f"bucket: push {push_bucket * 1e6 / N:.2f} us/rec, peek+confirm {drain_bucket * 1e6 / N:.2f} us/rec")
@@ -0,0 +1,173 @@
+import math
+from dataclasses import dataclass, field
+from typing import Optional
+
+EARTH_RADIUS = 6371008.8  # meters, same as _wialonips.utils, the firmware does not import the server
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two decimal coordinates."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def heading_delta(a, b):
+    """Smallest angle in degrees between two courses."""
+    d = abs(a - b) % 360
+    return 360 - d if d > 180 else d
+
+
+def ddmm2dec(ddmm, sign):
+    """Convert DDMM.MM / DDDMM.MM with a literal sign back to decimal degrees."""
+    if not ddmm or ddmm == "NA" or sign not in ("N", "S", "E", "W"):
+        return None
+    deg_len = 2 if sign in "NS" else 3
+    try:
+        value = int(ddmm[:deg_len]) + float(ddmm[deg_len:]) / 60
+    except ValueError:
+        return None
+    return -value if sign in "SW" else value
+
+
+def record_coords(record):
+    """Returns (lat, lon) of an encoded record body or None."""
+    fields = record.split(";", 6)
+    if len(fields) < 6:
+        return None
+    lat = ddmm2dec(fields[2], fields[3])
+    lon = ddmm2dec(fields[4], fields[5])
+    if lat is None or lon is None:
+        return None
+    return lat, lon
+
+
+def _offset(origin, point):
+    """Local equirectangular projection of `point` around `origin`, meters."""
+    lat0, lon0 = origin
+    lat, lon = point
+    x = math.radians(lon - lon0) * math.cos(math.radians((lat + lat0) / 2)) * EARTH_RADIUS
+    y = math.radians(lat - lat0) * EARTH_RADIUS
+    return x, y
+
+
+def _segment_distance(p, a, b):
+    px, py = _offset(a, p)
+    bx, by = _offset(a, b)
+    length = bx * bx + by * by
+    if length == 0:
+        return math.hypot(px, py)
+    t = max(0.0, min(1.0, (px * bx + py * by) / length))
+    return math.hypot(px - t * bx, py - t * by)
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker over (lat, lon) points, returns the indexes to keep."""
+    n = len(points)
+    if n < 3:
+        return list(range(n))
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        lo, hi = stack.pop()
+        index, dmax = None, tolerance
+        for i in range(lo + 1, hi):
+            d = _segment_distance(points[i], points[lo], points[hi])
+            if d > dmax:
+                index, dmax = i, d
+        if index is not None:
+            keep[index] = True
+            stack.append((lo, index))
+            stack.append((index, hi))
+    return [i for i in range(n) if keep[i]]
+
+
+@dataclass
+class ReportingPolicy:
+    """Decides which position samples are worth sending.
+
+    A sample is reported when any threshold against the last reported one
+    is crossed: elapsed time, travelled distance, course change or speed
+    change. Nothing is reported more often than `min_interval`, and a
+    heartbeat goes out every `max_interval` even when parked. With a
+    `simplify_tolerance` the device also thins the queued track before it
+    uploads the backlog.
+    """
+    sample_interval: float = 1  # how often the monitor reads the position, s
+    min_interval: float = 5  # s
+    max_interval: float = 300  # s
+    distance: float = 100  # m
+    heading: float = 15  # deg
+    speed: float = 10  # speed units of the position source
+    heading_min_speed: float = 5  # course is noise below this speed
+    simplify_tolerance: float = 0  # m, Douglas-Peucker over the backlog before an upload, 0 = off
+
+    _last: Optional[tuple] = field(init=False, default=None)
+
+    def reset(self):
+        self._last = None
+
+    def should_report(self, ts, lat=None, lon=None, speed=None, course=None):
+        if self._check(ts, lat, lon, speed, course):
+            self._last = (ts, lat, lon, speed, course)
+            return True
+        return False
+
+    def _check(self, ts, lat, lon, speed, course):
+        if self._last is None:
+            return True
+        last_ts, last_lat, last_lon, last_speed, last_course = self._last
+
+        elapsed = ts - last_ts
+        if elapsed < self.min_interval:
+            return False
+        if elapsed >= self.max_interval:
+            return True
+
+        if None not in (lat, lon, last_lat, last_lon):
+            if haversine(last_lat, last_lon, lat, lon) >= self.distance:
+                return True
+
+        if speed is not None and last_speed is not None:
+            if abs(speed - last_speed) >= self.speed:
+                return True
+
+            if (course is not None and last_course is not None
+                    and speed >= self.heading_min_speed
+                    and heading_delta(course, last_course) >= self.heading):
+                return True
+
+        return False
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    # parked for 10 min, then driving a straight road with a turn
+    samples = []
+    ts, lat, lon = 0, 50.45, 30.52
+    for _ in range(600):
+        samples.append((ts, lat + random.gauss(0, 2e-5), lon + random.gauss(0, 2e-5), 0, random.randrange(360)))
+        ts += 1
+    for i in range(600):
+        course = 90 if i < 300 else 0
+        lat += 0 if course == 90 else 0.00025
+        lon += 0.0004 if course == 90 else 0
+        samples.append((ts, lat, lon, 60 + random.randrange(-3, 4), course))
+        ts += 1
+
+    policy = ReportingPolicy()
+    t = time.perf_counter()
+    reported = [s for s in samples if policy.should_report(*s)]
+    elapsed = time.perf_counter() - t
+    print(f"policy: {len(reported)}/{len(samples)} samples reported, {elapsed * 1e6 / len(samples):.1f} us/sample")
+
+    points = [(s[1], s[2]) for s in reported]
+    t = time.perf_counter()
+    kept = simplify(points, 20)  # the tolerance ReportingPolicy(simplify_tolerance=20) would use
+    elapsed = time.perf_counter() - t
+    print(f"simplify(20 m): {len(kept)}/{len(points)} points kept, {elapsed * 1e3:.2f} ms")
@@ -0,0 +1,263 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+from _wialonips.dedup import message_key
+from _wialonips.protocol import DevPacket
+from _wialonips.utils import epoch_seconds, haversine
+
+BUCKET = 3600  # s of device time per aggregate
+MAX_GAP = 300  # s between two messages above which the gap is not counted as time on
+IDLE_SPEED = 3  # km/h, slower with the ignition on is idling
+IGNITION_BIT = 0  # input carrying the ignition, engine hours are its on-duration
+EXPORT_INTERVAL = 60  # s between two snapshot exports
+
+
+class Bucket:
+    """Aggregates of one device over one bucket of device time."""
+    __slots__ = ("start", "messages", "distance", "speed_max", "speed_sum", "speed_count",
+                 "idle", "inputs_on", "adc_min", "adc_max")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.messages = 0
+        self.distance = 0.0  # m
+        self.speed_max = 0
+        self.speed_sum = 0
+        self.speed_count = 0
+        self.idle = 0.0  # s
+        self.inputs_on: Dict[int, float] = {}  # input bit -> s
+        self.adc_min: Dict[int, float] = {}  # ADC channel index -> value
+        self.adc_max: Dict[int, float] = {}
+
+    def snapshot(self, imei: str, length: int, complete: bool) -> dict:
+        return {
+            "imei": imei,
+            "start": self.start,
+            "end": self.start + length,
+            "complete": complete,
+            "messages": self.messages,
+            "distance": round(self.distance, 1),
+            "speed_max": self.speed_max,
+            "speed_avg": self.speed_sum / self.speed_count if self.speed_count else None,
+            "idle": self.idle,
+            "inputs_on": dict(self.inputs_on),
+            "adc_min": dict(self.adc_min),
+            "adc_max": dict(self.adc_max),
+        }
+
+
+class _Device:
+    __slots__ = ("ts", "key", "pos", "speed", "inputs", "bucket", "closed", "dirty", "late", "repeated")
+
+    def __init__(self):
+        self.ts: Optional[float] = None
+        self.key: Optional[int] = None  # message key of the last message
+        self.pos = None
+        self.speed = None
+        self.inputs = 0
+        self.bucket: Optional[Bucket] = None
+        self.closed: List[Bucket] = []  # completed buckets not exported yet
+        self.dirty = False
+        self.late = 0  # messages older than the last one, left out
+        self.repeated = 0  # copies of the last message, left out
+
+
+class Aggregator:
+    """Streaming aggregates per device and bucket of device time.
+
+    Each message updates the device's current bucket in constant time from
+    the state the previous message left: distance from the two positions,
+    input on-durations and idle time from how long the previous state
+    lasted (not across gaps over `max_gap`), max/avg speed and ADC min/max
+    from the message itself. Messages older than the device's last one
+    (a late #B#) are left out, their deltas are unknown, and so is a copy
+    of the last one that the device resent.
+
+    `export` writes a snapshot of every bucket that changed to a sink, at
+    most every `interval` seconds unless forced; completed buckets are
+    written once more with "complete" set.
+    """
+
+    def __init__(self, bucket: int = BUCKET, max_gap: float = MAX_GAP, idle_speed: float = IDLE_SPEED,
+                 ignition_bit: int = IGNITION_BIT, interval: float = EXPORT_INTERVAL):
+        self.bucket = bucket
+        self.max_gap = max_gap
+        self.idle_speed = idle_speed
+        self.ignition_bit = ignition_bit
+        self.interval = interval
+        self._devices: Dict[str, _Device] = {}
+        self._lock = threading.Lock()
+        self._next_export = time.monotonic() + interval
+
+    def update(self, imei: str, packet: DevPacket):
+        ts = self._timestamp(packet)
+        try:
+            pos = packet.pos
+        except ValueError:  # malformed coordinates
+            pos = None
+        speed = packet.speed if isinstance(packet.speed, (int, float)) else None
+        inputs = packet.inputs if isinstance(packet.inputs, int) else None
+        adc = packet.adc if isinstance(packet.adc, list) else ()  # a string that did not parse
+        key = message_key(imei, packet)
+        with self._lock:
+            device = self._devices.get(imei)
+            if device is None:
+                device = self._devices[imei] = _Device()
+            if device.ts is not None and ts <= device.ts:
+                if ts < device.ts:
+                    device.late += 1
+                    return
+                if key is not None and key == device.key:
+                    device.repeated += 1
+                    return
+
+            start = int(ts) - int(ts) % self.bucket
+            bucket = device.bucket
+            if bucket is None or bucket.start != start:
+                if bucket is not None:
+                    device.closed.append(bucket)
+                bucket = device.bucket = Bucket(start)
+
+            if device.ts is not None:
+                elapsed = ts - device.ts
+                if elapsed <= self.max_gap:
+                    mask = device.inputs
+                    while mask:  # the inputs that were on until now
+                        low = mask & -mask
+                        bit = low.bit_length() - 1
+                        bucket.inputs_on[bit] = bucket.inputs_on.get(bit, 0.0) + elapsed
+                        mask ^= low
+                    if device.inputs >> self.ignition_bit & 1 and (device.speed or 0) < self.idle_speed:
+                        bucket.idle += elapsed
+                if pos is not None and device.pos is not None:
+                    bucket.distance += haversine(device.pos[0], device.pos[1], pos[0], pos[1])
+
+            bucket.messages += 1
+            if speed is not None:
+                if speed > bucket.speed_max:
+                    bucket.speed_max = speed
+                bucket.speed_sum += speed
+                bucket.speed_count += 1
+            for i, value in enumerate(adc):
+                if not isinstance(value, (int, float)):
+                    continue  # NA on this channel, the others keep their index
+                if i not in bucket.adc_min:
+                    bucket.adc_min[i] = bucket.adc_max[i] = value
+                elif value < bucket.adc_min[i]:
+                    bucket.adc_min[i] = value
+                elif value > bucket.adc_max[i]:
+                    bucket.adc_max[i] = value
+
+            device.ts = ts
+            device.key = key
+            if pos is not None:
+                device.pos = pos
+            if speed is not None:
+                device.speed = speed
+            if inputs is not None:
+                device.inputs = inputs
+            device.dirty = True
+
+    def snapshot(self, imei: str) -> Optional[dict]:
+        """Current bucket of `imei`."""
+        with self._lock:
+            device = self._devices.get(imei)
+            if device is None or device.bucket is None:
+                return None
+            return device.bucket.snapshot(imei, self.bucket, False)
+
+    def export(self, sink, force: bool = False) -> int:
+        """Writes the changed buckets to `sink.write_snapshot`, returns how many.
+
+        When the sink raises, the buckets stay pending for the next export.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_export:
+            return 0
+        self._next_export = now + self.interval
+        snapshots = []
+        exported = []  # (device, closed buckets written, was dirty)
+        with self._lock:
+            for imei, device in self._devices.items():
+                if not device.closed and not device.dirty:
+                    continue
+                for bucket in device.closed:
+                    snapshots.append(bucket.snapshot(imei, self.bucket, True))
+                if device.dirty:
+                    snapshots.append(device.bucket.snapshot(imei, self.bucket, False))
+                exported.append((device, len(device.closed), device.dirty))
+                device.dirty = False  # an update while the sink writes sets it again
+        try:
+            for snapshot in snapshots:
+                sink.write_snapshot(snapshot["imei"], snapshot)
+        except Exception:
+            with self._lock:
+                for device, _, dirty in exported:
+                    device.dirty = device.dirty or dirty
+            raise
+        with self._lock:
+            for device, closed, _ in exported:
+                del device.closed[:closed]  # buckets closed meanwhile stay
+        return len(snapshots)
+
+    @staticmethod
+    def _timestamp(packet: DevPacket) -> float:
+        """Device time in s since the epoch, the arrival time for a message without one."""
+        if not packet.date or not packet.time:
+            return time.time()
+        try:
+            return epoch_seconds(packet.date, packet.time)
+        except ValueError:
+            return time.time()
+
+
+if __name__ == "__main__":
+    import math
+    import random
+    from datetime import datetime, timedelta
+
+    from _wialonips.decoder import create_decoder
+    from _wialonips.protocol import Protocol
+    from _wialonips.sink import MemorySink
+
+    protocol = Protocol()
+    decoder = create_decoder("2.0")
+    start = datetime(2025, 2, 24, 0, 0, 0)
+    lat, lon, engine = 50.45, 30.52, False
+    history = []
+    for i in range(8640):  # a day at one message per 10 s
+        if i % 360 == 0:
+            engine = not engine
+        speed = random.randint(0, 90) if engine and i % 7 else 0
+        lat += speed / 3.6 * 10 / 111_320 * math.cos(i / 500)
+        lon += speed / 3.6 * 10 / 71_000 * math.sin(i / 500)
+        history.append(decoder.decode(protocol.build_data_packet(
+            date_time=start + timedelta(seconds=10 * i), lat=lat, lon=lon, speed=speed, course=90, alt=150,
+            sats=9, hdop=1.0, inputs=0b101 if engine else 0b100, outputs=0,
+            adc=[round(random.uniform(11.5, 14.4), 2), 0.0], ibutton="NA")))
+
+    aggregator = Aggregator()
+    t = time.perf_counter()
+    for packet in history:
+        aggregator.update("1", packet)
+    per_message = (time.perf_counter() - t) / len(history)
+    sink = MemorySink()
+    aggregator.export(sink, force=True)
+    day = [snapshot for _, snapshot in sink.snapshots]
+    hours = sum(s["inputs_on"].get(IGNITION_BIT, 0) for s in day) / 3600
+    print(f"streaming: {per_message * 1e6:.2f} us/message, {len(day)} hourly snapshots, "
+          f"{sum(s['distance'] for s in day) / 1000:.1f} km, max {max(s['speed_max'] for s in day)} km/h, "
+          f"engine {hours:.1f} h, idle {sum(s['idle'] for s in day) / 3600:.1f} h")
+
+    def recompute(packets):
+        """What a dashboard does today: the day's aggregates from raw history."""
+        fresh = Aggregator(bucket=86400)
+        for packet in packets:
+            fresh.update("1", packet)
+        return fresh.snapshot("1")
+
+    t = time.perf_counter()
+    whole = recompute(history)
+    print(f"recompute: {(time.perf_counter() - t) * 1e3:.1f} ms per dashboard query over {len(history)} messages, "
+          f"{whole['distance'] / 1000:.1f} km")
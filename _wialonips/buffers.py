@@ -0,0 +1,100 @@
+import threading
+from typing import List
+
+RECV_SIZE = 4096  # bytes read from a connection at once
+MAX_FREE = 64  # idle buffers kept for reuse, more are left to the garbage collector
+
+
+class BufferPool:
+    """Receive buffers shared by all connections of a server.
+
+    A connection takes a buffer only once its socket is readable and gives
+    it back after the read, so an idle connection holds none and the pool
+    stays as large as the number of reads in flight.
+    """
+
+    def __init__(self, size: int = RECV_SIZE, max_free: int = MAX_FREE):
+        self.size = size
+        self.max_free = max_free
+        self._free: List[bytearray] = []
+        self._lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self) -> bytearray:
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocated += 1
+        return bytearray(self.size)
+
+    def release(self, buf: bytearray):
+        with self._lock:
+            if len(self._free) < self.max_free:
+                self._free.append(buf)
+
+
+if __name__ == "__main__":
+    import contextlib
+    import gc
+    import os
+    import socket
+    import time
+    import tracemalloc
+
+    from _wialonips.guard import ClientLimits
+    from _wialonips.listener import Listener
+    from _wialonips.protocol import Protocol
+    from _wialonips.server import DeviceCredentials, Server
+    from _wialonips.types import PacketType
+
+    protocol = Protocol()
+    data = protocol.build_data_packet(None, 50.45, 30.52, 60, 90, 150, 9, 1.0, 0b101, 0, [12.4], "NA",
+                                      battery=80, fuel=31.5, driver="Ivan")
+    devices = 500
+
+    def wait(condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def traced() -> int:
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0]
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # the server prints every packet
+        listener = Listener(port=0, credentials={str(d): DeviceCredentials(str(d), "pw") for d in range(devices)},
+                            client_limits=ClientLimits(max_unauthenticated=None))  # every client is on 127.0.0.1
+        server = Server(listeners=[listener])
+        threading.Thread(target=server.run, daemon=True).start()
+        wait(lambda: listener.sock is not None)
+        clients = [socket.socket() for _ in range(devices)]
+
+        tracemalloc.start()
+        base = traced()
+        for c in clients:
+            c.connect(("127.0.0.1", listener.port))
+        wait(lambda: len(server._open) == devices)
+        connected = traced()
+        for d, c in enumerate(clients):
+            c.sendall(protocol.build_packet(PacketType.DEV_LOGIN, ["2.0", str(d), "pw"]))
+            c.recv(64)
+        logged_in = traced()
+        for _ in range(5):
+            for c in clients:
+                c.sendall(data)
+            for c in clients:
+                c.recv(64)
+        active = traced()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        for c in clients:
+            c.close()
+        wait(lambda: not server._open)
+        server.stop()
+        time.sleep(1)
+    print(f"{devices} connections, Python heap per connection: {(connected - base) / devices / 1024:.1f} KiB "
+          f"connected, {(logged_in - base) / devices / 1024:.1f} KiB idle after login, "
+          f"{(active - base) / devices / 1024:.1f} KiB after streaming data; "
+          f"peak {(peak - base) / devices / 1024:.1f} KiB; {server.buffers.allocated} receive buffers of "
+          f"{server.buffers.size} bytes allocated; plus a thread stack each, not traced")
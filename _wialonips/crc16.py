@@ -33,9 +33,11 @@ CRC16_TABLE = [
     0x8201, 0x42C0, 0x4380, 0x8341, 0x4100, 0x81C1, 0x8081, 0x4040
 ]
 
-def crc16(data: bytes) -> int:
-    """Computes CRC-16 using a lookup table."""
-    crc = 0
+def crc16(data: bytes, crc: int = 0) -> int:
+    """Computes CRC-16 using a lookup table.
+
+    Pass the CRC of the preceding data as `crc` to continue it over `data`.
+    """
     for byte in data:
         crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ byte) & 0xFF]
     return crc
@@ -0,0 +1,183 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from _wialonips.protocol import DevPacket
+from _wialonips.spool import ChunkSpool
+from _wialonips.types import *
+
+INFO_ACK = b"#%s#1\r\n" % PacketType.SRV_DDD_INFO_RESPONSE.value.encode("ascii")
+BLOCK_ACK_FMT = b"#%s#%%d;%%d\r\n" % PacketType.SRV_DDD_RESPONSE.value.encode("ascii")
+DDD_QUERY = b"#%s#\r\n" % PacketType.SRV_DDD_QUERY.value.encode("ascii")
+
+WORKERS = 4
+MAX_IN_FLIGHT = 64  # blocks queued for writing over all connections
+MAX_NAMES = 1024  # names of unfinished files, the oldest is dropped beyond it
+MAX_COMPLETED = 1024  # finished files remembered to ack late resends of their blocks
+
+Send = Callable[[bytes], None]
+
+
+class DddReassembler:
+    """Collects #T# blocks of tachograph (.ddd) files into a ChunkSpool.
+
+    Blocks are written by a pool of writer threads, so the connection
+    thread goes on with telemetry while a download is running; a block is
+    acked with #AT#ind;1 once it is on disk. Every file is bound to one
+    writer, which keeps its blocks in order. At most `max_in_flight` blocks
+    wait for a writer over all connections, a connection that would exceed
+    it waits for a free slot, which bounds the memory held by a download
+    spike.
+
+    Block integrity is checked by the packet CRC, the protocol has no
+    checksum of the whole file. A completed file is passed to `on_file`
+    with its size. The names from #IT# of the last `MAX_NAMES` unfinished
+    files are kept, a file whose name was dropped is saved under its key.
+    A block of a file that is already complete, resent because its ack
+    got lost, is acked again without being written.
+    """
+
+    def __init__(self, spool: ChunkSpool, workers: int = WORKERS, max_in_flight: int = MAX_IN_FLIGHT):
+        self.spool = spool
+        self._writers = [ThreadPoolExecutor(1) for _ in range(workers)]
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._names: "OrderedDict[str, str]" = OrderedDict()  # key -> name from #IT#
+        self._completed: "OrderedDict[str, int]" = OrderedDict()  # key -> block count
+        self._lock = threading.Lock()
+
+    def on_info(self, imei: str, packet: DevPacket, send: Send):
+        """#IT#: names the file of the blocks that follow."""
+        key = self._key(imei, packet.file_id)
+        with self._lock:
+            self._names[key] = packet.name
+            self._names.move_to_end(key)
+            while len(self._names) > MAX_NAMES:
+                self._names.popitem(last=False)
+            self._completed.pop(key, None)  # a new file under the same id
+        send(INFO_ACK)
+
+    def on_block(self, imei: str, packet: DevPacket, send: Send):
+        """#T#: queues the block for writing, the ack is sent by the writer."""
+        index, count = packet.index, packet.count
+        if not isinstance(index, int) or not isinstance(count, int) or not 0 <= index < count:
+            send(BLOCK_ACK_FMT % (index if isinstance(index, int) else 0, 0))
+            return
+        key = self._key(imei, packet.file_id)
+        self._slots.acquire()
+        try:
+            self._writers[hash(key) % len(self._writers)].submit(self._write, imei, key, packet, send)
+        except RuntimeError:  # shut down, the device sends it again to the next server
+            self._slots.release()
+            send(BLOCK_ACK_FMT % (index, 0))
+
+    def on_file(self, imei: str, path: str, size: int):
+        """Called with every completed file."""
+
+    def close(self):
+        """Writes the queued blocks, then closes the files of unfinished transfers."""
+        for writer in self._writers:
+            writer.shutdown()
+        self.spool.close()
+
+    def _write(self, imei: str, key: str, packet: DevPacket, send: Send):
+        try:
+            ack = self._store(imei, key, packet)
+        except OSError as exc:
+            print(f"Failed to store DDD block {key}#{packet.index}: {exc}")
+            ack = BLOCK_ACK_FMT % (packet.index, 0)
+        finally:
+            self._slots.release()
+        try:
+            send(ack)
+        except OSError:
+            pass  # connection gone, the device resends after reconnecting
+
+    def _store(self, imei: str, key: str, packet: DevPacket) -> bytes:
+        with self._lock:
+            if self._completed.get(key) == packet.count:
+                return BLOCK_ACK_FMT % (packet.index, 1)  # its ack got lost, the file is done
+        offset = self._offset(key, packet)
+        if offset is None:
+            return BLOCK_ACK_FMT % (packet.index, 0)  # sent again later
+
+        received = self.spool.write(key, packet.index, offset, packet.payload)
+        if received == packet.count:
+            with self._lock:
+                name = self._names.pop(key, None)
+                self._completed[key] = packet.count
+                while len(self._completed) > MAX_COMPLETED:
+                    self._completed.popitem(last=False)
+            path = self.spool.complete(key, name and f"{imei}_{name}" or f"{key}.ddd")
+            self.on_file(imei, path, os.path.getsize(path))
+        return BLOCK_ACK_FMT % (packet.index, 1)
+
+    def _offset(self, key: str, packet: DevPacket) -> Optional[int]:
+        if packet.index < packet.count - 1:
+            return packet.index * packet.size
+        if packet.index == 0:
+            return 0
+        for index, (_, length) in self.spool.blocks(key).items():
+            if index != packet.index:
+                return packet.index * length
+        return None
+
+    @staticmethod
+    def _key(imei: str, file_id) -> str:
+        return f"{imei}_ddd_{file_id}"
+
+
+if __name__ == "__main__":
+    import random
+    import shutil
+    import statistics
+    import tempfile
+    import time
+
+    devices, blocks, block_size = 100, 40, 1024
+    directory = tempfile.mkdtemp()
+    files = {d: os.urandom(blocks * block_size - 100) for d in range(devices)}
+    done = {}
+
+    class Reassembler(DddReassembler):
+        def on_file(self, imei, path, size):
+            with open(path, "rb") as f:
+                done[imei] = f.read()
+
+    def packets(d):
+        data = files[d]
+        count = (len(data) + block_size - 1) // block_size
+        for i in range(count):
+            payload = data[i * block_size:(i + 1) * block_size]
+            yield DevPacket(PacketType.DEV_DDD, file_id="1", size=len(payload), index=i, count=count, payload=payload)
+
+    def ack(data):
+        pass
+
+    for mode, workers in (("inline write", 0), ("writer pool", WORKERS)):
+        reassembler = Reassembler(ChunkSpool(os.path.join(directory, mode.replace(" ", "_"))), max(workers, 1))
+        streams = [packets(d) for d in range(devices)]
+        order = [d for _ in range(blocks) for d in range(devices)]
+        latency = []
+        t = time.perf_counter()
+        for d in order:
+            packet = next(streams[d], None)
+            if packet is None:
+                continue
+            start = time.perf_counter()
+            if workers:
+                reassembler.on_block(str(d), packet, ack)
+            else:
+                ack(reassembler._store(str(d), reassembler._key(str(d), "1"), packet))
+            latency.append(time.perf_counter() - start)
+            if random.random() < 0.5:
+                time.sleep(0)  # yield to the writers as telemetry handling would
+        reassembler.close()
+        elapsed = time.perf_counter() - t
+        assert all(done[str(d)] == files[d] for d in range(devices)), "file mismatch"
+        latency.sort()
+        print(f"{mode:12}: {len(latency) / elapsed:7.0f} blocks/s, connection thread busy "
+              f"median {statistics.median(latency) * 1e6:6.1f} us, p99 {latency[int(len(latency) * .99)] * 1e6:7.1f} us")
+        done.clear()
+    shutil.rmtree(directory)
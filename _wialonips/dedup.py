@@ -0,0 +1,287 @@
+import math
+import threading
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+from _wialonips.params import Params
+from _wialonips.protocol import DevPacket
+
+WINDOW = 32  # recent message keys remembered exactly per device
+MAX_DEVICES = 10_000  # devices with a window, the least recently active ones lose theirs
+CAPACITY = 10_000_000  # keys per filter generation
+ERROR_RATE = 1e-6  # false positive rate of one full generation
+
+_MASK32 = 0xFFFFFFFF
+
+
+def message_key(imei: str, packet: DevPacket) -> Optional[int]:
+    """Hash of (IMEI, device timestamp, content), None for a message without a timestamp.
+
+    The content is taken from the decoded fields, so a message resent in a
+    #B# packet has the key it had when it came as #D# or #SD#. It is the
+    built-in hash(), randomized per process for strings: keys only compare
+    within one process, the Deduplicator is not carried over a restart or
+    a handoff.
+    """
+    if packet.date is None or packet.time is None:
+        return None
+    params = packet.params
+    if isinstance(params, Params):
+        params = (params.schema.keys, params.values)
+    elif params:
+        params = tuple(params.items())
+    else:
+        params = ()
+    return hash((imei, packet.date, packet.time, packet.lat_deg, packet.lat_sign, packet.lon_deg,
+                 packet.lon_sign, packet.speed, packet.course, packet.alt, packet.sats, packet.hdop,
+                 packet.inputs, packet.outputs, tuple(packet.adc or ()), packet.ibutton, params))
+
+
+def timestamp(packet: DevPacket) -> str:
+    """Device time as 'YYMMDDhhmmss...', sortable as a string."""
+    date = packet.date
+    return date[4:6] + date[2:4] + date[0:2] + packet.time
+
+
+class BloomFilter:
+    """Fixed-size set of 64-bit hashes with false positives and no false negatives.
+
+    Sized for `capacity` keys at `error_rate`; bit positions come from the
+    two 32-bit halves of the key (double hashing).
+    """
+    __slots__ = ("capacity", "bits", "hashes", "count", "_bits")
+
+    def __init__(self, capacity: int, error_rate: float = ERROR_RATE):
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.bits + 7) // 8)
+
+    def add(self, key: int) -> bool:
+        """Adds `key`, True when it was (or seems to be) there already."""
+        bits, size = self._bits, self.bits
+        h1, h2 = key & _MASK32, (key >> 32 & _MASK32) | 1
+        present = True
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % size
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                present = False
+        if not present:
+            self.count += 1
+        return present
+
+    def __contains__(self, key: int) -> bool:
+        bits, size = self._bits, self.bits
+        h1, h2 = key & _MASK32, (key >> 32 & _MASK32) | 1
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % size
+            if not bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    @property
+    def false_positive_rate(self) -> float:
+        """Expected rate at the current fill."""
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+
+class _Window:
+    __slots__ = ("latest", "keys", "order")
+
+    def __init__(self, size: int):
+        self.latest = ""
+        self.keys = set()
+        self.order = deque(maxlen=size)
+
+    def add(self, key: int):
+        if len(self.order) == self.order.maxlen:
+            self.keys.discard(self.order[0])
+        self.order.append(key)
+        self.keys.add(key)
+
+
+class Deduplicator:
+    """Recognizes messages a device already sent, e.g. a #B# resent after a lost ack.
+
+    Each recently active device has a window of its last `window` message
+    keys and its latest device time: a message newer than that is new
+    without any lookup, so live data never meets a false positive. Older
+    messages are checked against the window and then against a global
+    Bloom filter holding every key seen. The filter has two generations of
+    `capacity` keys each; when the current one is full the older one is
+    dropped, which bounds memory whatever the number of devices.
+    """
+
+    def __init__(self, window: int = WINDOW, max_devices: int = MAX_DEVICES,
+                 capacity: int = CAPACITY, error_rate: float = ERROR_RATE):
+        self.window = window
+        self.max_devices = max_devices
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._windows: "OrderedDict[str, _Window]" = OrderedDict()
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous: Optional[BloomFilter] = None
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.filtered = 0  # duplicates only the Bloom filter recognized, they may be false positives
+
+    def seen(self, imei: str, packet: DevPacket) -> bool:
+        """Records the message, True when it is a duplicate."""
+        duplicate = not self.fresh(imei, [packet])
+        if not duplicate:
+            self.add(imei, [packet])
+        return duplicate
+
+    def fresh(self, imei: str, packets: List[DevPacket]) -> List[DevPacket]:
+        """The messages of `packets` that are not duplicates, nothing is recorded.
+
+        A message repeated within `packets` is kept once. Call `add` with
+        the result once it is stored, so a message that could not be stored
+        is taken again when the device resends it.
+        """
+        new, keys = [], set()
+        with self._lock:
+            window = self._window(imei)
+            for packet in packets:
+                key = message_key(imei, packet)
+                if key is None:
+                    new.append(packet)
+                    continue
+                self.checked += 1
+                if key in keys or self._duplicate(window, key, timestamp(packet)):
+                    self.duplicates += 1
+                    continue
+                keys.add(key)
+                new.append(packet)
+        return new
+
+    def add(self, imei: str, packets: List[DevPacket]):
+        """Records stored messages, later copies of them are duplicates."""
+        with self._lock:
+            window = self._window(imei)
+            for packet in packets:
+                key = message_key(imei, packet)
+                if key is None:
+                    continue
+                ts = timestamp(packet)
+                if ts > window.latest:
+                    window.latest = ts
+                window.add(key)
+                self._add(key)
+
+    def _window(self, imei: str) -> _Window:
+        window = self._windows.get(imei)
+        if window is None:
+            window = self._windows[imei] = _Window(self.window)
+            if len(self._windows) > self.max_devices:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(imei)
+        return window
+
+    def _duplicate(self, window: _Window, key: int, ts: str) -> bool:
+        if window.latest and ts > window.latest:
+            return False
+        if key in window.keys:
+            return True
+        # older than the latest message, or a device without a window yet
+        if key in self._current or self._previous is not None and key in self._previous:
+            self.filtered += 1
+            return True
+        return False
+
+    def _add(self, key: int):
+        if self._current.count >= self.capacity:
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity, self.error_rate)
+        self._current.add(key)
+
+    @property
+    def false_positive_rate(self) -> float:
+        """Expected rate of a Bloom filter lookup, over both generations."""
+        rate = self._current.false_positive_rate
+        if self._previous is not None:
+            rate = 1 - (1 - rate) * (1 - self._previous.false_positive_rate)
+        return rate
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the filter generations, the windows come on top."""
+        if self._previous is None:
+            return self._current.nbytes
+        return self._current.nbytes + self._previous.nbytes
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from datetime import datetime, timedelta
+
+    from _wialonips.decoder import create_decoder
+    from _wialonips.protocol import Protocol
+    from _wialonips.types import PacketType
+
+    # false positive rate of a full generation, measured with keys never added
+    capacity = 1_000_000
+    for error_rate in (1e-4, 1e-6):
+        bloom = BloomFilter(capacity, error_rate)
+        keys = random.sample(range(1 << 62), 2 * capacity)
+        for key in keys[:capacity]:
+            bloom.add(key)
+        t = time.perf_counter()
+        hits = sum(key in bloom for key in keys[capacity:])
+        lookup = (time.perf_counter() - t) / capacity
+        print(f"Bloom {error_rate:g}: {hits / capacity:.1e} measured vs {bloom.false_positive_rate:.1e} expected "
+              f"false positives, {bloom.hashes} hashes, lookup {lookup * 1e6:.2f} us, "
+              f"{bloom.nbytes / capacity:.1f} bytes/key")
+
+    # per packet overhead on decoded data: live messages, then the same messages resent in #B#
+    protocol = Protocol()
+    decoder = create_decoder("2.0")
+    devices, messages = 1_000, 20
+    start = datetime(2025, 2, 24, 8, 0, 0)
+
+    def body(i):
+        packet = protocol.build_data_packet(
+            date_time=start + timedelta(seconds=10 * i), lat=50.45 + i * 1e-4, lon=30.52,
+            speed=random.randint(0, 90), course=90, alt=150, sats=9, hdop=1.0, inputs=0b101, outputs=0,
+            adc=[12.4], ibutton="NA", battery=80, fuel=round(random.uniform(10, 60), 1))
+        return packet[3:packet.rindex(b";") + 1].decode("ascii")  # body without CRC
+
+    def blackbox(bodies):
+        return decoder.decode(protocol.build_black_box_packet(bodies)).packets
+
+    bodies = [body(i) for i in range(messages)]
+    streams = (
+        ("live #D#", [decoder.decode(protocol.build_packet(PacketType.DEV_EXTENDED_DATA, [b[:-1]])) for b in bodies]),
+        ("resent #B#", blackbox(bodies)),
+        ("same time, other content", blackbox([body(i) for i in range(messages)])),
+    )
+    dedup = Deduplicator(capacity=devices * messages * 4)
+    for label, stream in streams:
+        t = time.perf_counter()
+        found = sum(dedup.seen(str(d), packet) for d in range(devices) for packet in stream)
+        elapsed = (time.perf_counter() - t) / (devices * len(stream))
+        print(f"{label:24}: {found:6}/{devices * len(stream)} duplicates, {elapsed * 1e6:5.2f} us/message")
+    # windows for a tenth of the devices only: the Bloom filter has to recognize the rest
+    dedup = Deduplicator(max_devices=devices // 10, capacity=devices * messages * 4)
+    for d in range(devices):
+        for packet in streams[0][1]:
+            dedup.seen(str(d), packet)
+    t = time.perf_counter()
+    found = sum(dedup.seen(str(d), packet) for d in range(devices) for packet in streams[1][1])
+    elapsed = (time.perf_counter() - t) / (devices * messages)
+    print(f"{'resent, windows evicted':24}: {found:6}/{devices * messages} duplicates "
+          f"({dedup.filtered} by the filter), {elapsed * 1e6:5.2f} us/message")
+    full = Deduplicator()
+    print(f"defaults: {full.nbytes / 2 ** 20:.0f} MiB of filters for {2 * full.capacity:,} keys "
+          f"(~{2 * full.capacity // 1_000_000} messages per device for a million devices), "
+          f"windows for {full.max_devices:,} devices of {full.window} keys")
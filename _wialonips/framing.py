@@ -0,0 +1,170 @@
+import zlib
+from typing import List
+
+COMPRESSED_MARKER = 0xFF
+COMPRESSED_HEADER_LEN = 3  # 0xFF + uint16 little-endian length
+MAX_COMPRESSED_LEN = 0xFFFF
+
+MAX_FRAME_LEN = 64 * 1024
+MAX_DECOMPRESSED_LEN = 1024 * 1024
+
+FRAME_END = b"\r\n"
+
+# packets followed by a binary block, header -> index of the block size field
+BINARY_FRAMES = {b"#I#": 0, b"#T#": 1}
+
+
+class FramingError(ValueError):
+    pass
+
+
+def compress_frame(frame: bytes, level: int = zlib.Z_DEFAULT_COMPRESSION) -> bytes:
+    """Wraps one or more packets into a compressed frame.
+
+    Returns `frame` unchanged when compression does not make it smaller or
+    the result does not fit the 16-bit length field.
+    """
+    data = zlib.compress(frame, level)
+    if len(data) > MAX_COMPRESSED_LEN or len(data) + COMPRESSED_HEADER_LEN >= len(frame):
+        return frame
+    return bytes((COMPRESSED_MARKER,)) + len(data).to_bytes(2, "little") + data
+
+
+def inflate(data: bytes, limit: int = MAX_DECOMPRESSED_LEN) -> bytes:
+    """Decompresses `data`, refusing to produce more than `limit` bytes."""
+    d = zlib.decompressobj()
+    try:
+        out = d.decompress(data, limit + 1)
+        if len(out) > limit or d.unconsumed_tail:
+            raise FramingError("Compressed frame exceeds %d bytes" % limit)
+        out += d.flush()
+    except zlib.error as exc:
+        raise FramingError(f"Invalid compressed frame: {exc}") from exc
+    if len(out) > limit:
+        raise FramingError("Compressed frame exceeds %d bytes" % limit)
+    return out
+
+
+class Framer:
+    """Splits a device byte stream into packets.
+
+    Plain packets end with CRLF. A compressed frame starts with 0xFF and a
+    16-bit little-endian length, and its inflated content holds one or more
+    plain packets. Packets listed in BINARY_FRAMES are followed by a binary
+    block whose size is one of their fields; the block is returned appended
+    to its packet.
+    """
+    __slots__ = ("max_frame_len", "max_decompressed_len", "_buf")
+
+    def __init__(self, max_frame_len: int = MAX_FRAME_LEN,
+                 max_decompressed_len: int = MAX_DECOMPRESSED_LEN):
+        self.max_frame_len = max_frame_len
+        self.max_decompressed_len = max_decompressed_len
+        self._buf = bytearray()
+
+    @property
+    def pending(self) -> bytes:
+        return bytes(self._buf)
+
+    @property
+    def buffered(self) -> int:
+        """Bytes of an incomplete frame, without copying them like `pending`."""
+        return len(self._buf)
+
+    def feed(self, data: bytes) -> List[bytes]:
+        buf = self._buf
+        buf += data
+        frames = []
+        while buf:
+            if buf[0] == COMPRESSED_MARKER:
+                if len(buf) < COMPRESSED_HEADER_LEN:
+                    break
+                size = int.from_bytes(buf[1:COMPRESSED_HEADER_LEN], "little")
+                end = COMPRESSED_HEADER_LEN + size
+                if len(buf) < end:
+                    break
+                payload = bytes(buf[COMPRESSED_HEADER_LEN:end])
+                del buf[:end]
+                frames.extend(self._split(inflate(payload, self.max_decompressed_len)))
+            else:
+                end = buf.find(FRAME_END)
+                if end < 0:
+                    if len(buf) > self.max_frame_len:
+                        raise FramingError("Frame exceeds %d bytes" % self.max_frame_len)
+                    break
+                end += len(FRAME_END)
+                end += self._binary_size(buf, end)
+                if len(buf) < end:
+                    break
+                frames.append(bytes(buf[:end]))
+                del buf[:end]
+        return frames
+
+    def _binary_size(self, buf: bytearray, end: int) -> int:
+        header = bytes(buf[:buf.find(b"#", 1, 6) + 1])  # '#XX#', types are at most 4 chars
+        field = BINARY_FRAMES.get(header)
+        if field is None:
+            return 0
+        fields = bytes(buf[len(header):end - len(FRAME_END)]).split(b";")
+        try:
+            size = int(fields[field])
+        except (IndexError, ValueError):
+            return 0  # malformed, the parser answers with an error
+        if not 0 <= size <= self.max_frame_len:
+            raise FramingError("Binary block exceeds %d bytes" % self.max_frame_len)
+        return size
+
+    @staticmethod
+    def _split(data: bytes) -> List[bytes]:
+        frames = []
+        start = 0
+        while start < len(data):
+            end = data.find(FRAME_END, start)
+            if end < 0:
+                raise FramingError("Truncated packet in compressed frame")
+            end += len(FRAME_END)
+            frames.append(data[start:end])
+            start = end
+        return frames
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from datetime import datetime, timedelta
+
+    from _wialonips.protocol import Protocol
+
+    protocol = Protocol()
+    start = datetime(2025, 2, 24, 8, 0, 0)
+    lat, lon = 50.45, 30.52
+
+    def message(i):
+        global lat, lon
+        lat += random.uniform(-1e-4, 1e-4)
+        lon += random.uniform(-1e-4, 1e-4)
+        packet = protocol.build_data_packet(
+            date_time=start + timedelta(seconds=10 * i),
+            lat=lat, lon=lon,
+            speed=random.randint(0, 90), course=random.randint(0, 359),
+            alt=150, sats=random.randint(7, 14), hdop=1.0,
+            inputs=0b101, outputs=0, adc=[12.4, 0.0],
+            ibutton="NA", battery=random.randint(60, 100), fuel=round(random.uniform(10, 60), 1),
+        )
+        return packet[3:packet.rindex(b";") + 1].decode("ascii")  # body without CRC
+
+    for batch in (1, 10, 50, 100):
+        bodies = [message(i) for i in range(batch)]
+        frame = protocol.build_black_box_packet(bodies)
+        n = 200
+        t = time.perf_counter()
+        for _ in range(n):
+            wire = compress_frame(frame)
+        t_compress = (time.perf_counter() - t) / n / batch
+        framer = Framer()
+        t = time.perf_counter()
+        for _ in range(n):
+            framer.feed(wire)
+        t_inflate = (time.perf_counter() - t) / n / batch
+        print(f"#B# x{batch:<3}: {len(frame) / batch:6.1f} -> {len(wire) / batch:6.1f} bytes/msg, "
+              f"compress {t_compress * 1e6:5.1f} us/msg, inflate+frame {t_inflate * 1e6:5.1f} us/msg")
@@ -0,0 +1,223 @@
+import math
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Set, Tuple, Union
+
+from _wialonips.protocol import DevPacket
+from _wialonips.utils import EARTH_RADIUS
+
+CELL = 0.01  # degrees per grid cell side, about 1.1 km of latitude
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+ENTER = "enter"
+EXIT = "exit"
+
+
+class Circle:
+    __slots__ = ("id", "lat", "lon", "radius", "bbox", "_cos", "_r2")
+
+    def __init__(self, id: str, lat: float, lon: float, radius: float):
+        self.id = id
+        self.lat = lat
+        self.lon = lon
+        self.radius = radius  # m
+        self._cos = math.cos(math.radians(lat))
+        self._r2 = (radius / METERS_PER_DEGREE) ** 2
+        dlat = radius / METERS_PER_DEGREE
+        dlon = dlat / max(self._cos, 1e-6)
+        self.bbox = (lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+
+    def contains(self, lat: float, lon: float) -> bool:
+        """Equirectangular distance, exact enough for fences up to tens of km."""
+        dy = lat - self.lat
+        dx = (lon - self.lon) * self._cos
+        return dx * dx + dy * dy <= self._r2
+
+
+class Polygon:
+    __slots__ = ("id", "points", "bbox", "_edges")
+
+    def __init__(self, id: str, points: Sequence[Tuple[float, float]]):
+        if len(points) < 3:
+            raise ValueError(f"Polygon {id} needs at least 3 points")
+        self.id = id
+        self.points = tuple(points)  # (lat, lon), closed implicitly
+        lats = [p[0] for p in points]
+        lons = [p[1] for p in points]
+        self.bbox = (min(lats), min(lons), max(lats), max(lons))
+        # (lat1, lat2, lon1, slope) per edge that is not horizontal
+        self._edges = tuple(
+            (a[0], b[0], a[1], (b[1] - a[1]) / (b[0] - a[0]))
+            for a, b in zip(self.points, self.points[1:] + self.points[:1]) if a[0] != b[0]
+        )
+
+    def contains(self, lat: float, lon: float) -> bool:
+        """Ray casting towards growing longitude."""
+        inside = False
+        for lat1, lat2, lon1, slope in self._edges:
+            if (lat1 > lat) != (lat2 > lat) and lon < lon1 + (lat - lat1) * slope:
+                inside = not inside
+        return inside
+
+
+Fence = Union[Circle, Polygon]
+
+
+class GeofenceEvent(NamedTuple):
+    imei: str
+    fence: str
+    event: str  # ENTER or EXIT
+    packet: DevPacket
+
+
+class GeofenceEngine:
+    """Enter and exit events of devices against many circles and polygons.
+
+    Fences are indexed in a uniform grid of `cell` degrees: every fence is
+    listed in the cells its bounding box touches, so a position is tested
+    only against the fences of its own cell, bounding box first. Each
+    device keeps the set of fences it is inside; `update` compares it with
+    the fences of the new position and passes every change to `on_event`.
+    """
+
+    def __init__(self, fences: Iterable[Fence] = (), cell: float = CELL):
+        self.cell = cell
+        self._fences: Dict[str, Fence] = {}
+        self._grid: Dict[Tuple[int, int], List[Fence]] = {}  # lists are replaced, never changed in place
+        self._inside: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        for fence in fences:
+            self.add(fence)
+
+    def __len__(self) -> int:
+        return len(self._fences)
+
+    def add(self, fence: Fence):
+        with self._lock:
+            if fence.id in self._fences:
+                self._remove(fence.id)
+            self._fences[fence.id] = fence
+            for key in self._cells(fence.bbox):
+                self._grid[key] = self._grid.get(key, []) + [fence]
+
+    def remove(self, fence_id: str):
+        """Drops a fence; devices inside it get no exit event."""
+        with self._lock:
+            self._remove(fence_id)
+
+    def fences_at(self, lat: float, lon: float) -> Set[str]:
+        found = set()
+        for fence in self._grid.get((math.floor(lat / self.cell), math.floor(lon / self.cell)), ()):
+            south, west, north, east = fence.bbox
+            if south <= lat <= north and west <= lon <= east and fence.contains(lat, lon):
+                found.add(fence.id)
+        return found
+
+    def update(self, imei: str, packet: DevPacket) -> List[GeofenceEvent]:
+        """Moves the device to the position of `packet`, returns the events it caused."""
+        try:
+            pos = packet.pos
+        except ValueError:  # malformed coordinates
+            pos = None
+        if pos is None:
+            return []
+        current = self.fences_at(pos[0], pos[1])
+        previous = self._inside.get(imei)
+        if not current and not previous:
+            return []
+        self._inside[imei] = current
+        if previous is None:
+            previous = set()
+        events = [GeofenceEvent(imei, fence, EXIT, packet) for fence in previous - current if fence in self._fences]
+        events += [GeofenceEvent(imei, fence, ENTER, packet) for fence in current - previous]
+        for event in events:
+            self.on_event(event)
+        return events
+
+    def inside(self, imei: str) -> Set[str]:
+        return set(self._inside.get(imei, ()))
+
+    def on_event(self, event: GeofenceEvent):
+        """Called with every enter and exit."""
+
+    def _remove(self, fence_id: str):
+        fence = self._fences.pop(fence_id, None)
+        if fence is None:
+            return
+        for key in self._cells(fence.bbox):
+            cell = [f for f in self._grid.get(key, ()) if f is not fence]
+            if cell:
+                self._grid[key] = cell
+            else:
+                self._grid.pop(key, None)
+
+    def _cells(self, bbox) -> Iterable[Tuple[int, int]]:
+        south, west, north, east = bbox
+        for y in range(math.floor(south / self.cell), math.floor(north / self.cell) + 1):
+            for x in range(math.floor(west / self.cell), math.floor(east / self.cell) + 1):
+                yield y, x
+
+
+if __name__ == "__main__":
+    import random
+    import statistics
+    import time
+
+    from _wialonips.utils import decimal_to_ddmm
+
+    random.seed(1)
+    south, west, size = 50.0, 30.0, 1.0  # about 110 x 70 km
+
+    def polygon(i):
+        lat, lon = south + random.random() * size, west + random.random() * size
+        radius = random.uniform(100, 2000) / METERS_PER_DEGREE
+        n = random.randint(8, 24)
+        points = []
+        for k in range(n):
+            angle = 2 * math.pi * k / n
+            r = radius * random.uniform(0.5, 1)
+            points.append((lat + r * math.sin(angle), lon + r * math.cos(angle) / math.cos(math.radians(lat))))
+        return Polygon(f"p{i}", points)
+
+    def circle(i):
+        return Circle(f"c{i}", south + random.random() * size, west + random.random() * size,
+                      random.uniform(100, 1500))
+
+    fences = [polygon(i) if i % 2 else circle(i) for i in range(10_000)]
+    t = time.perf_counter()
+    engine = GeofenceEngine(fences)
+    build = time.perf_counter() - t
+
+    def packet(lat, lon):
+        lat_deg, lat_sign = decimal_to_ddmm(lat, True)
+        lon_deg, lon_sign = decimal_to_ddmm(lon, False)
+        return DevPacket(None, lat_deg=lat_deg, lat_sign=lat_sign, lon_deg=lon_deg, lon_sign=lon_sign)
+
+    devices, steps = 2_000, 100
+    stream = []
+    positions = [[south + random.random() * size, west + random.random() * size] for _ in range(devices)]
+    for _ in range(steps):
+        for d, p in enumerate(positions):
+            p[0] += random.uniform(-3e-3, 3e-3)
+            p[1] += random.uniform(-3e-3, 3e-3)
+            stream.append((str(d), packet(*p)))
+
+    events = 0
+    latency = []
+    t = time.perf_counter()
+    for imei, p in stream:
+        start = time.perf_counter()
+        events += len(engine.update(imei, p))
+        latency.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - t
+    latency.sort()
+    print(f"{len(fences)} fences indexed in {build:.2f} s, {len(engine._grid)} cells; "
+          f"{len(stream)} packets: {len(stream) / elapsed:,.0f} packets/s, median "
+          f"{statistics.median(latency) * 1e6:.1f} us, p99 {latency[int(len(latency) * .99)] * 1e6:.1f} us, "
+          f"max {latency[-1] * 1e3:.2f} ms, {events} events")
+
+    sample = stream[:500]
+    t = time.perf_counter()
+    naive = [{f.id for f in fences if f.contains(*p.pos)} for _, p in sample]
+    scan = (time.perf_counter() - t) / len(sample)
+    assert naive == [engine.fences_at(*p.pos) for _, p in sample], "grid and full scan disagree"
+    print(f"full scan of every fence: {scan * 1e3:.2f} ms/packet ({1 / scan:,.0f} packets/s), same fences found")
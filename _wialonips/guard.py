@@ -0,0 +1,232 @@
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Tuple
+
+LOGIN_TIMEOUT = 30  # s from accept to a successful #L#
+IDLE_TIMEOUT = 900  # s without a byte; devices ping far more often, so this ends half-open connections
+MIN_RATE = 64  # bytes/s an incomplete frame has to arrive at
+RATE_GRACE = 10  # s an incomplete frame may take at any rate
+SEND_TIMEOUT = 30  # s a device may leave a packet sent to it unread
+MAX_UNAUTHENTICATED = 16  # connections per IP that did not log in yet
+BACKLOG = 128  # connections the kernel queues before accept, a flood beyond it is refused
+
+_TIMEVAL = struct.Struct("ll")  # struct timeval of SO_SNDTIMEO
+
+# why a connection was closed, also the name of its metric
+LOGIN_TIMEOUTS = "login_timeouts"
+IDLE_TIMEOUTS = "idle_timeouts"
+SLOW_CLIENTS = "slow_clients"
+
+
+@dataclass(frozen=True)
+class ClientLimits:
+    """Limits on clients that connect and then do not talk, None disables one.
+
+    `min_rate` applies while a frame is incomplete: once it started more
+    than `rate_grace` seconds ago, its bytes so far must have come at
+    `min_rate` on average. A device between two packets is only held to
+    `idle_timeout`.
+    """
+    login_timeout: Optional[float] = LOGIN_TIMEOUT
+    idle_timeout: Optional[float] = IDLE_TIMEOUT
+    min_rate: Optional[float] = MIN_RATE
+    rate_grace: float = RATE_GRACE
+    send_timeout: Optional[float] = SEND_TIMEOUT
+    max_unauthenticated: Optional[int] = MAX_UNAUTHENTICATED
+
+
+def set_send_timeout(sock: socket.socket, timeout: Optional[float]):
+    """Bounds every blocking send on `sock` to `timeout` seconds, None removes the bound.
+
+    Unlike `socket.settimeout` this keeps the descriptor blocking, so
+    `os.sendfile` and MSG_DONTWAIT sends on it work as before. A send that
+    runs out of time returns what it wrote so far, or raises
+    BlockingIOError when it wrote nothing.
+    """
+    usec = 0 if timeout is None else max(1, round(timeout * 1e6))  # a zero timeval means no timeout
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, _TIMEVAL.pack(*divmod(usec, 1_000_000)))
+
+
+def send_timeout(sock: socket.socket) -> Optional[float]:
+    """The bound `set_send_timeout` put on `sock`, None when there is none."""
+    sec, usec = _TIMEVAL.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, _TIMEVAL.size))
+    return sec + usec / 1e6 or None
+
+
+class Watchdog:
+    """Deadlines of one connection under its listener's ClientLimits."""
+    __slots__ = ("limits", "accepted", "logged_in", "last", "frame_start", "frame_bytes")
+
+    def __init__(self, limits: ClientLimits, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        self.limits = limits
+        self.accepted = now
+        self.logged_in = False
+        self.last = now  # last byte received
+        self.frame_start: Optional[float] = None  # first byte of the incomplete frame
+        self.frame_bytes = 0
+
+    def received(self, nbytes: int, frames: int, buffered: int, now: Optional[float] = None):
+        """Records a read of `nbytes` that completed `frames` and left `buffered` bytes of the next one."""
+        if now is None:
+            now = time.monotonic()
+        self.last = now
+        if not buffered:
+            self.frame_start = None
+        elif frames or self.frame_start is None:
+            self.frame_start, self.frame_bytes = now, buffered
+        else:
+            self.frame_bytes += nbytes
+
+    def timeout(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until the next deadline, None when there is none."""
+        if now is None:
+            now = time.monotonic()
+        deadlines = [deadline for deadline, _ in self._deadlines()]
+        return max(0.0, min(deadlines) - now) if deadlines else None
+
+    def expired(self, now: Optional[float] = None) -> Optional[str]:
+        """The limit the connection broke by `now`, None while it keeps to them."""
+        if now is None:
+            now = time.monotonic()
+        for deadline, reason in self._deadlines():
+            if now >= deadline:
+                return reason
+        return None
+
+    def _deadlines(self) -> Iterator[Tuple[float, str]]:
+        limits = self.limits
+        if not self.logged_in and limits.login_timeout is not None:
+            yield self.accepted + limits.login_timeout, LOGIN_TIMEOUTS
+        if limits.idle_timeout is not None:
+            yield self.last + limits.idle_timeout, IDLE_TIMEOUTS
+        if self.frame_start is not None and limits.min_rate:
+            # average rate frame_bytes / elapsed drops below min_rate once elapsed passes frame_bytes / min_rate
+            yield self.frame_start + max(limits.rate_grace, self.frame_bytes / limits.min_rate), SLOW_CLIENTS
+
+
+class Unauthenticated:
+    """Connections that did not log in yet, counted per client IP."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, ip: str) -> bool:
+        """Counts a new connection from `ip`, False when `ip` has `limit` already."""
+        with self._lock:
+            count = self._counts.get(ip, 0)
+            if count >= self.limit:
+                return False
+            self._counts[ip] = count + 1
+            return True
+
+    def release(self, ip: str):
+        """The connection logged in or closed."""
+        with self._lock:
+            count = self._counts.pop(ip, 0)
+            if count > 1:
+                self._counts[ip] = count - 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(self._counts.values())
+
+
+if __name__ == "__main__":
+    import contextlib
+    import os
+    import socket
+    import statistics
+
+    from _wialonips.listener import Listener
+    from _wialonips.protocol import Protocol
+    from _wialonips.server import DeviceCredentials, Server
+    from _wialonips.types import PacketType
+
+    protocol = Protocol()
+    data = protocol.build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+    scanners = 64
+
+    def login(port, imei):
+        c = socket.create_connection(("127.0.0.1", port))
+        c.sendall(protocol.build_packet(PacketType.DEV_LOGIN, ["2.0", imei, "pw"]))
+        c.recv(64)
+        return c
+
+    def closed(c, timeout=10) -> bool:
+        c.settimeout(timeout)
+        try:
+            return c.recv(64) == b""
+        except ConnectionResetError:
+            return True
+        except socket.timeout:
+            return False
+
+    def attack(limits: ClientLimits):
+        listener = Listener(port=0, client_limits=limits,
+                            credentials={str(d): DeviceCredentials(str(d), "pw") for d in range(3)})
+        server = Server(listeners=[listener])
+        threading.Thread(target=server.run, daemon=True).start()
+        while listener.sock is None:
+            time.sleep(0.01)
+        port = listener.port
+
+        healthy = login(port, "0")
+        rtt = []
+        stop = threading.Event()
+
+        def serve_healthy():
+            while not stop.is_set():
+                t = time.perf_counter()
+                healthy.sendall(data)
+                healthy.recv(64)
+                rtt.append(time.perf_counter() - t)
+                time.sleep(0.01)
+
+        worker = threading.Thread(target=serve_healthy, daemon=True)
+        worker.start()
+
+        # connect and never log in, from another address than the devices
+        scan = [socket.create_connection(("127.0.0.1", port), source_address=("127.0.0.2", 0))
+                for _ in range(scanners)]
+        silent = login(port, "1")  # logs in, then goes quiet like a half-open connection
+        slow = login(port, "2")
+        try:
+            for byte in data[:20]:  # a slowloris: 10 bytes/s of one frame
+                slow.send(bytes((byte,)))
+                time.sleep(0.1)
+        except OSError:
+            pass  # closed by the server
+        time.sleep(1)
+        still_open = len(server._open) - 1  # without the healthy device
+        scan_closed = sum(closed(c, 0.05) for c in scan)
+        slow_closed = closed(slow, 0.5)
+        silent_closed = closed(silent, 5)
+        stop.set()
+        worker.join()
+        for c in scan + [silent, slow, healthy]:
+            c.close()
+        server.stop()
+        time.sleep(1)
+        return still_open, scan_closed, slow_closed, silent_closed, rtt, server.metrics.snapshot()[listener.name]
+
+    for label, limits in (
+            ("no limits", ClientLimits(None, None, None, 0, None, None)),
+            ("limits", ClientLimits(login_timeout=1, idle_timeout=3, min_rate=50, rate_grace=1,
+                                    send_timeout=1, max_unauthenticated=16)),
+    ):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # the server prints every packet
+            still_open, scan_closed, slow_closed, silent_closed, rtt, metrics = attack(limits)
+        rtt.sort()
+        counters = {k: metrics.get(k, 0) for k in ("rejected_unauthenticated", "login_timeouts", "slow_clients",
+                                                    "idle_timeouts")}
+        print(f"{label:9}: {still_open} bad connections open 3 s in; {scan_closed}/{scanners} scanners, slowloris "
+              f"{'closed' if slow_closed else 'open'}, silent device {'closed' if silent_closed else 'open'}; "
+              f"healthy device round trip median {statistics.median(rtt) * 1e3:.2f} ms, "
+              f"p99 {rtt[int(len(rtt) * .99)] * 1e3:.2f} ms; {counters}")
@@ -0,0 +1,217 @@
+import base64
+import json
+import os
+import select
+import socket
+from dataclasses import asdict, dataclass
+from typing import List, Optional, Tuple
+
+MAX_FDS = 200  # per message, below the kernel limit of descriptors in one SCM_RIGHTS
+HANDOFF_TIMEOUT = 10  # s for a single handoff message
+DRAIN_TIMEOUT = 5  # s the old server waits for its connections to detach
+DRAIN_POLL = 0.2  # s a connection blocks in recv before it checks for a handoff
+
+TAKEOVER = b"takeover"
+
+_poll = getattr(select, "poll", None)  # select() is limited to fds below 1024
+
+_LENGTH = 4  # bytes of the big-endian length prefix of a message
+
+
+class HandoffError(ConnectionError):
+    pass
+
+
+@dataclass
+class Session:
+    """What a connection needs to go on in another process.
+
+    `imei` is None for a connection that has not logged in yet, `version`
+    None when its first frame has not arrived; `pending` holds the bytes of
+    a frame that is not complete yet.
+    """
+    listener: str
+    imei: Optional[str] = None
+    version: Optional[str] = None
+    pending: bytes = b""
+
+    def to_json(self) -> dict:
+        data = asdict(self)
+        data["pending"] = base64.b64encode(self.pending).decode("ascii")
+        return data
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Session":
+        return cls(data["listener"], data.get("imei"), data.get("version"),
+                   base64.b64decode(data.get("pending", "")))
+
+
+def send_message(sock: socket.socket, message: dict, fds: List[int] = ()):
+    """Sends a length-prefixed JSON message, `fds` travel with its first byte."""
+    data = json.dumps(message).encode("utf-8")
+    data = len(data).to_bytes(_LENGTH, "big") + data
+    sent = socket.send_fds(sock, [data], list(fds)) if fds else sock.send(data)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def recv_message(sock: socket.socket) -> Tuple[dict, List[int]]:
+    head, fds, _, _ = socket.recv_fds(sock, _LENGTH, MAX_FDS)
+    if not head:
+        raise HandoffError("Handoff connection closed")
+    head += _recv_exact(sock, _LENGTH - len(head))
+    return json.loads(_recv_exact(sock, int.from_bytes(head, "big"))), fds
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise HandoffError("Handoff connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+def listen(path: str) -> socket.socket:
+    """Unix socket a running server hands its sockets off on."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+    except OSError:  # left over by a server that did not shut down cleanly
+        if _alive(path):
+            sock.close()
+            raise
+        unlink(path)
+        sock.bind(path)
+    sock.listen(1)
+    sock.setblocking(False)
+    return sock
+
+
+def connect(path: str, timeout: float = HANDOFF_TIMEOUT) -> Optional[socket.socket]:
+    """Connection to the server running at `path`, None if there is none."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    return sock
+
+
+def unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def readable(sock: socket.socket, timeout: Optional[float]) -> bool:
+    """Waits up to `timeout` (forever when None) for data (or EOF) on `sock`."""
+    if _poll is None:
+        return bool(select.select([sock], [], [], timeout)[0])
+    poller = _poll()
+    poller.register(sock, select.POLLIN)
+    return bool(poller.poll(None if timeout is None else timeout * 1000))
+
+
+def _alive(path: str) -> bool:
+    sock = connect(path, 1)
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import shutil
+    import tempfile
+    import threading
+    import time
+
+    from _wialonips.listener import Listener
+    from _wialonips.protocol import Protocol
+    from _wialonips.server import DeviceCredentials, Server
+    from _wialonips.types import PacketType
+
+    devices = 200
+    protocol = Protocol()
+    data = protocol.build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+    credentials = {str(d): DeviceCredentials(str(d), "pw") for d in range(devices)}
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "handoff.sock")
+
+    def server(port=0, handoff_path=None):
+        return Server(image_dir=directory, ddd_dir=directory, handoff_path=handoff_path,
+                      listeners=[Listener(port=port, name="main", credentials=credentials)])
+
+    def start(s):
+        threading.Thread(target=s.run, daemon=True).start()
+        while not s._running:
+            time.sleep(0.01)
+
+    def tracker(port, imei, stop, stats):
+        """A device sending a packet every 10 ms and waiting for its ack."""
+        try:
+            with socket.create_connection(("127.0.0.1", port)) as c:
+                c.settimeout(HANDOFF_TIMEOUT)
+                c.sendall(protocol.build_packet(PacketType.DEV_LOGIN, ["2.0", imei, "pw"]))
+                if c.recv(64) != b"#AL#1\r\n":
+                    raise ConnectionError("login rejected")
+                while not stop.is_set():
+                    t = time.perf_counter()
+                    c.sendall(data)
+                    if not c.recv(64):
+                        raise ConnectionError("closed")
+                    stats["worst"] = max(stats["worst"], time.perf_counter() - t)
+                    stats["acks"] += 1
+                    time.sleep(0.01)
+        except OSError:
+            stats["dropped"] += 1
+
+    def restart(graceful):
+        stats = {"acks": 0, "dropped": 0, "worst": 0.0}
+        stop = threading.Event()
+        # the servers print every packet, killed connections end in tracebacks
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            old = server(handoff_path=path if graceful else None)
+            start(old)
+            port = old.listeners[0].port
+            clients = [threading.Thread(target=tracker, args=(port, str(d), stop, stats)) for d in range(devices)]
+            for c in clients:
+                c.start()
+            time.sleep(1)
+            t = time.perf_counter()
+            if graceful:
+                new = server(handoff_path=path)
+                new.take_over()
+            else:  # what a process exit does to the old server
+                old.stop()
+                with old._open_lock:
+                    for conn in old._open:
+                        conn.shutdown(socket.SHUT_RDWR)
+                while old._selector is not None:
+                    time.sleep(0.01)
+                new = server(port)
+            start(new)
+            while old._selector is not None:
+                time.sleep(0.01)
+            switch = time.perf_counter() - t
+            time.sleep(1)
+            stop.set()
+            for c in clients:
+                c.join()
+            new.stop()
+            time.sleep(1)
+        moved = new.metrics.get("taken_over", "main")
+        print(f"{'handoff' if graceful else 'cold restart':12}: {stats['dropped']}/{devices} connections dropped, "
+              f"{moved} moved, switch {switch * 1e3:6.1f} ms, worst ack {stats['worst'] * 1e3:6.1f} ms, "
+              f"{stats['acks']} acks")
+
+    restart(False)
+    restart(True)
+    shutil.rmtree(directory)
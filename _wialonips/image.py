@@ -0,0 +1,49 @@
+from _wialonips.protocol import DevPacket
+from _wialonips.spool import ChunkSpool
+from _wialonips.types import *
+
+BLOCK_ACK_FMT = b"#%s#%%d;%%d\r\n" % PacketType.SRV_IMAGE_RESPONSE.value.encode("ascii")
+IMAGE_ACK = b"#%s#1\r\n" % PacketType.SRV_IMAGE_RESPONSE.value.encode("ascii")
+
+
+class ImageReceiver:
+    """Spools #I# image blocks to disk as they arrive.
+
+    Blocks are written at `index * size`; all blocks but the last have the
+    same size, so the offset of the last one is taken from any other block
+    already on disk. Each block is acked with #AI#ind;1 and the completed
+    image with #AI#1. Transfers are keyed by IMEI and image name and resume
+    from the spool after a reconnect.
+    """
+
+    def __init__(self, spool: ChunkSpool):
+        self.spool = spool
+
+    def on_block(self, imei: str, packet: DevPacket) -> bytes:
+        index, count = packet.index, packet.count
+        if not isinstance(index, int) or not isinstance(count, int) or not 0 <= index < count:
+            return BLOCK_ACK_FMT % (index if isinstance(index, int) else 0, 0)
+
+        key = f"{imei}_{packet.name}"
+        offset = self._offset(key, packet)
+        if offset is None:
+            return BLOCK_ACK_FMT % (index, 0)  # the device sends it again later
+
+        received = self.spool.write(key, index, offset, packet.payload)
+        if received < count:
+            return BLOCK_ACK_FMT % (index, 1)
+        self.on_image(imei, packet.name, self.spool.complete(key))
+        return BLOCK_ACK_FMT % (index, 1) + IMAGE_ACK
+
+    def on_image(self, imei: str, name: str, path: str):
+        """Called with the file of every completed image."""
+
+    def _offset(self, key: str, packet: DevPacket):
+        if packet.index < packet.count - 1:
+            return packet.index * packet.size
+        if packet.index == 0:
+            return 0
+        for index, (_, length) in self.spool.blocks(key).items():
+            if index != packet.index:
+                return packet.index * length
+        return None
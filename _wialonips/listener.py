@@ -0,0 +1,153 @@
+import socket
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, Optional
+
+from _wialonips.aggregates import Aggregator
+from _wialonips.decoder import MAX_BODY_LEN, create_decoder
+from _wialonips.dedup import Deduplicator
+from _wialonips.geofence import GeofenceEngine
+from _wialonips.guard import BACKLOG, ClientLimits, Unauthenticated
+from _wialonips.protocol import Protocol, shared_protocol
+from _wialonips.ratelimit import DeviceBuckets, RateLimit
+from _wialonips.sink import NullSink, Sink
+
+
+class AckPolicy(str, Enum):
+    IMMEDIATE = "immediate"  # data is acked once parsed, before the sink sees it
+    AFTER_WRITE = "after_write"  # acked once the sink committed it, a failed write is not acked
+    NONE = "none"  # data packets are never acked
+
+
+@dataclass
+class Listener:
+    """One listening port of a server.
+
+    Every listener has its own device credentials, ack policy, sink and
+    protocol profile: `version` forces a decoder for every connection
+    ("1.1" or "2.0"), None picks it from each #L# packet.
+
+    `connection_limit` caps every connection, `device_limit` every IMEI
+    over all its connections; a connection over a limit is not read from
+    until it is back under it. With `dedup` set, messages a device sends
+    again are acked but not written to the sink. With `aggregates` set,
+    every stored message also updates the device's running aggregates,
+    whose snapshots go to the sink as well, and `geofences` moves the
+    device against its fences.
+
+    `client_limits` closes connections that do not log in, go silent or
+    dribble a frame, and caps the connections per IP that did not log in
+    yet. `backlog` is capped at the system's SOMAXCONN.
+
+    AFTER_WRITE needs a sink that can commit, see Sink.commits.
+    """
+    host: str = "127.0.0.1"
+    port: int = 65432
+    name: str = "default"
+    credentials: Dict[str, "DeviceCredentials"] = field(default_factory=dict)
+    ack_policy: AckPolicy = AckPolicy.IMMEDIATE
+    sink: Sink = field(default_factory=NullSink)
+    version: Optional[str] = None
+    max_body_len: Optional[int] = None
+    backlog: int = BACKLOG
+    connection_limit: Optional[RateLimit] = None
+    device_limit: Optional[RateLimit] = None
+    dedup: Optional[Deduplicator] = None
+    aggregates: Optional[Aggregator] = None
+    geofences: Optional[GeofenceEngine] = None
+    client_limits: ClientLimits = field(default_factory=ClientLimits)
+
+    protocol: Protocol = field(init=False, repr=False)
+    device_buckets: Optional[DeviceBuckets] = field(init=False, default=None, repr=False)
+    unauthenticated: Optional[Unauthenticated] = field(init=False, default=None, repr=False)
+    sock: Optional[socket.socket] = field(init=False, default=None, repr=False)
+
+    def __post_init__(self):
+        if self.ack_policy is AckPolicy.AFTER_WRITE and not self.sink.commits:
+            raise ValueError(f"{type(self.sink).__name__} cannot commit, AFTER_WRITE would ack unstored data")
+        if self.version is None:
+            self.protocol = shared_protocol(max_body_len=self.max_body_len)
+        else:
+            self.protocol = shared_protocol(self.version, self.max_body_len)
+        if self.device_limit is not None:
+            self.device_buckets = DeviceBuckets(self.device_limit)
+        if self.client_limits.max_unauthenticated is not None:
+            self.unauthenticated = Unauthenticated(self.client_limits.max_unauthenticated)
+
+    def open(self) -> socket.socket:
+        if self.sock is not None:  # taken over from a previous server
+            return self.sock
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(min(self.backlog, socket.SOMAXCONN))
+        sock.setblocking(False)
+        self.port = sock.getsockname()[1]  # the actual one when bound to port 0
+        self.sock = sock
+        return sock
+
+    def adopt(self, sock: socket.socket):
+        """Listens on a socket that is already bound, e.g. one handed off by another process."""
+        sock.setblocking(False)
+        self.host, self.port = sock.getsockname()[:2]
+        self.sock = sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.sink.close()
+
+    def decoder(self, frame: bytes, params_cache=None):
+        """Decoder for a connection whose first frame is `frame`."""
+        if self.version is not None:
+            return self.protocol.connection_decoder(None, params_cache)
+        return self.protocol.connection_decoder(frame, params_cache)
+
+    def resume_decoder(self, version: str, params_cache=None):
+        """Decoder for a handed off connection that speaks `version`."""
+        return create_decoder(version, self.max_body_len or MAX_BODY_LEN, params_cache)
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import threading
+    import time
+    import tracemalloc
+
+    from _wialonips.listener import Listener  # the server compares against this module's AckPolicy
+    from _wialonips.server import DeviceCredentials, Server
+    from _wialonips.types import PacketType
+
+    protocol = Protocol()
+    data = protocol.build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+
+    def session(port, imei, n=20):
+        with socket.create_connection(("127.0.0.1", port)) as c:
+            c.sendall(protocol.build_packet(PacketType.DEV_LOGIN, ["2.0", imei, "pw"]))
+            c.recv(64)
+            t = time.perf_counter()
+            for _ in range(n):
+                c.sendall(data)
+                c.recv(64)
+            return (time.perf_counter() - t) / n
+
+    for count in (1, 10, 100, 500):
+        with contextlib.redirect_stdout(io.StringIO()):  # the server prints every packet
+            server = Server(listeners=[])
+            threading.Thread(target=server.run, daemon=True).start()
+            while server._selector is None:
+                time.sleep(0.01)
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            for i in range(count):
+                server.add_listener(Listener(port=0, name=f"customer{i}",
+                                             credentials={str(d): DeviceCredentials(str(d), "pw") for d in range(3)}))
+            per_listener = (tracemalloc.get_traced_memory()[0] - before) / count
+            tracemalloc.stop()
+            rtt = min(session(server.listeners[-1].port, str(d)) for d in range(3))
+            server.stop()
+            time.sleep(1)  # lets the connection threads and the accept loop wind down
+        print(f"{count:4} listeners: {per_listener / 1024:5.1f} KiB and 1 fd per listener, "
+              f"packet round trip {rtt * 1e6:6.1f} us on the last one")
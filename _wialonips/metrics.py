@@ -0,0 +1,23 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    """Thread-safe counters, grouped by scope (a listener name, "" for global)."""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, n: int = 1, scope: str = ""):
+        with self._lock:
+            self._counters[scope][name] += n
+
+    def get(self, name: str, scope: str = "") -> int:
+        with self._lock:
+            return self._counters.get(scope, {}).get(name, 0)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {scope: dict(counters) for scope, counters in self._counters.items()}
@@ -0,0 +1,214 @@
+import sys
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+
+from _wialonips.types import *
+
+PARAM_SEPARATOR = ","
+LBS_PREFIXES = (LBS_MMC_PARAM, LBS_MNC_PARAM, LBS_LAC_PARAM, LBS_CELL_ID_PARAM)
+WIFI_PREFIXES = (WIFI_MAC_PARAM.split("%")[0], WIFI_RSSI_PARAM.split("%")[0])
+
+GROUP_PARAMS = 0
+GROUP_ALARM = 1
+GROUP_LBS = 2
+GROUP_WIFI = 3
+
+SHARED_SCHEMAS = 1024  # signatures compiled once for all connections
+
+
+def _converter(typ: Callable) -> Callable:
+    def convert(value: str):
+        if value == NOT_AVAILABLE:
+            return None
+        try:
+            return typ(value)
+        except (ValueError, TypeError):
+            print(f"Invalid param format {typ.__name__}.{value}")
+            return value
+
+    return convert
+
+
+CONVERTERS = {str(k): _converter(t) for k, t in ParamValueTypes.items()}
+
+
+def _group(key: str) -> int:
+    if key == ALARM_PARAM:
+        return GROUP_ALARM
+    if key.startswith(WIFI_PREFIXES):
+        return GROUP_WIFI
+    if key.startswith(LBS_PREFIXES):
+        return GROUP_LBS
+    return GROUP_PARAMS
+
+
+def _prefix(item: str) -> Optional[str]:
+    """'name:type:' part of a 'name:type:value' param."""
+    first = item.find(":")
+    second = item.find(":", first + 1) if first >= 0 else -1
+    if second < 0:
+        return None
+    return item[:second + 1]
+
+
+class ParamSchema:
+    """Precompiled layout of one observed param key/type signature."""
+
+    __slots__ = ("prefixes", "keys", "index", "_plain", "_grouped")
+
+    def __init__(self, prefixes: Tuple[Optional[str], ...]):
+        self.prefixes = prefixes
+        keys = []
+        index = {}
+        plain = []  # (item index, value offset, converter)
+        grouped = []  # (item index, value offset, converter, group, key)
+        for i, prefix in enumerate(prefixes):
+            if prefix is None:
+                continue
+            key, typ = prefix[:-1].split(":", 1)
+            convert = CONVERTERS.get(typ)
+            if convert is None:  # unknown value type, skipped like before
+                continue
+            key = sys.intern(key)
+            group = _group(key)
+            if group == GROUP_PARAMS:
+                if key in index:  # repeated key: first position, last value, as a dict would
+                    plain[index[key]] = (i, len(prefix), convert)
+                    continue
+                index[key] = len(keys)
+                keys.append(key)
+                plain.append((i, len(prefix), convert))
+            else:
+                grouped.append((i, len(prefix), convert, group, key))
+        self.keys = tuple(keys)
+        self.index = index
+        self._plain = tuple(plain)
+        self._grouped = tuple(grouped)
+
+    def matches(self, items) -> bool:
+        if len(items) != len(self.prefixes):
+            return False
+        for item, prefix in zip(items, self.prefixes):
+            if prefix is None or not item.startswith(prefix):
+                return False
+        return True
+
+    def parse(self, items) -> Tuple["Params", Dict, Dict, Optional[bool]]:
+        values = tuple([convert(items[i][offset:]) for i, offset, convert in self._plain])
+        lbs = {}
+        wifi = {}
+        alarm = None
+        for i, offset, convert, group, key in self._grouped:
+            value = convert(items[i][offset:])
+            if group == GROUP_ALARM:
+                alarm = value == 1
+            elif group == GROUP_LBS:
+                lbs[key] = value
+            else:
+                wifi[key] = value
+        return Params(self, values), lbs, wifi, alarm
+
+
+class Params(Mapping):
+    """Read-only mapping of typed param values sharing its keys with the schema."""
+
+    __slots__ = ("schema", "values")
+
+    def __init__(self, schema: ParamSchema, values: tuple):
+        self.schema = schema
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[self.schema.index[key]]
+
+    def __iter__(self):
+        return iter(self.schema.keys)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return repr(dict(zip(self.schema.keys, self.values)))
+
+
+@lru_cache(maxsize=SHARED_SCHEMAS)
+def shared_schema(prefixes: Tuple[Optional[str], ...]) -> ParamSchema:
+    """Schemas are immutable, devices of one model share theirs whatever connection they are on."""
+    return ParamSchema(prefixes)
+
+
+class ParamSchemaCache:
+    """Per-connection cache of param schemas.
+
+    A device sends the same key set on every packet, so after the first one
+    a packet's params are checked against the last schema with a prefix
+    compare per item and converted with precompiled converters. The
+    schemas themselves come from `shared_schema`.
+    """
+
+    __slots__ = ("max_schemas", "_schemas", "_last", "hits", "misses")
+
+    def __init__(self, max_schemas: int = 8):
+        self.max_schemas = max_schemas
+        self._schemas: "OrderedDict[tuple, ParamSchema]" = OrderedDict()
+        self._last: Optional[ParamSchema] = None
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, text: str):
+        items = text.split(PARAM_SEPARATOR)
+        schema = self._last
+        if schema is not None and schema.matches(items):
+            self.hits += 1
+            return schema.parse(items)
+
+        signature = tuple(_prefix(item) for item in items)
+        schema = self._schemas.get(signature)
+        if schema is None:
+            self.misses += 1
+            schema = shared_schema(signature)
+            self._schemas[schema.prefixes] = schema
+            if len(self._schemas) > self.max_schemas:
+                self._schemas.popitem(last=False)
+        else:
+            self.hits += 1
+            self._schemas.move_to_end(signature)
+        self._last = schema
+        return schema.parse(items)
+
+
+def parse_params(text: str):
+    """One-off parse without a cache: (params, lbs, wifi, alarm)."""
+    items = text.split(PARAM_SEPARATOR)
+    return shared_schema(tuple(_prefix(item) for item in items)).parse(items)
+
+
+if __name__ == "__main__":
+    import time
+
+    text = ",".join([
+        "battery:1:87", "fuel:2:34.5", "driver:3:john", "odometer:1:123456", "gsm:1:4",
+        "mcc1:1:255", "mnc1:1:1", "lac1:1:1001", "cell_id1:1:23456",
+        "wifi_mac_1:3:00:11:22:33:44:55", "wifi_rssi_1:1:-61", "SOS:1:0",
+    ] + [f"p{i}:1:{i}" for i in range(20)])
+
+    def legacy(text):
+        _params = {}
+        for param in text.split(","):
+            key, typ, value = param.split(":", 2)
+            if typ.isdigit() and (_typ := ParamValueTypes.get(int(typ))):
+                _params[key] = None if value == NOT_AVAILABLE else _typ(value)
+        alarm = _params.pop(ALARM_PARAM, None) == 1
+        lbs = {k: _params.pop(k) for k in list(_params) if k.startswith(LBS_PREFIXES)}
+        return _params, lbs, alarm
+
+    cache = ParamSchemaCache()
+    n = 50_000
+    for name, parse in (("dict per packet", legacy), ("schema cache", cache.parse)):
+        t = time.perf_counter()
+        for _ in range(n):
+            parse(text)
+        print(f"{name:16}: {(time.perf_counter() - t) * 1e6 / n:.1f} us/packet")
+    print(cache.parse(text))
@@ -0,0 +1,341 @@
+from typing import NamedTuple, Optional, Tuple
+
+from _wialonips.crc16 import crc16
+from _wialonips.framing import BINARY_FRAMES
+from _wialonips.params import ParamSchemaCache
+from _wialonips.protocol import DevPacket
+from _wialonips.types import *
+
+HASH = ord("#")
+FRAME_END = b"\r\n"
+NA = NOT_AVAILABLE.encode("ascii")
+SEP = SEPARATOR.encode("ascii")
+BLACKBOX_SEP = BLACKBOX_SEPARATOR.encode("ascii")
+BINARY_HEADERS = tuple(BINARY_FRAMES)
+
+PACKET_TYPES = {t.value.encode("ascii"): t for t in PacketType if t is not PacketType.UNKNOWN}
+
+
+def _str(value: bytes) -> Optional[str]:
+    return None if value == NA else value.decode("ascii")
+
+
+def _text(value: bytes) -> Optional[str]:
+    """Free text of a driver message, which the protocol sends as UTF-8."""
+    return None if value == NA else value.decode("utf-8")
+
+
+def _number(value: bytes):
+    if value == NA:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value.decode("ascii")
+
+
+# coordinates, date and time keep their leading zeros, so they stay strings
+SHORT_DATA_CONVERTERS = (_str,) * 6 + (_number,) * 4
+FULL_DATA_CONVERTERS = SHORT_DATA_CONVERTERS + (_number, _number, _number, _str, _str, _str)
+
+BODY_FORMATS = {
+    PacketType.DEV_LOGIN: (LoginBody._fields, (_str,) * len(LoginBody._fields)),
+    PacketType.DEV_SHORT_DATA: (ShortDataBody._fields, SHORT_DATA_CONVERTERS),
+    PacketType.DEV_EXTENDED_DATA: (FullDataBody._fields, FULL_DATA_CONVERTERS),
+    PacketType.DEV_PING: ((), ()),
+    PacketType.DEV_IMAGE: (ImageBody._fields, (_number,) * 3 + (_str,) * 3),
+    PacketType.DEV_DDD_INFO: (DddInfoBody._fields, (_str, _str)),
+    PacketType.DEV_DDD: (DddBody._fields, (_str,) + (_number,) * 3),
+    PacketType.DRV_MESSAGE: (("message",), (_text,)),
+}
+
+
+MAX_TYPE_LEN = 4
+MAX_CRC_LEN = 4
+MAX_BODY_LEN = 16 * 1024
+
+
+class ParseError(ValueError):
+    def __init__(self, message: str, typ: PacketType = PacketType.UNKNOWN, crc: bool = False):
+        super().__init__(message)
+        self.type = typ
+        self.crc = crc
+
+    @property
+    def code(self):
+        """Code to answer with; types that have no error answer still get one to mark the packet malformed."""
+        codes = CRC_ERROR_CODES if self.crc else STRUCT_ERROR_CODES
+        return codes.get(self.type, ResultCode.ERROR)
+
+    def packet(self, frame: bytes) -> DevPacket:
+        """The malformed packet, with the block index of an #I# or #T# frame when it can be read."""
+        return DevPacket(self.type, code=self.code, raw=frame, index=block_index(self.type, frame))
+
+
+class Token(NamedTuple):
+    type: PacketType
+    body_start: int
+    body_end: int  # one past the last separator, CRC covers [body_start, body_end)
+    crc: Optional[int]
+
+
+class Tokenizer:
+    """Deterministic state machine over a single frame.
+
+    START -> TYPE -> BODY -> CRC -> END. Every state moves forward over the
+    frame with a bounded bytes.find/rfind, so each byte is looked at a
+    constant number of times and tokenizing is O(n). Frames with a body
+    longer than `max_body_len` are rejected before the body is scanned.
+    """
+
+    def __init__(self, max_body_len: int = MAX_BODY_LEN):
+        self.max_body_len = max_body_len
+
+    def tokenize(self, packet: bytes) -> Token:
+        typ, start = self.header(packet)
+        return self.body(packet, typ, start)
+
+    @staticmethod
+    def header(packet: bytes) -> Tuple[PacketType, int]:
+        """START and TYPE states: packet type and the offset of its body."""
+        # START
+        if len(packet) < 5 or packet[0] != HASH:
+            raise ParseError("Missing packet header")
+
+        # TYPE
+        type_end = packet.find(b"#", 1, min(len(packet), 2 + MAX_TYPE_LEN))
+        if type_end < 0:
+            raise ParseError("Missing packet type")
+        typ = PACKET_TYPES.get(packet[1:type_end])
+        if typ is None:
+            raise ParseError("Unknown packet type")
+        return typ, type_end + 1
+
+    def body(self, packet: bytes, typ: PacketType, start: int) -> Token:
+        """BODY, CRC and END states for a body starting at `start`."""
+        # END is checked first so BODY and CRC know their bounds
+        if not packet.endswith(FRAME_END):
+            raise ParseError("Missing frame end", typ)
+        end = len(packet) - len(FRAME_END)
+
+        # BODY
+        if end - start > self.max_body_len + 1 + MAX_CRC_LEN:
+            raise ParseError("Body exceeds %d bytes" % self.max_body_len, typ)
+        sep = BLACKBOX_SEP if typ is PacketType.DEV_BLACKBOX else SEP
+        last = packet.rfind(sep, start, end)
+        if last < 0:
+            if start != end:
+                raise ParseError("Missing body separator", typ)
+            return Token(typ, start, start, None)
+        body_end = last + 1
+        if body_end - start > self.max_body_len:
+            raise ParseError("Body exceeds %d bytes" % self.max_body_len, typ)
+
+        # CRC
+        crc = None
+        if body_end < end:
+            if end - body_end > MAX_CRC_LEN:
+                raise ParseError("Invalid CRC", typ)
+            try:
+                crc = int(packet[body_end:end], 16)
+            except ValueError:
+                raise ParseError("Invalid CRC", typ) from None
+        return Token(typ, start, body_end, crc)
+
+
+class PacketParser:
+    """Parses device packets straight from bytes.
+
+    Drop-in replacement for `DevPacket.parse_from_bytes`: no ascii decode
+    of the whole frame, no regex, the CRC is computed over a memoryview of
+    the body. A malformed packet never raises, it comes back with `code`
+    set to the matching *ResponseCode.STRUCT_ERROR / CRC_ERROR.
+    """
+
+    def __init__(self, max_body_len: int = MAX_BODY_LEN):
+        self.tokenizer = Tokenizer(max_body_len)
+
+    def parse(self, packet: bytes, params_cache: Optional[ParamSchemaCache] = None) -> DevPacket:
+        """Parses one frame; custom params go through `params_cache` when given."""
+        try:
+            line, payload = split_binary(packet)
+            token = self.tokenizer.tokenize(line)
+            if token.crc is not None:
+                # the CRC of a packet with a binary block covers the block
+                data = memoryview(packet)[token.body_start:token.body_end] if payload is None else payload
+                if token.crc != crc16(data):
+                    raise ParseError("CRC check failed", token.type, crc=True)
+            if payload is not None:
+                return decode_binary(token.type, packet[token.body_start:token.body_end - 1], payload, packet)
+            if token.type is PacketType.DEV_BLACKBOX:
+                return self._parse_blackbox(packet, token, params_cache)
+            return self._parse_body(packet, token, params_cache)
+        except ParseError as exc:
+            return exc.packet(packet)
+        except UnicodeDecodeError:
+            return ParseError("Undecodable field").packet(packet)
+
+    @staticmethod
+    def _parse_body(packet: bytes, token: Token, params_cache: Optional[ParamSchemaCache] = None) -> DevPacket:
+        typ = token.type
+        if typ not in BODY_FORMATS:
+            return DevPacket(typ, raw=packet)
+        return decode_body(typ, packet[token.body_start:token.body_end - 1], packet, params_cache)
+
+    @staticmethod
+    def _parse_blackbox(packet: bytes, token: Token, params_cache: Optional[ParamSchemaCache] = None) -> DevPacket:
+        # #B#msg|msg|...|crc\r\n
+        if token.body_end == token.body_start:
+            raise ParseError("Empty blackbox packet", token.type)
+        return decode_blackbox(packet[token.body_start:token.body_end - 1], packet, params_cache)
+
+
+def decode_body(typ: PacketType, body: bytes, raw: bytes,
+                params_cache: Optional[ParamSchemaCache] = None, formats: dict = BODY_FORMATS) -> DevPacket:
+    """Builds a packet of type `typ` from its body without the trailing separator and CRC."""
+    values = body.split(SEP) if body else []
+    return _packet(typ, _fields(typ, values, formats=formats), params_cache, raw=raw)
+
+
+def decode_binary(typ: PacketType, body: bytes, payload: bytes, raw: bytes) -> DevPacket:
+    """Builds an #I# or #T# packet from its header body and the binary block that followed it."""
+    packet = decode_body(typ, body, raw)
+    if packet.size != len(payload):
+        raise ParseError("Expected %s bytes of binary block, got %d" % (packet.size, len(payload)), typ)
+    packet.payload = payload
+    return packet
+
+
+def split_binary(packet: bytes) -> Tuple[bytes, Optional[bytes]]:
+    """Header line and binary block of an #I# or #T# frame, (packet, None) for any other frame."""
+    if not packet.startswith(BINARY_HEADERS):
+        return packet, None
+    end = packet.find(FRAME_END)
+    if end < 0:
+        raise ParseError("Missing frame end")
+    end += len(FRAME_END)
+    return packet[:end], packet[end:]
+
+
+def block_index(typ: PacketType, packet: bytes) -> Optional[int]:
+    """Index field of a possibly malformed #I# or #T# frame, None when it cannot be read."""
+    if typ not in INDEXED_RESPONSE_TYPES:
+        return None
+    field = BODY_FORMATS[typ][0].index("index")
+    start = packet.find(b"#", 1, 2 + MAX_TYPE_LEN) + 1
+    end = packet.find(FRAME_END, start)
+    if not start or end < 0:
+        return None
+    values = packet[start:end].split(SEP, field + 1)
+    try:
+        return int(values[field])
+    except (IndexError, ValueError):
+        return None
+
+
+def decode_blackbox(body: bytes, raw: bytes, params_cache: Optional[ParamSchemaCache] = None) -> DevPacket:
+    """Builds a #B# packet from 'msg|msg|...' without the trailing separator and CRC."""
+    packets = []
+    for message in body.split(BLACKBOX_SEP):
+        values = message.split(SEP)
+        if len(values) == len(FullDataBody._fields):
+            typ = PacketType.DEV_EXTENDED_DATA
+        else:
+            typ = PacketType.DEV_SHORT_DATA
+        packets.append(_packet(typ, _fields(typ, values, PacketType.DEV_BLACKBOX), params_cache))
+    return DevPacket(PacketType.DEV_BLACKBOX, raw=raw, packets=packets)
+
+
+def _fields(typ: PacketType, values: list, packet_type: Optional[PacketType] = None,
+            formats: dict = BODY_FORMATS) -> dict:
+    names, converters = formats[typ]
+    if len(values) != len(names):
+        raise ParseError("Expected %d fields, got %d" % (len(names), len(values)), packet_type or typ)
+    try:
+        return {name: conv(v) for name, conv, v in zip(names, converters, values)}
+    except UnicodeDecodeError:
+        raise ParseError("Undecodable field", packet_type or typ) from None
+
+
+def _packet(typ: PacketType, fields: dict, params_cache: Optional[ParamSchemaCache], **kwargs) -> DevPacket:
+    params = fields.get("params")
+    if params_cache is None or not isinstance(params, str):
+        return DevPacket(typ, **fields, **kwargs)
+    fields["params"], lbs, wifi, alarm = params_cache.parse(params)
+    packet = DevPacket(typ, **fields, **kwargs)
+    packet.lbs = lbs
+    packet.wifi = wifi
+    if alarm is not None:
+        packet.alarm = alarm
+    return packet
+
+
+_parser = PacketParser()
+
+
+def parse_packet(packet: bytes) -> DevPacket:
+    return _parser.parse(packet)
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import random
+    import time
+
+    from _wialonips.protocol import Protocol
+
+    protocol = Protocol()
+    samples = {
+        "login": protocol.build_packet(PacketType.DEV_LOGIN, ["2.0", "865432100012345", "secret"]),
+        "short": protocol.build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9),
+        "extended": protocol.build_data_packet(
+            None, 50.45, 30.52, 60, 90, 150, 9, 1.2, 5, 0, [12.4, 0.5], "NA",
+            battery=87, fuel=34.5, driver="john", odometer=123456, gsm=4,
+            mcc1=255, mnc1=1, lac1=1001, cell_id1=23456,
+        ),
+    }
+    params_cache = ParamSchemaCache()
+
+    def legacy(packet):
+        try:
+            return DevPacket.parse_from_bytes(packet)
+        except Exception:  # legacy parser raises on bad CRC / field count
+            return None
+
+    def bench(parse, packet, n=20_000):
+        with contextlib.redirect_stdout(io.StringIO()):  # legacy parser prints
+            t = time.perf_counter()
+            for _ in range(n):
+                parse(packet)
+            return (time.perf_counter() - t) * 1e6 / n
+
+    for name, packet in samples.items():
+        slow = bench(legacy, packet)
+        fast = bench(parse_packet, packet)
+        cached = bench(lambda p: _parser.parse(p, params_cache), packet)
+        print(f"{name:9}: regex {slow:5.1f} us, bytes {fast:5.1f} us, x{slow / fast:.1f}, "
+              f"bytes + params cache {cached:5.1f} us")
+
+    def corpus(size):
+        rnd = random.Random(size)
+        yield "random bytes", bytes(rnd.getrandbits(8) for _ in range(size))
+        yield "separators", b"#D#" + b";" * size + b"zz\r\n"
+        yield "hex runs", b"#D#" + b";abcdef0123" * (size // 11) + b";x\r\n"
+        yield "no frame end", b"#D#" + b"1;" * (size // 2)
+        yield "long type", b"#" + b"A" * size + b"\r\n"
+        yield "bad crc", b"#D#" + b"NA;" * (size // 3) + b"FFFF\r\n"
+
+    print("fuzz corpus, worst case per parse:")
+    for size in (1024, 16 * 1024, 64 * 1024):
+        worst = {"regex": (0, ""), "bytes": (0, "")}
+        for name, packet in corpus(size):
+            for label, parse in (("regex", legacy), ("bytes", parse_packet)):
+                t = bench(parse, packet, n=20)
+                if t > worst[label][0]:
+                    worst[label] = (t, name)
+        print(f"{size:6} bytes: " + ", ".join(f"{k} {t:8.1f} us ({name})" for k, (t, name) in worst.items()))
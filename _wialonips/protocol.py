@@ -1,13 +1,16 @@
 from dataclasses import dataclass, field
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional, Any, Union, Dict, List
 
 from _wialonips.crc16 import crc16
+from _wialonips.framing import compress_frame
+from _wialonips.params import parse_params
 from _wialonips.types import *
 from _wialonips.utils import parse_datetime, dms_to_decimal, decimal_to_ddmm
 
 
-@dataclass
+@dataclass(slots=True)  # one per message, no instance dict
 class DevPacket:
     type: PacketType
     protocol_version: Optional[int] = None
@@ -39,6 +42,20 @@ class DevPacket:
     params: Dict[str, str] = field(default_factory=dict)
 
     lbs: Dict[str, Union[float, int]] = field(init=False, default_factory=dict)
+    wifi: Dict[str, Union[str, int]] = field(init=False, default_factory=dict)
+
+    packets: List["DevPacket"] = field(default_factory=list)  # #B# messages
+
+    message: Optional[str] = None  # #M# driver message
+    ack: Optional[str] = None  # answer code of #AM#
+
+    # #I# image / #IT#, #T# tachograph file block
+    file_id: Optional[str] = None
+    size: Optional[int] = None
+    index: Optional[int] = None
+    count: Optional[int] = None
+    name: Optional[str] = None
+    payload: Optional[bytes] = None
 
     def __post_init__(self):
         self._parse_adc()
@@ -51,6 +68,9 @@ class DevPacket:
         except UnicodeDecodeError:
             return DevPacket(type=PacketType.UNKNOWN, code=LoginResponseCode.ERROR, raw=packet)
 
+        if _packet.startswith("#%s#" % PacketType.DEV_BLACKBOX.value):
+            return cls._parse_blackbox(packet, _packet)
+
         match = INCOMING_PACKET_REGEX.fullmatch(_packet)
 
         if not match:
@@ -94,6 +114,27 @@ class DevPacket:
         _kwargs = format_(*params)._asdict()
         return cls(_typ, code=None, raw=packet, **_kwargs)
 
+    @classmethod
+    def _parse_blackbox(cls, packet: bytes, _packet: str) -> "DevPacket":
+        # #B#msg|msg|...|crc\r\n
+        body = _packet[3:].rstrip("\r\n")
+        *messages, crc = body.split(BLACKBOX_SEPARATOR)
+        if not messages:
+            return cls(PacketType.UNKNOWN, code=LoginResponseCode.ERROR, raw=packet)
+        if crc:
+            cls.crc_check(body[:len(body) - len(crc)].encode('ascii'), crc.encode('ascii'))
+
+        packets = []
+        for message in messages:
+            params = [None if value == NOT_AVAILABLE else value for value in message.split(SEPARATOR)]
+            if len(params) == len(FullDataBody._fields):
+                packets.append(cls(PacketType.DEV_EXTENDED_DATA, **FullDataBody(*params)._asdict()))
+            elif len(params) == len(ShortDataBody._fields):
+                packets.append(cls(PacketType.DEV_SHORT_DATA, **ShortDataBody(*params)._asdict()))
+            else:
+                return cls(PacketType.UNKNOWN, code=LoginResponseCode.ERROR, raw=packet)
+        return cls(PacketType.DEV_BLACKBOX, raw=packet, packets=packets)
+
     @classmethod
     def crc_check(cls, body: bytes, expected_crc: bytes):
         print(cls.crc_body(body), expected_crc)
@@ -113,32 +154,10 @@ class DevPacket:
 
     def _parse_params(self) -> None:
         if self.params and isinstance(self.params, str):
-            params = self.params.split(",")
-            _params = {}
-
-            for param in params:
-                key, typ, value = param.split(":")
-
-                if typ.isdigit() and (_typ := ParamValueTypes.get(int(typ))):
-                    try:
-                        _params[key] = None if value == NOT_AVAILABLE else _typ(value)
-                    except (ValueError, TypeError):
-                        print(f"Invalid param format {key}.{_typ}.{value}")
-                        _params[key] = value
-
-            # if alarm
-            if ALARM_PARAM in _params:
-                self.alarm = _params.pop(ALARM_PARAM) == 1
-
-            # if lbs
-            for key, value in _params.items():
-                if key.startswith((LBS_MMC_PARAM, LBS_MNC_PARAM, LBS_LAC_PARAM, LBS_CELL_ID_PARAM)):
-                    try:
-                        self.lbs[key] = _params.pop(key)
-                    except (ValueError, TypeError):
-                        print(f"Invalid LBS Params format {key}: {value}")
-
-            self.params = _params
+            params, self.lbs, self.wifi, alarm = parse_params(self.params)
+            if alarm is not None:
+                self.alarm = alarm
+            self.params = params
 
     @property
     def datetime(self):
@@ -166,6 +185,8 @@ class DevPacket:
 
     @staticmethod
     def _map_io(field):
+        if isinstance(field, int):
+            return [(field >> bit) & 1 for bit in range(32)]
         if field:
             if isinstance(field, str) and field.isdigit():
                 mask = int(field)
@@ -184,8 +205,10 @@ def _stringify(object):
 
 class Protocol:
 
-    def __init__(self, version="2.2"):
+    def __init__(self, version="2.2", max_body_len: Optional[int] = None):
         self.version = version
+        self.max_body_len = max_body_len
+        self._parser = None
 
     def build_login_packet(self, imei, password):
         return self.build_packet(PacketType.DEV_LOGIN, data=[imei, password])
@@ -291,9 +314,19 @@ class Protocol:
                                         speed, course, alt, sats)]
         return self.build_packet(PacketType.DEV_SHORT_DATA, data=data)
 
-    def build_black_box_packet(self, packets):
-        data = "|".join(packets)
-        return self.build_packet(PacketType.DEV_BLACKBOX, data=[data])
+    def build_black_box_packet(self, packets, compress_threshold: Optional[int] = None):
+        """Batches message bodies into #B#msg|msg|...|crc.
+
+        With `compress_threshold` set, packets longer than that are sent as a
+        compressed frame when it makes them smaller.
+        """
+        body = "".join(
+            (p[:-1] if p.endswith(SEPARATOR) else p) + BLACKBOX_SEPARATOR for p in packets
+        ).encode("ascii")
+        packet = b"#%s#" % PacketType.DEV_BLACKBOX.value.encode("ascii") + body + DevPacket.crc_body(body) + b"\r\n"
+        if compress_threshold is not None and len(packet) > compress_threshold:
+            return compress_frame(packet)
+        return packet
 
     def build_packet(self, packet_type: PacketType, data=None) -> bytes:
         header = f"#{packet_type.value}#"
@@ -301,8 +334,42 @@ class Protocol:
         crc = DevPacket.crc_body(body)
         return header.encode("ascii") + body + crc + b"\r\n"
 
-    def parse_incoming_packet_from_dev(self, packet: bytes) -> Optional[DevPacket]:
-        return DevPacket.parse_from_bytes(packet)
+    def build_driver_message(self, text: str) -> bytes:
+        """#M# packet for the driver, 1.1 devices get it without CRC."""
+        if self.version.startswith("1."):
+            return f"#{PacketType.DRV_MESSAGE.value}#{text}\r\n".encode()
+        return self.build_packet(PacketType.DRV_MESSAGE, [text])
+
+    def parse_incoming_packet_from_dev(self, packet: bytes, params_cache=None) -> Optional[DevPacket]:
+        if self._parser is None:
+            from _wialonips.parser import PacketParser, MAX_BODY_LEN  # parser builds DevPacket, import lazily
+            self._parser = PacketParser(self.max_body_len or MAX_BODY_LEN)
+        return self._parser.parse(packet, params_cache)
+
+    def connection_decoder(self, login: Optional[bytes] = None, params_cache=None):
+        """Decoder for one connection, picked from its #L# frame or `self.version`."""
+        from _wialonips.decoder import MAX_BODY_LEN, create_decoder, login_version  # builds DevPacket
+        version = self.version if login is None else login_version(login, self.version)
+        return create_decoder(version, self.max_body_len or MAX_BODY_LEN, params_cache)
+
+    def build_response(self, packet_type: PacketType, code: Any = "") -> bytes:
+        """Answer to a device packet, e.g. #AD#16 for a D packet with a bad CRC."""
+        code = getattr(code, "value", code)
+        return f"#{RESPONSE_TYPES[packet_type].value}#{code}\r\n".encode("ascii")
+
+    def build_error_response(self, packet: DevPacket) -> Optional[bytes]:
+        """Answer to a malformed device packet, e.g. #AI#3;0 for a broken block 3 of an image.
+
+        None when the type has no error answer (#P#), or the block index of
+        an #I# or #T# could not be read.
+        """
+        if packet.type not in STRUCT_ERROR_CODES:
+            return None
+        if packet.type in INDEXED_RESPONSE_TYPES:
+            if packet.index is None:
+                return None
+            return self.build_response(packet.type, f"{packet.index};{getattr(packet.code, 'value', packet.code)}")
+        return self.build_response(packet.type, packet.code)
 
     def parse_upcoming_packet(self, packet: bytes) -> Optional[DevPacket]:
         try:
@@ -337,6 +404,16 @@ class Protocol:
         return DevPacket(_typ, code, packet)
 
 
+
+@lru_cache(maxsize=None)
+def shared_protocol(version: str = "2.2", max_body_len: Optional[int] = None) -> Protocol:
+    """One Protocol per profile for every connection using it, it keeps no per-device state.
+
+    The instance is shared: do not change its attributes, ask for another profile.
+    """
+    return Protocol(version, max_body_len)
+
+
 if __name__ == "__main__":
     p = Protocol()
     # r = p.parse_upcoming_packet(b"#AD#15.1\r\n")
@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+MAX_DEVICES = 100_000  # per-IMEI bucket pairs kept, the least recently used ones are dropped
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` of them saved up.
+
+    `take` never refuses: a bucket that runs short goes into debt and
+    tells how long the caller has to wait for it to be paid off.
+    """
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def take(self, n: float, now: Optional[float] = None) -> float:
+        """Takes `n` tokens, returns the seconds until the bucket is out of debt."""
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Packets and bytes per second, None for no limit.
+
+    `burst` is how many seconds worth of traffic a quiet device may send
+    at once, e.g. the messages of a #B# packet after a reconnect.
+    """
+    packets: Optional[float] = None
+    bytes: Optional[float] = None
+    burst: float = 1.0
+
+    def buckets(self) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        return (None if self.packets is None else TokenBucket(self.packets, self.packets * self.burst),
+                None if self.bytes is None else TokenBucket(self.bytes, self.bytes * self.burst))
+
+
+class DeviceBuckets:
+    """Buckets per IMEI, kept across reconnects so reconnecting does not refill them."""
+
+    def __init__(self, limit: RateLimit, max_devices: int = MAX_DEVICES):
+        self.limit = limit
+        self.max_devices = max_devices
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, imei: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        with self._lock:
+            buckets = self._buckets.get(imei)
+            if buckets is None:
+                buckets = self._buckets[imei] = self.limit.buckets()
+                if len(self._buckets) > self.max_devices:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(imei)
+            return buckets
+
+
+class Throttle:
+    """The buckets one connection is charged to: its own and, once logged in, its device's."""
+    __slots__ = ("packets", "bytes")
+
+    def __init__(self, limit: Optional[RateLimit] = None):
+        self.packets: List[TokenBucket] = []
+        self.bytes: List[TokenBucket] = []
+        if limit is not None:
+            self.add(*limit.buckets())
+
+    def add(self, packets: Optional[TokenBucket], nbytes: Optional[TokenBucket]):
+        if packets is not None:
+            self.packets.append(packets)
+        if nbytes is not None:
+            self.bytes.append(nbytes)
+
+    def delay(self, packets: int, nbytes: int) -> float:
+        """Charges one read, returns the seconds to wait before the next one."""
+        if not self.packets and not self.bytes:
+            return 0.0
+        now = time.monotonic()
+        delay = 0.0
+        for bucket in self.packets:
+            delay = max(delay, bucket.take(packets, now))
+        for bucket in self.bytes:
+            delay = max(delay, bucket.take(nbytes, now))
+        return delay
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import shutil
+    import socket
+    import statistics
+    import tempfile
+
+    from _wialonips.listener import Listener
+    from _wialonips.protocol import Protocol
+    from _wialonips.server import DeviceCredentials, Server
+    from _wialonips.types import PacketType
+
+    devices, seconds = 20, 3
+    protocol = Protocol()
+    data = protocol.build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+    credentials = {str(d): DeviceCredentials(str(d), "pw") for d in range(devices + 1)}
+    directory = tempfile.mkdtemp()
+
+    def login(port, imei):
+        c = socket.create_connection(("127.0.0.1", port))
+        c.sendall(protocol.build_packet(PacketType.DEV_LOGIN, ["2.0", imei, "pw"]))
+        c.recv(64)
+        return c
+
+    def flood(c, stop, stats):
+        """Broken firmware: sends as fast as the socket takes it, acks are read aside."""
+        def acks():
+            while chunk := c.recv(65536):
+                stats["acked"] += chunk.count(b"\n")
+
+        threading.Thread(target=acks, daemon=True).start()
+        burst = data * 100
+        try:
+            while not stop.is_set():
+                c.sendall(burst)
+        except OSError:
+            pass  # shut down at the end of the run
+
+    def tracker(port, imei, stop, latency):
+        with login(port, imei) as c:
+            while not stop.is_set():
+                t = time.perf_counter()
+                c.sendall(data)
+                c.recv(64)
+                latency.append(time.perf_counter() - t)
+                time.sleep(0.02)
+
+    def run(limit):
+        latency, stats, stop = [], {"acked": 0}, threading.Event()
+        server = Server(image_dir=directory, ddd_dir=directory,
+                        listeners=[Listener(port=0, credentials=credentials, device_limit=limit)])
+        # the server prints every packet, the flood connection ends in a reset
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            threading.Thread(target=server.run, daemon=True).start()
+            while not server._running:
+                time.sleep(0.01)
+            port = server.listeners[0].port
+            flooder = login(port, str(devices))
+            threads = [threading.Thread(target=flood, args=(flooder, stop, stats))]
+            threads += [threading.Thread(target=tracker, args=(port, str(d), stop, latency)) for d in range(devices)]
+            for t in threads:
+                t.start()
+            time.sleep(seconds)
+            stop.set()
+            flood_rate = stats["acked"] / seconds
+            flooder.shutdown(socket.SHUT_RDWR)
+            for t in threads:
+                t.join()
+            flooder.close()
+            server.stop()
+            time.sleep(1)
+        latency.sort()
+        metrics = server.metrics
+        print(f"{str(limit or 'no limit'):46}: flood device served {flood_rate:7.0f} pkt/s; "
+              f"{devices} other devices ack median {statistics.median(latency) * 1e3:5.2f} ms, "
+              f"p99 {latency[int(len(latency) * .99)] * 1e3:6.2f} ms, {len(latency)} acks; "
+              f"throttled {metrics.get('throttled', 'default')}x")
+
+    run(None)
+    run(RateLimit(packets=100, bytes=16 * 1024))
+    shutil.rmtree(directory)
@@ -0,0 +1,258 @@
+import select
+import socket
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+_poll = getattr(select, "poll", None)  # select() is limited to fds below 1024
+RETRY_DELAY = 0.01  # s, doubled on every pass over the retry list
+SEND_TIMEOUT = 5  # s for a whole broadcast to leave the server
+
+
+def _writable(sock: socket.socket) -> bool:
+    """True when the send buffer of `sock` has room right now."""
+    if _poll is None:
+        return bool(select.select([], [sock], [], 0)[1])
+    poller = _poll()
+    poller.register(sock, select.POLLOUT)
+    return bool(poller.poll(0))
+
+
+class Broadcast:
+    """Delivery state of one message written to many devices.
+
+    `pending` holds the devices that got the message and have not answered
+    with #AM# yet; `delivered` and `rejected` the ones that answered with
+    1 and anything else; `failed` the ones it could not be written to.
+    """
+
+    def __init__(self):
+        self.targets = 0
+        self.pending = set()
+        self.delivered = set()
+        self.rejected: Dict[str, str] = {}
+        self.failed: Dict[str, str] = {}
+        self.started = time.perf_counter()
+        self.sent_at: Optional[float] = None
+        self.done_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def on_ack(self, imei: str, ok: bool, code: str = ""):
+        with self._lock:
+            self.pending.discard(imei)
+            if ok:
+                self.delivered.add(imei)
+            else:
+                self.rejected[imei] = code
+            self._check_done()
+
+    def on_failed(self, imei: str, reason: str):
+        """The message could not be written to `imei`."""
+        with self._lock:
+            self.pending.discard(imei)
+            self.failed[imei] = reason
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits for all acks, True when nothing is pending anymore."""
+        return self._done.wait(timeout)
+
+    @property
+    def send_time(self) -> Optional[float]:
+        return None if self.sent_at is None else self.sent_at - self.started
+
+    def _check_done(self):
+        if self.sent_at is not None and not self.pending and not self._done.is_set():
+            self.done_at = time.perf_counter()
+            self._done.set()
+
+    def __str__(self):
+        return (f"{len(self.delivered)}/{self.targets} delivered, {len(self.pending)} pending, "
+                f"{len(self.rejected)} rejected, {len(self.failed)} failed, sent in {self.send_time or 0:.3f} s")
+
+
+class ConnectionRegistry:
+    """Authenticated devices of a server keyed by IMEI.
+
+    Devices are objects with `connection`, `send_lock` and `protocol`, like
+    the server `Device`. `broadcast` writes one encoded message to many of
+    them and matches the #AM# answers to it: every device answers its
+    messages in order, so each keeps a queue of broadcasts awaiting an ack.
+    """
+
+    def __init__(self):
+        self._devices: Dict[str, object] = {}
+        self._awaiting: Dict[str, Deque[Broadcast]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, imei: str, device) -> bool:
+        """Registers `device`, False when the IMEI is already connected."""
+        with self._lock:
+            if imei in self._devices:
+                return False
+            self._devices[imei] = device
+            return True
+
+    def remove(self, imei: str):
+        with self._lock:
+            self._devices.pop(imei, None)
+            awaiting = self._awaiting.pop(imei, ())
+        for broadcast in awaiting:
+            broadcast.on_ack(imei, False, "disconnected")
+
+    def get(self, imei: str):
+        return self._devices.get(imei)
+
+    def __contains__(self, imei: str) -> bool:
+        return imei in self._devices
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return dict(self._devices)
+
+    def on_ack(self, imei: str, code: str):
+        """#AM# answer of `imei` to the oldest message it has not answered."""
+        with self._lock:
+            awaiting = self._awaiting.get(imei)
+            broadcast = awaiting.popleft() if awaiting else None
+        if broadcast is not None:
+            broadcast.on_ack(imei, code == "1", code)
+
+    def broadcast(self, text: str, imeis: Optional[Iterable[str]] = None,
+                  timeout: float = SEND_TIMEOUT) -> Broadcast:
+        """Sends a driver message (#M#) to `imeis`, all connected devices by default.
+
+        The packet is built once per protocol version. Every device gets a
+        non-blocking write of the same bytes; devices whose send buffer is
+        full or whose connection is busy with another packet go to a retry
+        list that is walked again with a growing delay until `timeout`.
+        Returns as soon as the bytes are written; acks arrive on the
+        returned Broadcast.
+        """
+        devices = self.snapshot()
+        broadcast = Broadcast()
+        packets: Dict[str, bytes] = {}
+        retry: List[tuple] = []
+        for imei in (devices if imeis is None else imeis):
+            broadcast.targets += 1
+            device = devices.get(imei)
+            if device is None:
+                broadcast.on_failed(imei, "not connected")
+                continue
+            version = device.protocol.version
+            data = packets.get(version)
+            if data is None:
+                data = packets[version] = device.protocol.build_driver_message(text)
+            retry.append((imei, device, data))
+
+        deadline = time.perf_counter() + timeout
+        delay = RETRY_DELAY
+        while retry:
+            retry = [item for item in retry if not self._try_send(broadcast, *item)]
+            if not retry:
+                break
+            if time.perf_counter() + delay > deadline:
+                for imei, _, _ in retry:
+                    broadcast.on_failed(imei, "send timed out")
+                break
+            time.sleep(delay)
+            delay *= 2
+
+        with broadcast._lock:
+            broadcast.sent_at = time.perf_counter()
+            broadcast._check_done()
+        return broadcast
+
+    def _try_send(self, broadcast: Broadcast, imei: str, device, data: bytes) -> bool:
+        """One non-blocking attempt, False to retry later."""
+        if not device.send_lock.acquire(blocking=False):
+            return False  # another packet is being written to this device
+        try:
+            conn = device.connection
+            if (not MSG_DONTWAIT or conn.gettimeout() is not None) and not _writable(conn):
+                return False  # the send would wait: no such flag here, or Python polls with the socket timeout
+            # registered first, the answer may come before send() returns
+            self._expect(broadcast, imei)
+            try:
+                sent = conn.send(data, MSG_DONTWAIT)
+            except (BlockingIOError, TimeoutError):
+                self._forget(broadcast, imei)
+                return False
+            except OSError as exc:
+                self._fail(broadcast, imei, exc)
+                return True
+            if sent < len(data):
+                try:
+                    conn.sendall(data[sent:])  # a packet is never left half written
+                except OSError as exc:  # a timeout too, the device got part of the packet
+                    self._fail(broadcast, imei, exc)
+            return True
+        finally:
+            device.send_lock.release()
+
+    def _expect(self, broadcast: Broadcast, imei: str):
+        with self._lock:
+            self._awaiting.setdefault(imei, deque()).append(broadcast)
+        with broadcast._lock:
+            broadcast.pending.add(imei)
+
+    def _fail(self, broadcast: Broadcast, imei: str, exc: OSError):
+        self._forget(broadcast, imei)
+        broadcast.on_failed(imei, str(exc) or type(exc).__name__)
+
+    def _forget(self, broadcast: Broadcast, imei: str):
+        with self._lock:
+            awaiting = self._awaiting.get(imei)
+            if awaiting and broadcast in awaiting:
+                awaiting.remove(broadcast)
+        with broadcast._lock:
+            broadcast.pending.discard(imei)
+
+
+if __name__ == "__main__":
+    import resource
+
+    from _wialonips.protocol import Protocol
+
+    class Target:
+        def __init__(self, connection):
+            self.connection = connection
+            self.send_lock = threading.Lock()
+            self.protocol = Protocol()
+
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    devices = min(50_000, (soft - 100) // 2)
+    registry = ConnectionRegistry()
+    pairs = [socket.socketpair() for _ in range(devices)]
+    for i, (a, _) in enumerate(pairs):
+        registry.add(str(i), Target(a))
+
+    def per_device_encode():
+        t = time.perf_counter()
+        for imei, device in registry.snapshot().items():
+            device.connection.sendall(device.protocol.build_driver_message("Return to base"))
+        return time.perf_counter() - t
+
+    def drain():
+        for _, b in pairs:
+            b.recv(4096)
+
+    baseline = per_device_encode()
+    drain()
+    broadcast = registry.broadcast("Return to base")
+    t = time.perf_counter()
+    for imei in range(devices):
+        registry.on_ack(str(imei), "1")
+    acks = time.perf_counter() - t
+    assert broadcast.wait(0) and len(broadcast.delivered) == devices
+    print(f"{devices} devices: encode per device {baseline:.3f} s, broadcast {broadcast.send_time:.3f} s "
+          f"(~{broadcast.send_time * 50_000 / devices:.2f} s for 50k), acks {acks:.3f} s")
+    print(broadcast)
+    for a, b in pairs:
+        a.close()
+        b.close()
@@ -0,0 +1,229 @@
+import mmap
+import os
+import select
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from _wialonips.crc16 import crc16
+from _wialonips.guard import send_timeout, set_send_timeout
+from _wialonips.types import *
+
+_poll = getattr(select, "poll", None)  # select() is limited to fds below 1024
+
+MAX_CONCURRENT = 32
+CHUNK_SIZE = 64 * 1024
+STALL_TIMEOUT = 30  # s without any progress before a target is given up
+
+UPLOAD_TYPES = (PacketType.SRV_UPLOAD_SOFTWARE, PacketType.SRV_UPLOAD_CONFIGURATION)
+
+
+@dataclass
+class RolloutReport:
+    targets: int = 0
+    completed: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)  # IMEI -> reason
+    bytes_sent: int = 0
+    setup: float = 0.0  # s to map the file and compute its CRC
+    elapsed: float = 0.0  # s from the first byte sent to the last transfer done
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second over the whole rollout."""
+        return self.bytes_sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{len(self.completed)}/{self.targets} devices, {len(self.failed)} failed, "
+                f"{self.bytes_sent / 2 ** 20:.1f} MiB in {self.elapsed:.2f} s, "
+                f"{self.throughput / 2 ** 20:.1f} MiB/s, setup {self.setup:.2f} s")
+
+
+def upload_header(packet_type: PacketType, size: int, crc: int) -> bytes:
+    """#US#sz;crc16\\r\\n or #UC#sz;crc16\\r\\n, the CRC covers the binary block that follows."""
+    return f"#{packet_type.value}#{size};{crc:0X}\r\n".encode("ascii")
+
+
+def _writable(sock: socket.socket, timeout: float) -> bool:
+    """Waits up to `timeout` seconds for room in the send buffer of `sock`."""
+    timeout = max(0.0, timeout)
+    if _poll is None:
+        return bool(select.select([], [sock], [], timeout)[1])
+    poller = _poll()
+    poller.register(sock, select.POLLOUT)
+    return bool(poller.poll(timeout * 1000))
+
+
+class Rollout:
+    """Streams one file to many connected devices.
+
+    The file is opened and mapped once. Every target gets the same header
+    and then the file itself through `os.sendfile` (or slices of the shared
+    map where sendfile is missing), so no per-device copy is made. At most
+    `max_concurrent` transfers run at a time. A send that finds the socket
+    buffer full waits for room and goes on; a target that makes no
+    progress for `stall_timeout` seconds is given up. A target whose
+    transfer fails is shut down: the device would take the next packet
+    for the rest of the file, it reconnects instead.
+
+    `targets` maps IMEI to an object with `connection` and `send_lock`,
+    e.g. a server `Device`: the lock keeps other packets out of the frame.
+    """
+
+    def __init__(self, path: str, packet_type: PacketType = PacketType.SRV_UPLOAD_SOFTWARE,
+                 max_concurrent: int = MAX_CONCURRENT, chunk_size: int = CHUNK_SIZE,
+                 stall_timeout: float = STALL_TIMEOUT):
+        if packet_type not in UPLOAD_TYPES:
+            raise ValueError(f"Not an upload packet type: {packet_type}")
+        self.path = path
+        self.packet_type = packet_type
+        self.max_concurrent = max_concurrent
+        self.chunk_size = chunk_size
+        self.stall_timeout = stall_timeout
+        self._lock = threading.Lock()
+
+    def run(self, targets: Dict[str, object], imeis: Optional[Iterable[str]] = None) -> RolloutReport:
+        report = RolloutReport()
+        if imeis is None:
+            imeis = list(targets)
+        setup = time.perf_counter()
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                raise ValueError(f"Empty upload file: {self.path}")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                header = upload_header(self.packet_type, size, crc16(memoryview(data)))
+                start = time.perf_counter()
+                report.setup = start - setup
+                with ThreadPoolExecutor(self.max_concurrent) as pool:
+                    for imei in imeis:
+                        report.targets += 1
+                        target = targets.get(imei)
+                        if target is None:
+                            report.failed[imei] = "not connected"
+                            continue
+                        pool.submit(self._push, report, imei, target, header, f.fileno(), data, size)
+                report.elapsed = time.perf_counter() - start
+        return report
+
+    def _push(self, report, imei, target, header, fd, data, size):
+        try:
+            with target.send_lock:
+                sent = self._send(target.connection, header, fd, data, size)
+        except OSError as exc:
+            with self._lock:
+                report.failed[imei] = str(exc) or type(exc).__name__
+            return
+        with self._lock:
+            report.completed.append(imei)
+            report.bytes_sent += sent
+
+    def _send(self, sock: socket.socket, header: bytes, fd: int, data, size: int) -> int:
+        # a blocking socket without a send timeout would hold sendfile until a stalled device reads
+        bound = sock.gettimeout() is None and send_timeout(sock) is None
+        if bound:
+            set_send_timeout(sock, self.stall_timeout)
+        use_sendfile = hasattr(os, "sendfile")
+        view = memoryview(data)
+        offset = 0
+        try:
+            sock.sendall(header)
+            deadline = time.monotonic() + self.stall_timeout
+            while offset < size:
+                count = min(self.chunk_size, size - offset)
+                try:
+                    if use_sendfile:
+                        sent = os.sendfile(sock.fileno(), fd, offset, count)
+                    else:
+                        sent = sock.send(view[offset:offset + count])
+                except (BlockingIOError, TimeoutError):
+                    # the buffer is full: a socket with a timeout, or its SO_SNDTIMEO ran out
+                    if not _writable(sock, deadline - time.monotonic()):
+                        raise TimeoutError("send buffer stalled") from None
+                    continue
+                if not sent:
+                    raise OSError(f"{self.path} shrank during the rollout")
+                offset += sent
+                deadline = time.monotonic() + self.stall_timeout
+        except OSError:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # the frame is half written
+            except OSError:
+                pass
+            raise
+        finally:
+            view.release()
+            if bound:
+                set_send_timeout(sock, None)
+        return len(header) + size
+
+
+if __name__ == "__main__":
+    import tempfile
+    import tracemalloc
+
+    class Target:
+        def __init__(self, connection):
+            self.connection = connection
+            self.send_lock = threading.Lock()
+
+    def drain(sock, expected, done):
+        got = 0
+        while got < expected:
+            chunk = sock.recv(256 * 1024)
+            if not chunk:
+                break
+            got += len(chunk)
+        done.append(got)
+
+    size, devices = 4 * 2 ** 20, 64
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(size))
+    with open(f.name, "rb") as src:
+        header = upload_header(PacketType.SRV_UPLOAD_SOFTWARE, size, crc16(src.read()))
+    expected = len(header) + size
+
+    def session(push):
+        tracemalloc.start()
+        pairs = [socket.socketpair() for _ in range(devices)]
+        done = []
+        readers = [threading.Thread(target=drain, args=(b, expected, done)) for _, b in pairs]
+        for r in readers:
+            r.start()
+        tracemalloc.reset_peak()
+        report = push({str(i): Target(a) for i, (a, _) in enumerate(pairs)})
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        for r in readers:
+            r.join()
+        for a, b in pairs:
+            a.close()
+            b.close()
+        assert sum(done) >= devices * size, "lost data"
+        return f"{report}, peak {peak / 2 ** 20:.1f} MiB allocated"
+
+    def naive(targets):
+        """Per-device read of the whole file and sendall, the baseline."""
+        report = RolloutReport(targets=len(targets))
+        start = time.perf_counter()
+
+        def push(imei, target):
+            with open(f.name, "rb") as src:
+                body = src.read()
+            target.connection.sendall(header + body)
+            report.completed.append(imei)
+            report.bytes_sent += len(header) + len(body)
+
+        with ThreadPoolExecutor(MAX_CONCURRENT) as pool:
+            for imei, target in targets.items():
+                pool.submit(push, imei, target)
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    rollout = Rollout(f.name)
+    print(f"naive copy : {session(naive)}")
+    print(f"rollout    : {session(rollout.run)}")
+    print(f"rollout x4 : {session(Rollout(f.name, max_concurrent=4).run)}")
+    os.remove(f.name)
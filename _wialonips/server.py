@@ -1,9 +1,30 @@
+import queue
+import selectors
 import socket
 import threading
+import time
 from dataclasses import dataclass, field
-from typing import Optional, Dict
-
-from _wialonips.protocol import Protocol, PacketType, DevPacket
+from typing import Optional, Dict, Iterable, List
+
+from _wialonips import handoff
+from _wialonips.aggregates import Aggregator
+from _wialonips.buffers import BufferPool
+from _wialonips.ddd import DDD_QUERY, DddReassembler
+from _wialonips.dedup import Deduplicator
+from _wialonips.framing import Framer, FramingError
+from _wialonips.geofence import GeofenceEngine
+from _wialonips.guard import Watchdog, set_send_timeout
+from _wialonips.handoff import DRAIN_POLL, DRAIN_TIMEOUT, HANDOFF_TIMEOUT, MAX_FDS, TAKEOVER, Session
+from _wialonips.image import ImageReceiver
+from _wialonips.listener import AckPolicy, Listener
+from _wialonips.metrics import Metrics
+from _wialonips.params import ParamSchemaCache
+from _wialonips.spool import ChunkSpool
+from _wialonips.protocol import Protocol, PacketType, DevPacket, shared_protocol
+from _wialonips.ratelimit import Throttle
+from _wialonips.registry import Broadcast, ConnectionRegistry
+from _wialonips.rollout import MAX_CONCURRENT, Rollout, RolloutReport
+from _wialonips.sink import Sink
 
 
 @dataclass
@@ -13,17 +34,35 @@ class DeviceCredentials:
     PROTOCOL_VERSION: str = "2.2"
 
 
-@dataclass
+@dataclass(slots=True)  # one per connection
 class Device:
     connection: socket.socket
     credentials: DeviceCredentials
     protocol: Optional[Protocol] = field(init=False, default=None)
+    images: Optional[ImageReceiver] = None
+    ddd: Optional[DddReassembler] = None
+    registry: Optional[ConnectionRegistry] = None
+    sink: Optional[Sink] = None
+    ack_policy: AckPolicy = AckPolicy.IMMEDIATE
+    dedup: Optional[Deduplicator] = None
+    aggregates: Optional[Aggregator] = None
+    geofences: Optional[GeofenceEngine] = None
+    metrics: Optional[Metrics] = None
+    scope: str = ""  # listener name the metrics are counted under
+    send_lock: threading.Lock = field(init=False, repr=False, default_factory=threading.Lock)
 
     def __post_init__(self):
-        self.protocol = Protocol()
+        self.protocol = shared_protocol()
+
+    def send(self, data: bytes):
+        """Sends a whole packet, never interleaved with a rollout to this device."""
+        with self.send_lock:
+            self.connection.sendall(data)
 
     def on_message_received(self, packet: DevPacket):
-        if packet.type == PacketType.DEV_LOGIN:
+        if packet.code is not None:
+            self.on_error(packet)
+        elif packet.type == PacketType.DEV_LOGIN:
             self.on_login(packet)
         elif packet.type == PacketType.DEV_EXTENDED_DATA:
             self.on_extended(packet)
@@ -31,18 +70,112 @@ class Device:
             self.on_short(packet)
         elif packet.type == PacketType.DEV_PING:
             self.on_ping(packet)
+        elif packet.type == PacketType.DEV_BLACKBOX:
+            self.on_blackbox(packet)
+        elif packet.type == PacketType.DEV_IMAGE:
+            self.on_image(packet)
+        elif packet.type == PacketType.DEV_DDD_INFO:
+            self.on_ddd_info(packet)
+        elif packet.type == PacketType.DEV_DDD:
+            self.on_ddd_block(packet)
+        elif packet.type == PacketType.DRV_MESSAGE:
+            self.on_driver_message(packet)
+        elif packet.type == PacketType.SRV_DRV_MESSAGE_RESPONSE:
+            self.on_driver_message_ack(packet)
 
     def on_login(self, packet):
         raise NotImplementedError
 
     def on_short(self, packet: DevPacket):
-        self.connection.send(b'#AD#1\r\n')
+        self.store([packet], b'#ASD#1\r\n')
 
     def on_extended(self, packet: DevPacket):
-        self.connection.send(b'#AD#1\r\n')
+        self.store([packet], b'#AD#1\r\n')
 
     def on_ping(self, packet: DevPacket):
-        self.connection.send(b'#AP#\r\n')
+        self.send(b'#AP#\r\n')
+
+    def on_error(self, packet: DevPacket):
+        answer = self.protocol.build_error_response(packet)
+        if answer is not None:
+            self.send(answer)
+
+    def on_blackbox(self, packet: DevPacket):
+        self.store(packet.packets, b'#AB#%d\r\n' % len(packet.packets))
+
+    def store(self, packets, ack: bytes):
+        """Hands data packets to the sink and acks them as the ack policy says.
+
+        Duplicates are acked too, the device stops resending them only then.
+        Messages are recorded as seen only once the sink took them, so a
+        resend after a sink failure is written. Without an AFTER_WRITE ack
+        nothing is resent and a sink failure loses the messages, they are
+        counted as `sink_dropped`.
+        """
+        if self.ack_policy is AckPolicy.IMMEDIATE:
+            self.send(ack)
+        if self.dedup is not None:
+            packets = self.dedup.fresh(self.credentials.IMEI, packets)
+        if self.sink is not None:
+            try:
+                for packet in packets:
+                    self.sink.write(self.credentials.IMEI, packet)
+                if self.ack_policy is AckPolicy.AFTER_WRITE:
+                    self.sink.commit()  # stored, not only queued
+            except Exception as exc:  # a broken sink must not take the connection down
+                if self.ack_policy is AckPolicy.AFTER_WRITE:
+                    print(f"Sink failed for device {self.credentials.IMEI}, not acked: {exc}")
+                    return  # the device sends it again
+                # acked already or never, the device does not send it again
+                print(f"Sink failed for device {self.credentials.IMEI}, {len(packets)} messages lost: {exc}")
+                if self.metrics is not None:
+                    self.metrics.inc("sink_dropped", len(packets), self.scope)
+                return
+        if self.dedup is not None:
+            self.dedup.add(self.credentials.IMEI, packets)
+        if self.aggregates is not None:  # counted once stored, a message the device resends is not
+            for packet in packets:
+                self.aggregates.update(self.credentials.IMEI, packet)
+        if self.geofences is not None:
+            for packet in packets:
+                self.geofences.update(self.credentials.IMEI, packet)
+        if self.ack_policy is AckPolicy.AFTER_WRITE:
+            self.send(ack)
+
+    def on_image(self, packet: DevPacket):
+        if self.images is None:
+            self.send(b'#AI#%d;0\r\n' % (packet.index or 0))
+            return
+        self.send(self.images.on_block(self.credentials.IMEI, packet))
+
+    def driver_message(self, text: str) -> Optional[Broadcast]:
+        """Sends #M# to the driver; the #AM# answer is tracked when registered."""
+        if self.registry is None:
+            self.send(self.protocol.build_driver_message(text))
+            return None
+        return self.registry.broadcast(text, [self.credentials.IMEI])
+
+    def on_driver_message(self, packet: DevPacket):
+        self.send(b'#AM#1\r\n')
+
+    def on_driver_message_ack(self, packet: DevPacket):
+        if self.registry is not None:
+            self.registry.on_ack(self.credentials.IMEI, packet.ack)
+
+    def query_ddd_info(self):
+        self.send(DDD_QUERY)
+
+    def on_ddd_info(self, packet: DevPacket):
+        if self.ddd is None:
+            self.send(b'#AIT#0\r\n')
+            return
+        self.ddd.on_info(self.credentials.IMEI, packet, self.send)
+
+    def on_ddd_block(self, packet: DevPacket):
+        if self.ddd is None:
+            self.send(b'#AT#%d;0\r\n' % (packet.index or 0))
+            return
+        self.ddd.on_block(self.credentials.IMEI, packet, self.send)  # acked once written
 
     # def query_stream(self):
     #     raise NotImplementedError
@@ -71,113 +204,469 @@ class Device:
     # def upload_configuration(self):
     #     raise NotImplementedError
     #
-    # def driver_message(self):
-    #     raise NotImplementedError
-    #
-    # def on_driver_message(self):
-    #     raise NotImplementedError
-    #
     # def query_image(self):
     #     raise NotImplementedError
     #
-    # def on_image(self):
-    #     raise NotImplementedError
-    #
-    # def query_ddd_info(self):
-    #     raise NotImplementedError
-    #
-    # def on_ddd_info(self):
-    #     raise NotImplementedError
-    #
-    # def on_ddd_block(self):
-    #     raise NotImplementedError
-    #
     # def custom(self):
     #     raise NotImplementedError
 
 
 class Server:
+    """Serves one or more listeners.
 
-    def __init__(self, host: str = "127.0.0.1", port: int = 65432):
+    A single selector accepts on every listening socket and each accepted
+    connection is handled in its own thread. Listeners share the
+    connection registry, metrics, image and DDD spools. `Server(host, port)`
+    serves one listener whose credentials are `devices`.
+
+    A restart does not drop connections when both servers share a
+    `handoff_path`: the new one calls `take_over()` before `run()`.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 65432, image_dir: str = "images",
+                 ddd_dir: str = "ddd", listeners: Optional[Iterable[Listener]] = None,
+                 handoff_path: Optional[str] = None):
         self.host = host
         self.port = port
+        self.images = ImageReceiver(ChunkSpool(image_dir))  # shared, so uploads resume on any connection
+        self.ddd = DddReassembler(ChunkSpool(ddd_dir))
         self.devices: Dict[str, DeviceCredentials] = {}
-        self.socket = None
-        self.protocol = Protocol()
-        self.active_imeis: set = set()  # Track active IMEIs
-
-    def handle_connection(self, conn, addr):
-        """Handles communication with a single device (client)."""
+        self.protocol = shared_protocol()
+        self.buffers = BufferPool()  # receive buffers, held only while a read is in progress
+        self.connections = ConnectionRegistry()  # IMEI -> authenticated Device
+        self.metrics = Metrics()
+        if listeners is None:
+            listeners = [Listener(host, port, credentials=self.devices)]
+        self.listeners = list(listeners)
+        self.handoff_path = handoff_path  # Unix socket for a graceful restart, see take_over
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._running = False
+        self._draining = False  # set once a successor took the listeners, connections detach
+        self._handed_off = False  # the successor owns handoff_path
+        self._detached: "queue.Queue[tuple]" = queue.Queue()  # (conn, Session, send lock)
+        self._open = set()  # connections served by this process
+        self._open_lock = threading.Lock()
+
+    def add_listener(self, listener: Listener):
+        """Adds a listener, it starts accepting at once if the server is running."""
+        self.listeners.append(listener)
+        if self._selector is not None:
+            self._listen(listener)
+
+    def handle_connection(self, conn, addr, listener: Optional[Listener] = None,
+                          session: Optional[Session] = None):
+        """Handles communication with a single device (client).
+
+        `session` is the state of a connection handed off by another server.
+        The connection is closed once it breaks the listener's client limits.
+        """
+        listener = listener or self.listeners[0]
+        scope = listener.name
         print(f"Connected by {addr}")
         device_imei = None
         dev = None
-
+        watchdog = Watchdog(listener.client_limits)
+        counted = session is None and listener.unauthenticated is not None  # by _accept, until the login
+        set_send_timeout(conn, listener.client_limits.send_timeout)  # the socket stays blocking for sendfile
+
+        framer = Framer()
+        params_cache = ParamSchemaCache()  # a device repeats its param layout on every packet
+        decoder = None  # chosen from the #L# frame, 1.1 and 2.x differ in framing and CRC
+        throttle = Throttle(listener.connection_limit)
+
+        if session is not None:
+            framer.feed(session.pending)  # an incomplete frame, nothing comes out
+            if session.version is not None:
+                decoder = listener.resume_decoder(session.version, params_cache)
+            if session.imei is not None:
+                dev = self._bind(conn, listener, session.imei, session.version, throttle)
+                if dev is None:
+                    print(f"Device {session.imei} can not be resumed, closing its connection")
+                    conn.close()
+                    return
+                device_imei = session.imei
+                watchdog.logged_in = True
+                print(f"Device {device_imei} resumed")
+
+        with self._open_lock:
+            self._open.add(conn)
+        detached = False
+        poll = DRAIN_POLL if self.handoff_path is not None else None
         try:
             while True:
-                data = conn.recv(1024)  # Receive data (1024 bytes max)
+                if self._draining and self._detach(conn, listener, device_imei, dev, decoder, framer):
+                    detached = True
+                    return
+                reason = watchdog.expired()
+                if reason is not None:
+                    print(f"Closing connection from {addr}: {reason}")
+                    self.metrics.inc(reason, 1, scope)
+                    break
+                timeout = watchdog.timeout()
+                if poll is not None and (timeout is None or timeout > poll):
+                    timeout = poll
+                if not handoff.readable(conn, timeout):  # an idle connection holds no receive buffer
+                    continue
+                buf = self.buffers.acquire()
+                try:
+                    data = bytes(memoryview(buf)[:conn.recv_into(buf)])
+                finally:
+                    self.buffers.release(buf)
                 if not data:
                     print(f"Connection closed by {addr}")
                     break
+                self.metrics.inc("bytes_in", len(data), scope)
 
-                print(f"Received from {addr}: {data.decode()}")
-
-                message = self.protocol.parse_incoming_packet_from_dev(data)
-                print(device_imei, message.datetime, message.type.name)
-
-                # Handle DEV_LOGIN only once, then bind the device
-                if message.type == PacketType.DEV_LOGIN:
-                    if message.imei in self.active_imeis:
-                        print(f"Device {message.imei} already connected, rejecting login")
-                        conn.send(b"#AL#0\r\n")  # Reject the connection
-                        break  # Close the connection if IMEI is already active
-
-                    if message.imei not in self.devices:
-                        print(f"Device {message.imei} not registered")
-                        conn.send(b"#AL#01\r\n")  # Reject the connection
-                        break  # Close the connection if IMEI is already active
-                    if self.devices[message.imei].PASSWORD != message.password:
-                        print(f"Wrong password for device {message.imei}")
-                        conn.send(b"#AL#01\r\n")
-                        break
-
-                    conn.send(b"#AL#1\r\n")
-
-                    # Bind the connection to the device
-                    device_imei = message.imei
-                    self.active_imeis.add(device_imei)  # Mark this IMEI as active
-                    dev = Device(conn, self.devices[message.imei])
-
-                    print(f"Device {device_imei} authenticated")
-
-                # Now handle all subsequent messages for this device (no more DEV_LOGIN)
-                elif device_imei and dev and self.devices.get(device_imei):
-                    print(f"Processing message for device {device_imei}")
-                    # Handle any message that is not a DEV_LOGIN
-                    dev.on_message_received(message)
-
-                else:
-                    print(f"Device not authenticated yet, ignoring message from {addr}")
-                    # continue
-                    break
+                print(f"Received from {addr}: {data}")
 
+                try:
+                    frames = framer.feed(data)
+                except FramingError as exc:
+                    print(f"Framing error from {addr}: {exc}")
+                    self.metrics.inc("errors", 1, scope)
+                    break
+                watchdog.received(len(data), len(frames), framer.buffered)
+
+                for frame in frames:
+                    if decoder is None:
+                        decoder = listener.decoder(frame, params_cache)
+                    message = decoder.decode(frame)
+                    print(device_imei, message.datetime, message.type.name)
+                    self.metrics.inc("packets", 1, scope)
+                    if message.code is not None:
+                        self.metrics.inc("errors", 1, scope)
+
+                    # Handle DEV_LOGIN only once, then bind the device
+                    if message.type == PacketType.DEV_LOGIN:
+                        if message.code is not None:
+                            print(f"Malformed login from {addr}")
+                            conn.send(listener.protocol.build_error_response(message))
+                            self.metrics.inc("login_failures", 1, scope)
+                            return
+
+                        if message.imei in self.connections:
+                            print(f"Device {message.imei} already connected, rejecting login")
+                            conn.send(b"#AL#0\r\n")  # Reject the connection
+                            self.metrics.inc("login_failures", 1, scope)
+                            return  # Close the connection if IMEI is already active
+
+                        if message.imei not in listener.credentials:
+                            print(f"Device {message.imei} not registered")
+                            conn.send(b"#AL#01\r\n")  # Reject the connection
+                            self.metrics.inc("login_failures", 1, scope)
+                            return  # Close the connection if IMEI is already active
+                        if listener.credentials[message.imei].PASSWORD != message.password:
+                            print(f"Wrong password for device {message.imei}")
+                            conn.send(b"#AL#01\r\n")
+                            self.metrics.inc("login_failures", 1, scope)
+                            return
+
+                        # Bind the connection to the device
+                        dev = self._bind(conn, listener, message.imei, decoder.version, throttle)
+                        if dev is None:  # lost a race with another login
+                            print(f"Device {message.imei} already connected, rejecting login")
+                            conn.send(b"#AL#0\r\n")
+                            self.metrics.inc("login_failures", 1, scope)
+                            return
+                        device_imei = message.imei
+                        watchdog.logged_in = True
+                        if counted:
+                            listener.unauthenticated.release(addr[0])
+                            counted = False
+                        dev.send(b"#AL#1\r\n")
+                        self.metrics.inc("logins", 1, scope)
+
+                        print(f"Device {device_imei} authenticated")
+
+                    # Now handle all subsequent messages for this device (no more DEV_LOGIN)
+                    elif device_imei and dev and listener.credentials.get(device_imei):
+                        print(f"Processing message for device {device_imei}")
+                        # Handle any message that is not a DEV_LOGIN
+                        dev.on_message_received(message)
+
+                    else:
+                        print(f"Device not authenticated yet, ignoring message from {addr}")
+                        return
+
+                delay = throttle.delay(len(frames), len(data))
+                if delay:
+                    # not reading is the backpressure: the device's TCP window fills up and it waits
+                    self.metrics.inc("throttled", 1, scope)
+                    self.metrics.inc("throttled_ms", round(delay * 1000), scope)
+                    time.sleep(delay)
+                data = frames = frame = message = None  # nothing of the last read stays while idle
+
+        except (BlockingIOError, TimeoutError):  # the device does not read what it is sent
+            print(f"Sending to {addr} timed out")
+            self.metrics.inc("send_timeouts", 1, scope)
         finally:
-            if device_imei:
-                print(f"Closing connection for device {device_imei}")
-                self.active_imeis.remove(device_imei)  # Remove the IMEI from active connections
-            conn.close()
+            if counted:
+                listener.unauthenticated.release(addr[0])
+            with self._open_lock:
+                self._open.discard(conn)
+            if not detached:  # a detached connection belongs to the next server now
+                if device_imei:
+                    print(f"Closing connection for device {device_imei}")
+                    self.connections.remove(device_imei)  # Remove the IMEI from active connections
+                conn.close()
+
+    def _bind(self, conn, listener: Listener, imei: str, version: Optional[str],
+              throttle: Throttle) -> Optional[Device]:
+        """Registers the device of `imei` on `conn`, None when it is not known or already connected.
+
+        From then on the connection is also charged to the rate limit of the IMEI.
+        """
+        credentials = listener.credentials.get(imei)
+        if credentials is None:
+            return None
+        dev = Device(conn, credentials, images=self.images, ddd=self.ddd, registry=self.connections,
+                     sink=listener.sink, ack_policy=listener.ack_policy, dedup=listener.dedup,
+                     aggregates=listener.aggregates, geofences=listener.geofences,
+                     metrics=self.metrics, scope=listener.name)
+        if version is not None:
+            dev.protocol = shared_protocol(version)
+        if not self.connections.add(imei, dev):
+            return None
+        if listener.device_buckets is not None:
+            throttle.add(*listener.device_buckets.get(imei))
+        return dev
+
+    def _detach(self, conn, listener: Listener, imei: Optional[str], dev: Optional[Device],
+                decoder, framer: Framer) -> bool:
+        """Queues the connection for handoff, False while a packet is being written to it.
+
+        The send lock is held until the handoff closes this process's copy
+        of the socket, so nothing gets written to it from here afterwards.
+        """
+        lock = dev.send_lock if dev is not None else threading.Lock()
+        if not lock.acquire(blocking=False):
+            return False
+        with self._open_lock:
+            if not self._draining:  # the handoff failed meanwhile
+                lock.release()
+                return False
+            if imei is not None:
+                self.connections.remove(imei)
+            version = decoder.version if decoder is not None else None
+            self._detached.put((conn, Session(listener.name, imei, version, framer.pending), lock))
+        return True
 
     def run(self):
-        """Runs the server to accept multiple client connections."""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as self.socket:
-            self.socket.bind((self.host, self.port))
-            self.socket.listen()
-            print(f"Server listening on {self.host}:{self.port}")
-
+        """Runs the server to accept multiple client connections on every listener.
+
+        With `handoff_path` set the server also waits for a successor on
+        that Unix socket: once a new server calls `take_over`, the listening
+        sockets and the live connections move to it and `run` returns.
+        """
+        self._selector = selectors.DefaultSelector()
+        self._running = True
+        handoff_sock = None
+        try:
+            for listener in list(self.listeners):
+                self._listen(listener)
+            if self.handoff_path is not None:
+                handoff_sock = handoff.listen(self.handoff_path)
+                self._selector.register(handoff_sock, selectors.EVENT_READ, None)
+            while self._running:
+                for key, _ in self._selector.select(timeout=1):
+                    if key.data is None:
+                        self._handoff_requested(handoff_sock)
+                    else:
+                        self._accept(key.data)
+                self._export_aggregates()
+        finally:
+            self._selector.close()
+            self._selector = None
+            if handoff_sock is not None:
+                handoff_sock.close()
+                if not self._handed_off:  # the path belongs to the successor otherwise
+                    handoff.unlink(self.handoff_path)
+            self._export_aggregates(force=True)
+            for listener in self.listeners:
+                listener.close()
+
+    def _export_aggregates(self, force: bool = False):
+        for listener in self.listeners:
+            if listener.aggregates is not None:
+                try:
+                    listener.aggregates.export(listener.sink, force)
+                except Exception as exc:  # a broken sink must not stop the accept loop
+                    print(f"Exporting aggregates of {listener.name} failed: {exc}")
+
+    def stop(self):
+        """Makes `run` return within a second, closing all listeners and the file spools."""
+        self._running = False
+        self.ddd.close()
+        self.images.spool.close()
+
+    def _listen(self, listener: Listener):
+        listener.open()
+        self._selector.register(listener.sock, selectors.EVENT_READ, listener)
+        print(f"Server listening on {listener.host}:{listener.port} ({listener.name})")
+
+    def _accept(self, listener: Listener):
+        try:
+            conn, addr = listener.sock.accept()  # Accept a new connection
+        except BlockingIOError:
+            return  # taken by an earlier wakeup
+        conn.setblocking(True)
+        self.metrics.inc("connections", 1, listener.name)
+        if listener.unauthenticated is not None and not listener.unauthenticated.acquire(addr[0]):
+            print(f"Too many connections from {addr[0]} without a login, closing {addr}")
+            self.metrics.inc("rejected_unauthenticated", 1, listener.name)
+            conn.close()
+            return
+        client_thread = threading.Thread(target=self.handle_connection, args=(conn, addr, listener))
+        client_thread.daemon = True  # Allow thread to be killed when the program exits
+        client_thread.start()
+
+    def take_over(self, path: Optional[str] = None) -> bool:
+        """Takes listening sockets and connections over from the server running at `path`.
+
+        Call it before `run`. Listening sockets are matched to this
+        server's listeners by name and keep accepting without a gap;
+        connections follow in the background as the old server drains them.
+        False when no server is running at `path` (`handoff_path` by default).
+        """
+        conn = handoff.connect(path or self.handoff_path)
+        if conn is None:
+            return False
+        try:
+            conn.sendall(TAKEOVER)
+            message, fds = handoff.recv_message(conn)
+        except OSError:
+            conn.close()
+            raise
+        listeners = {listener.name: listener for listener in self.listeners}
+        for name, fd in zip(message["listeners"], fds):
+            sock = socket.socket(fileno=fd)
+            if name not in listeners:
+                print(f"No listener named {name}, closing its socket")
+                sock.close()
+                continue
+            listeners[name].adopt(sock)
+            print(f"Took over {listeners[name].host}:{listeners[name].port} ({name})")
+        receiver = threading.Thread(target=self._receive_sessions, args=(conn, listeners))
+        receiver.daemon = True
+        receiver.start()
+        return True
+
+    def _receive_sessions(self, conn, listeners: Dict[str, Listener]):
+        with conn:
+            try:
+                while True:
+                    message, fds = handoff.recv_message(conn)
+                    if message.get("done"):
+                        print(f"Handoff done, {message['kept']} connection(s) stayed with the old server")
+                        return
+                    for data, fd in zip(message["sessions"], fds):
+                        self._resume(socket.socket(fileno=fd), Session.from_json(data), listeners)
+            except (OSError, ValueError) as exc:
+                print(f"Handoff failed: {exc}")
+
+    def _resume(self, conn, session: Session, listeners: Dict[str, Listener]):
+        listener = listeners.get(session.listener)
+        if listener is None:
+            conn.close()
+            return
+        conn.setblocking(True)
+        self.metrics.inc("taken_over", 1, listener.name)
+        client_thread = threading.Thread(target=self.handle_connection,
+                                         args=(conn, conn.getpeername(), listener, session))
+        client_thread.daemon = True
+        client_thread.start()
+
+    def _handoff_requested(self, handoff_sock):
+        try:
+            conn, _ = handoff_sock.accept()
+        except BlockingIOError:
+            return
+        with conn:
+            conn.settimeout(HANDOFF_TIMEOUT)
+            try:
+                if conn.recv(len(TAKEOVER)) != TAKEOVER:
+                    return  # a probe, see handoff.listen
+                self._hand_off(conn, handoff_sock)
+            except OSError as exc:
+                print(f"Handoff failed: {exc}")
+
+    def _hand_off(self, conn, handoff_sock):
+        """Passes the listening sockets, then drains connections to the successor on `conn`.
+
+        When the successor goes away while connections drain, the ones
+        already detached are closed, the devices reconnect to it, and the
+        rest stay with this server.
+        """
+        listeners = [listener for listener in self.listeners if listener.sock is not None]
+        handoff.send_message(conn, {"listeners": [listener.name for listener in listeners]},
+                             [listener.sock.fileno() for listener in listeners])
+        handoff.unlink(self.handoff_path)  # the successor listens there for the next restart
+        self._handed_off = True
+        self._selector.unregister(handoff_sock)
+        for listener in listeners:
+            self._selector.unregister(listener.sock)
+            listener.sock.close()
+            listener.sock = None
+        self._running = False
+        self._draining = True
+
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        batch = []
+        try:
             while True:
-                conn, addr = self.socket.accept()  # Accept a new connection
-                client_thread = threading.Thread(target=self.handle_connection, args=(conn, addr))
-                client_thread.daemon = True  # Allow thread to be killed when the program exits
-                client_thread.start()
+                try:
+                    batch.append(self._detached.get(timeout=DRAIN_POLL))
+                    while len(batch) < MAX_FDS:
+                        batch.append(self._detached.get_nowait())
+                except queue.Empty:
+                    pass
+                if batch:
+                    handoff.send_message(conn, {"sessions": [s.to_json() for _, s, _ in batch]},
+                                         [c.fileno() for c, _, _ in batch])
+                    self._close_detached(batch, "handed_off")
+                    batch = []
+                with self._open_lock:
+                    kept = len(self._open)
+                if not kept and self._detached.empty() or time.monotonic() > deadline:
+                    break
+            handoff.send_message(conn, {"done": True, "kept": kept})
+        except OSError as exc:
+            with self._open_lock:  # _detach checks the flag under this lock, nothing is queued after it
+                self._draining = False
+            dropped = batch
+            while not self._detached.empty():
+                dropped.append(self._detached.get_nowait())
+            self._close_detached(dropped, "handoff_dropped")
+            print(f"Handoff failed while draining: {exc}, "
+                  f"{len(dropped)} detached connection(s) closed, the others stay")
+            return
+        print(f"Handed off to the new server, {kept} connection(s) did not drain")
+
+    def _close_detached(self, detached: List[tuple], metric: str):
+        """Closes this process's copy of detached connections and frees their send locks."""
+        for c, session, lock in detached:
+            c.close()
+            lock.release()
+            self.metrics.inc(metric, 1, session.listener)
+
+    def rollout(self, path: str, imeis: Optional[Iterable[str]] = None,
+                packet_type: PacketType = PacketType.SRV_UPLOAD_SOFTWARE,
+                max_concurrent: int = MAX_CONCURRENT) -> RolloutReport:
+        """Pushes a firmware (#US#) or configuration (#UC#) file to connected devices.
+
+        Targets all connected devices unless `imeis` is given; the ones that
+        are not connected are reported as failed.
+        """
+        rollout = Rollout(path, packet_type, max_concurrent)
+        return rollout.run(self.connections.snapshot(), imeis)
+
+    def broadcast(self, text: str, imeis: Optional[Iterable[str]] = None) -> Broadcast:
+        """Sends a driver message (#M#) to connected devices, see ConnectionRegistry.broadcast."""
+        return self.connections.broadcast(text, imeis)
+
+    @property
+    def active_imeis(self) -> set:
+        return set(self.connections.snapshot())
 
     def register_device(self, device: DeviceCredentials):
         if not device.IMEI in self.devices:
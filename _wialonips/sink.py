@@ -0,0 +1,51 @@
+from _wialonips.protocol import DevPacket
+
+
+class Sink:
+    """Destination of the packets a listener receives.
+
+    `write` is called from connection threads, one call per data packet
+    (messages of a #B# packet are written one by one). Sinks that buffer
+    write out in `flush`, `close` releases their resources. Under the
+    AFTER_WRITE ack policy `commit` is called before the ack; a sink whose
+    `write` only queues waits there until the calling thread's messages
+    are stored and raises when they could not be. A sink that cannot do
+    that sets `commits` to False and is refused for AFTER_WRITE.
+    `write_snapshot` gets the periodic aggregates of a device, see
+    aggregates.Aggregator.
+    """
+
+    commits = True
+
+    def write(self, imei: str, packet: DevPacket):
+        pass
+
+    def write_snapshot(self, imei: str, snapshot: dict):
+        pass
+
+    def commit(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class NullSink(Sink):
+    """Drops everything, the default."""
+
+
+class MemorySink(Sink):
+    """Keeps (imei, packet) pairs in a list, for tests and examples."""
+
+    def __init__(self):
+        self.packets = []
+        self.snapshots = []
+
+    def write(self, imei: str, packet: DevPacket):
+        self.packets.append((imei, packet))
+
+    def write_snapshot(self, imei: str, snapshot: dict):
+        self.snapshots.append((imei, snapshot))
@@ -0,0 +1,168 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+PART_SUFFIX = ".part"
+META_SUFFIX = ".meta"
+MAX_OPEN_FILES = 32
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def safe_name(name: str) -> str:
+    """File name made of a device supplied string."""
+    return _UNSAFE.sub("_", name).lstrip(".") or "_"
+
+
+class _Transfer:
+    __slots__ = ("part", "meta", "blocks")
+
+    def __init__(self, part: int, meta: int, blocks: Dict[int, Tuple[int, int]]):
+        self.part = part
+        self.meta = meta
+        self.blocks = blocks  # index -> (offset, length)
+
+    def close(self):
+        os.close(self.part)
+        os.close(self.meta)
+
+
+class ChunkSpool:
+    """Writes the blocks of incoming files straight to disk at their offsets.
+
+    A transfer lives in `<key>.part` next to an append-only `<key>.meta`
+    holding one "index offset length" line per written block, so after a
+    reconnect it resumes from what is on disk. At most `max_open_files`
+    transfers keep their descriptors and block lists in memory, the least
+    recently used one is closed and reloaded from its meta file on demand.
+    """
+
+    def __init__(self, directory: str, max_open_files: int = MAX_OPEN_FILES):
+        self.directory = directory
+        self.max_open_files = max_open_files
+        self._open: "OrderedDict[str, _Transfer]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_written = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, safe_name(key))
+
+    def blocks(self, key: str) -> Dict[int, Tuple[int, int]]:
+        """Blocks of `key` already on disk, index -> (offset, length)."""
+        with self._lock:
+            return dict(self._transfer(key).blocks)
+
+    def write(self, key: str, index: int, offset: int, data: bytes) -> int:
+        """Stores block `index` at `offset`, returns the number of blocks on disk.
+
+        A block that is already on disk is not written again.
+        """
+        with self._lock:
+            transfer = self._transfer(key)
+            if index not in transfer.blocks:
+                os.lseek(transfer.part, offset, os.SEEK_SET)
+                os.write(transfer.part, data)
+                # the block is recorded only once its data is written
+                os.write(transfer.meta, b"%d %d %d\n" % (index, offset, len(data)))
+                transfer.blocks[index] = (offset, len(data))
+                self.bytes_written += len(data)
+            return len(transfer.blocks)
+
+    def complete(self, key: str, name: Optional[str] = None) -> str:
+        """Closes the transfer and moves its data to `name` (`key` by default)."""
+        with self._lock:
+            self._close(key)
+            path = self.path(key)
+            target = self.path(name or key)
+            os.replace(path + PART_SUFFIX, target)
+            os.remove(path + META_SUFFIX)
+            return target
+
+    def discard(self, key: str):
+        with self._lock:
+            self._close(key)
+            path = self.path(key)
+            for suffix in (PART_SUFFIX, META_SUFFIX):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        with self._lock:
+            while self._open:
+                self._open.popitem(last=False)[1].close()
+
+    def _transfer(self, key: str) -> _Transfer:
+        transfer = self._open.get(key)
+        if transfer is not None:
+            self._open.move_to_end(key)
+            return transfer
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        blocks = self._load(path + META_SUFFIX)
+        part = os.open(path + PART_SUFFIX, os.O_WRONLY | os.O_CREAT, 0o644)
+        meta = os.open(path + META_SUFFIX, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        transfer = self._open[key] = _Transfer(part, meta, blocks)
+        while len(self._open) > self.max_open_files:
+            self._open.popitem(last=False)[1].close()
+        return transfer
+
+    def _close(self, key: str):
+        transfer = self._open.pop(key, None)
+        if transfer is not None:
+            transfer.close()
+
+    @staticmethod
+    def _load(meta_path: str) -> Dict[int, Tuple[int, int]]:
+        blocks = {}
+        try:
+            with open(meta_path, "rb") as f:
+                for line in f:
+                    try:
+                        index, offset, length = map(int, line.split())
+                    except ValueError:
+                        continue  # torn last line, the block is sent again
+                    blocks[index] = (offset, length)
+        except FileNotFoundError:
+            pass
+        return blocks
+
+
+if __name__ == "__main__":
+    import random
+    import shutil
+    import tempfile
+    import time
+    import tracemalloc
+
+    devices, blocks, block_size = 200, 50, 4096
+    directory = tempfile.mkdtemp()
+    spool = ChunkSpool(directory)
+    images = {d: bytes(random.getrandbits(8) for _ in range(64)) * (blocks * block_size // 64) for d in range(devices)}
+
+    # blocks of all devices interleaved, each device in order, some blocks sent twice
+    order = [(d, i) for i in range(blocks) for d in range(devices)]
+    order += random.sample(order, len(order) // 20)
+
+    tracemalloc.start()
+    t = time.perf_counter()
+    for d, i in order:
+        spool.write(f"dev{d}", i, i * block_size, images[d][i * block_size:(i + 1) * block_size])
+    elapsed = time.perf_counter() - t
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for d in range(devices):
+        with open(spool.complete(f"dev{d}"), "rb") as f:
+            assert f.read() == images[d]
+    spool.close()
+    shutil.rmtree(directory)
+
+    total = devices * blocks * block_size
+    print(f"{devices} devices x {blocks} blocks: {total / elapsed / 2 ** 20:.1f} MiB/s, "
+          f"{len(order) / elapsed:.0f} blocks/s, peak spool memory {peak / 1024:.0f} KiB, "
+          f"<= {spool.max_open_files} transfers open")
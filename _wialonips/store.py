@@ -0,0 +1,350 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+from _wialonips.params import Params
+from _wialonips.protocol import DevPacket
+from _wialonips.sink import Sink
+from _wialonips.utils import epoch_seconds
+
+BATCH_SIZE = 10_000  # rows per transaction at most
+MAX_DELAY = 0.1  # s a row waits for more rows to share its transaction
+MAX_PENDING = 200_000  # rows queued for the writer before `write` blocks
+MAX_FAILURES = 1024  # failed transactions remembered for `commit`
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    imei TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS messages (
+    device INTEGER NOT NULL REFERENCES devices(id),
+    ts INTEGER NOT NULL,  -- us since the epoch, device time or arrival time when it sent none
+    received INTEGER NOT NULL,
+    type TEXT,
+    lat REAL,
+    lon REAL,
+    speed INTEGER,
+    course INTEGER,
+    alt INTEGER,
+    sats INTEGER,
+    hdop REAL,
+    inputs INTEGER,
+    outputs INTEGER,
+    adc TEXT,  -- JSON list
+    ibutton TEXT,
+    alarm INTEGER,
+    params TEXT  -- JSON object
+);
+CREATE INDEX IF NOT EXISTS messages_device_ts ON messages (device, ts);
+"""
+
+COLUMNS = ("ts", "received", "type", "lat", "lon", "speed", "course", "alt", "sats", "hdop",
+           "inputs", "outputs", "adc", "ibutton", "alarm", "params")
+INSERT = f"INSERT INTO messages (device, {', '.join(COLUMNS)}) VALUES ({', '.join('?' * (len(COLUMNS) + 1))})"
+SELECT = f"SELECT {', '.join(COLUMNS)} FROM messages"
+
+Time = Union[datetime, float]
+
+
+def _int(value) -> Optional[int]:
+    return value if isinstance(value, int) else None
+
+
+def _us(value: Time) -> int:
+    if isinstance(value, datetime):
+        value = value.timestamp()
+    return int(value * 1e6)
+
+
+class SQLiteStore(Sink):
+    """Message history in one SQLite file, for deployments without a database server.
+
+    `write` only queues a row; a writer thread inserts the queue in
+    transactions of up to `batch_size` rows, waiting at most `max_delay`
+    for a batch to fill. `commit` waits for the transactions holding the
+    rows the calling thread queued and raises the error of one that
+    failed, so an AFTER_WRITE ack goes out only for stored rows. The
+    database runs in WAL mode, so `range` and `latest` read from their
+    own per-thread connections while the writer goes on. Messages are
+    indexed by (device, ts).
+    """
+
+    def __init__(self, path: str, batch_size: int = BATCH_SIZE, max_delay: float = MAX_DELAY,
+                 max_pending: int = MAX_PENDING):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+        self._pending: List[tuple] = []
+        self._cond = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self._devices: Dict[str, int] = {}
+        self._local = threading.local()  # reader connection and commit tickets of a thread
+        self._readers: List[sqlite3.Connection] = []
+        self._queued = 0  # rows ever queued, a row's ticket is the count after it
+        self._done = 0  # rows the writer finished with, in queue order
+        self._failures: Deque[Tuple[int, int, Exception]] = deque(maxlen=MAX_FAILURES)  # rows (start, end]
+        self.rows_written = 0
+        self.batches = 0
+        self.write_time = 0.0  # s the writer spent in transactions
+        self._writer = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._writer.start()
+
+    def write(self, imei: str, packet: DevPacket):
+        received = time.time()
+        ts = received
+        if packet.date and packet.time:
+            try:
+                ts = epoch_seconds(packet.date, packet.time)
+            except ValueError:
+                pass
+        try:
+            pos = packet.pos
+        except ValueError:
+            pos = None
+        params = packet.params
+        if isinstance(params, Params):
+            params = dict(zip(params.schema.keys, params.values))
+        row = (imei, int(ts * 1e6), int(received * 1e6), packet.type.name if packet.type else None,
+               pos and pos[0], pos and pos[1], _int(packet.speed), _int(packet.course), _int(packet.alt),
+               _int(packet.sats), packet.hdop if isinstance(packet.hdop, (int, float)) else None,
+               _int(packet.inputs), _int(packet.outputs), json.dumps(packet.adc) if packet.adc else None,
+               packet.ibutton, int(packet.alarm), json.dumps(params) if params else None)
+        with self._cond:
+            while len(self._pending) >= self.max_pending and not self._closed:
+                self._cond.wait()  # the writer is behind, hold the connection back
+            if self._closed:
+                raise ValueError("Store is closed")
+            self._pending.append(row)
+            self._queued += 1
+            self._local.ticket = self._queued
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._cond.notify_all()  # start the batch timer, or end it early
+
+    def commit(self):
+        """Waits until the rows this thread queued since its last commit are committed.
+
+        Raises the error of a transaction that held some of them, those rows are not stored.
+        """
+        ticket = getattr(self._local, "ticket", 0)
+        since = getattr(self._local, "committed", 0)
+        if ticket <= since:
+            return
+        with self._cond:
+            while self._done < ticket:
+                self._cond.wait()
+            self._local.committed = ticket
+            for start, end, exc in self._failures:
+                if start < ticket and end > since:
+                    raise exc
+
+    def flush(self):
+        """Waits until every queued row is committed."""
+        with self._cond:
+            self._cond.notify_all()
+            while self._pending or self._busy:
+                self._cond.wait()
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        with self._cond:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+
+    def range(self, imei: str, start: Time, end: Time, limit: Optional[int] = None) -> List[dict]:
+        """Messages of `imei` with start <= ts < end, oldest first."""
+        device = self._device(imei)
+        if device is None:
+            return []
+        sql = f"{SELECT} WHERE device = ? AND ts >= ? AND ts < ? ORDER BY ts"
+        args = [device, _us(start), _us(end)]
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        return [self._row(r) for r in self._reader().execute(sql, args)]
+
+    def latest(self, imei: str, n: int = 1) -> List[dict]:
+        """The last `n` messages of `imei`, newest first."""
+        device = self._device(imei)
+        if device is None:
+            return []
+        rows = self._reader().execute(f"{SELECT} WHERE device = ? ORDER BY ts DESC LIMIT ?", (device, n))
+        return [self._row(r) for r in rows]
+
+    def count(self) -> int:
+        return self._reader().execute("SELECT count(*) FROM messages").fetchone()[0]
+
+    @property
+    def rate(self) -> float:
+        """Rows per second of writer time."""
+        return self.rows_written / self.write_time if self.write_time else 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent, a power loss may lose the last commits
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._cond:
+                self._readers.append(conn)
+        return conn
+
+    def _device(self, imei: str) -> Optional[int]:
+        device = self._devices.get(imei)
+        if device is None:
+            row = self._reader().execute("SELECT id FROM devices WHERE imei = ?", (imei,)).fetchone()
+            device = row and row[0]
+        return device
+
+    @staticmethod
+    def _row(row: tuple) -> dict:
+        message = dict(zip(COLUMNS, row))
+        message["ts"] /= 1e6
+        message["received"] /= 1e6
+        if message["adc"] is not None:
+            message["adc"] = json.loads(message["adc"])
+        if message["params"] is not None:
+            message["params"] = json.loads(message["params"])
+        message["alarm"] = bool(message["alarm"])
+        return message
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                with self._cond:
+                    if not self._pending and not self._closed:
+                        self._cond.wait()
+                    if self._pending and len(self._pending) < self.batch_size and not self._closed:
+                        self._cond.wait(self.max_delay)  # let the batch fill
+                    if not self._pending:
+                        if self._closed:
+                            return
+                        continue
+                    rows = self._pending[:self.batch_size]
+                    del self._pending[:self.batch_size]
+                    self._busy = True
+                    self._cond.notify_all()  # writers waiting for room
+                failure = None
+                try:
+                    self._insert(conn, rows)
+                except Exception as exc:  # reported by commit, the writer goes on
+                    print(f"Storing {len(rows)} messages failed: {exc}")
+                    failure = exc
+                finally:
+                    with self._cond:
+                        if failure is not None:
+                            self._failures.append((self._done, self._done + len(rows), failure))
+                        self._done += len(rows)
+                        self._busy = False
+                        self._cond.notify_all()
+        finally:
+            conn.close()
+
+    def _insert(self, conn: sqlite3.Connection, rows: List[tuple]):
+        start = time.perf_counter()
+        with conn:
+            devices = self._devices
+            for imei in {row[0] for row in rows} - devices.keys():
+                conn.execute("INSERT OR IGNORE INTO devices (imei) VALUES (?)", (imei,))
+                devices[imei] = conn.execute("SELECT id FROM devices WHERE imei = ?", (imei,)).fetchone()[0]
+            conn.executemany(INSERT, [(devices[row[0]],) + row[1:] for row in rows])
+        self.rows_written += len(rows)
+        self.batches += 1
+        self.write_time += time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import shutil
+    import statistics
+    import sys
+    import tempfile
+    from datetime import timedelta
+
+    from _wialonips.decoder import create_decoder
+    from _wialonips.protocol import Protocol
+
+    # python -m _wialonips.store [rows] [devices]; the tables are meant for 1e8 rows, give the disk ~15 GB for that
+    rows = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1_000_000
+    devices = int(float(sys.argv[2])) if len(sys.argv) > 2 else 10_000
+    protocol = Protocol()
+    decoder = create_decoder("2.0")
+    start = datetime(2025, 2, 24, 0, 0, 0)
+    step = 30  # s between two messages of a device
+    templates = [decoder.decode(protocol.build_data_packet(
+        date_time=start, lat=50 + random.random(), lon=30 + random.random(), speed=random.randint(0, 90),
+        course=random.randint(0, 359), alt=150, sats=9, hdop=1.0, inputs=0b101, outputs=0,
+        adc=[round(random.uniform(11.5, 14.4), 2)], ibutton="NA", battery=random.randint(60, 100),
+        fuel=round(random.uniform(10, 60), 1))) for _ in range(100)]
+    times = {}
+
+    def packets():
+        """Rounds of one message per device, decoded packets are reused with a new device time."""
+        for i in range(rows):
+            n, d = divmod(i, devices)
+            if d == 0:
+                at = start + timedelta(seconds=step * n)
+                times["date"], times["time"] = at.strftime("%d%m%y"), at.strftime("%H%M%S")
+            packet = templates[i % len(templates)]
+            packet.date, packet.time = times["date"], times["time"]
+            yield str(350_000_000_000_000 + d), packet
+
+    directory = tempfile.mkdtemp()
+    store = SQLiteStore(os.path.join(directory, "telemetry.db"))
+    t = time.perf_counter()
+    for imei, packet in packets():
+        store.write(imei, packet)
+    store.flush()
+    elapsed = time.perf_counter() - t
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    print(f"{store.rows_written:,} rows of {devices:,} devices: {store.rows_written / elapsed:,.0f} rows/s end to end, "
+          f"{store.rate:,.0f} rows/s in {store.batches} transactions; {size / store.rows_written:.0f} bytes/row")
+
+    rounds = rows // devices
+    imeis = [str(350_000_000_000_000 + random.randrange(devices)) for _ in range(1_000)]
+
+    def measure(label, query):
+        latency = []
+        found = 0
+        for imei in imeis:
+            t = time.perf_counter()
+            found += len(query(imei))
+            latency.append(time.perf_counter() - t)
+        latency.sort()
+        print(f"{label:24}: median {statistics.median(latency) * 1e3:.3f} ms, "
+              f"p99 {latency[int(len(latency) * .99)] * 1e3:.3f} ms, {found / len(imeis):.0f} rows/query")
+
+    hour = start.timestamp() + step * rounds / 2
+    measure("range, one hour", lambda imei: store.range(imei, hour, hour + 3600))
+    measure("latest 1", lambda imei: store.latest(imei))
+    measure("latest 100", lambda imei: store.latest(imei, 100))
+
+    # reads while the writer goes on: WAL readers do not wait for it
+    rows, start = rows // 10, start + timedelta(seconds=step * rounds)
+    writer = threading.Thread(target=lambda: [store.write(imei, packet) for imei, packet in packets()])
+    writer.start()
+    measure("latest 1, while writing", lambda imei: store.latest(imei))
+    writer.join()
+    store.close()
+    shutil.rmtree(directory)
@@ -18,6 +18,7 @@ INCOMING_PACKET_PATTERN = r"^#(\w+)#((.*?);)([0-9a-f]+)?\r\n$"
 INCOMING_PACKET_REGEX = re.compile(INCOMING_PACKET_PATTERN, re.IGNORECASE)
 
 SEPARATOR = ";"
+BLACKBOX_SEPARATOR = "|"
 NOT_AVAILABLE = "NA"
 ALARM_PARAM = "SOS"
 # LBS_MMC_PARAM = "mcc%d"
@@ -82,6 +83,27 @@ class FullDataBody(NamedTuple):
     params: int
 
 
+class ImageBody(NamedTuple):
+    size: int
+    index: int
+    count: int
+    date: int
+    time: int
+    name: str
+
+
+class DddInfoBody(NamedTuple):
+    file_id: str
+    name: str
+
+
+class DddBody(NamedTuple):
+    file_id: str
+    size: int
+    index: int
+    count: int
+
+
 class PacketType(str, Enum):
     UNKNOWN = "UNKNOWN"
 
@@ -162,6 +184,47 @@ class ShortDataResponseCode(str, Enum):
     CRC_ERROR = "13"
 
 
+class ResultCode(str, Enum):
+    """Result of the answers that carry only success or failure: #AB#, #AI#, #AIT#, #AT#, #AM#."""
+    ERROR = "0"
+    OK = "1"
+
+
 class Position(NamedTuple):
     latitude: float
-    longitude: float
\ No newline at end of file
+    longitude: float
+
+
+# response packet type and the codes to answer a malformed packet with
+RESPONSE_TYPES = {
+    PacketType.DEV_LOGIN: PacketType.SRV_LOGIN_RESPONSE,
+    PacketType.DEV_SHORT_DATA: PacketType.SRV_SHORT_DATA_RESPONSE,
+    PacketType.DEV_EXTENDED_DATA: PacketType.SRV_EXTENDED_DATA_RESPONSE,
+    PacketType.DEV_BLACKBOX: PacketType.SRV_BLACKBOX_RESPONSE,
+    PacketType.DEV_PING: PacketType.SRV_PING,
+    PacketType.DEV_IMAGE: PacketType.SRV_IMAGE_RESPONSE,
+    PacketType.DEV_DDD_INFO: PacketType.SRV_DDD_INFO_RESPONSE,
+    PacketType.DEV_DDD: PacketType.SRV_DDD_RESPONSE,
+    PacketType.DRV_MESSAGE: PacketType.SRV_DRV_MESSAGE_RESPONSE,
+}
+
+# #P# has no error answer; #I# and #T# answers carry the block index first: #AI#<index>;0
+STRUCT_ERROR_CODES = {
+    PacketType.DEV_LOGIN: LoginResponseCode.ERROR,
+    PacketType.DEV_SHORT_DATA: ShortDataResponseCode.STRUCT_ERROR,
+    PacketType.DEV_EXTENDED_DATA: ExtendedDataResponseCode.STRUCT_ERROR,
+    PacketType.DEV_BLACKBOX: ResultCode.ERROR,
+    PacketType.DEV_IMAGE: ResultCode.ERROR,
+    PacketType.DEV_DDD_INFO: ResultCode.ERROR,
+    PacketType.DEV_DDD: ResultCode.ERROR,
+    PacketType.DRV_MESSAGE: ResultCode.ERROR,
+}
+
+CRC_ERROR_CODES = {
+    **STRUCT_ERROR_CODES,
+    PacketType.DEV_LOGIN: LoginResponseCode.CRC_ERROR,
+    PacketType.DEV_SHORT_DATA: ShortDataResponseCode.CRC_ERROR,
+    PacketType.DEV_EXTENDED_DATA: ExtendedDataResponseCode.CRC_ERROR,
+}
+
+INDEXED_RESPONSE_TYPES = frozenset((PacketType.DEV_IMAGE, PacketType.DEV_DDD))
@@ -1,8 +1,13 @@
+import calendar
+import math
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Union, Tuple
 
 from _wialonips.types import LAT_SIGN, LON_SIGN
 
+EARTH_RADIUS = 6371008.8  # meters
+
 
 def parse_datetime_with_nanoseconds(date_str: str, time_str: str):
     # Remove the fractional part for datetime parsing (seconds only)
@@ -78,4 +83,25 @@ def dms_to_decimal(deg_min: str, sign: Union[LAT_SIGN, LON_SIGN]) -> float:
     if sign in "SW":
         decimal = -decimal
 
-    return decimal
\ No newline at end of file
+    return decimal
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in meters between two decimal coordinates."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+@lru_cache(maxsize=1024)
+def _day_start(date: str) -> int:
+    return calendar.timegm((2000 + int(date[4:6]), int(date[2:4]), int(date[:2]), 0, 0, 0))
+
+
+def epoch_seconds(date: str, time: str) -> float:
+    """Seconds since the epoch of a DDMMYY date and HHMMSS[.fff] time, ValueError when malformed."""
+    if len(date) != 6 or len(time) < 6:
+        raise ValueError(f"Invalid date and time: {date} {time}")
+    return _day_start(date) + int(time[:2]) * 3600 + int(time[2:4]) * 60 + float(time[4:])
@@ -0,0 +1,51 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from _wialonips.protocol import Protocol
+from _wialonips.server import DeviceCredentials, Server
+from _wialonips.types import PacketType
+
+PASSWORD = "pw"
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def credentials(*imeis: str) -> dict:
+    return {imei: DeviceCredentials(imei, PASSWORD) for imei in imeis}
+
+
+def login(port: int, imei: str, version: str = "2.0") -> socket.socket:
+    """A device connection logged in to the server on `port`."""
+    c = socket.create_connection(("127.0.0.1", port))
+    c.settimeout(5)
+    c.sendall(Protocol(version).build_packet(PacketType.DEV_LOGIN, [version, imei, PASSWORD]))
+    assert c.recv(64) == b"#AL#1\r\n"
+    return c
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """Starts a server on the given listeners, stops it after the test."""
+    servers = []
+
+    def start(*listeners, **kwargs) -> Server:
+        server = Server(listeners=listeners, image_dir=str(tmp_path / "images"), ddd_dir=str(tmp_path / "ddd"),
+                        **kwargs)
+        threading.Thread(target=server.run, daemon=True).start()
+        assert wait_for(lambda: all(listener.sock is not None for listener in listeners))
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
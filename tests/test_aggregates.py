@@ -0,0 +1,120 @@
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+
+from _wialonips.aggregates import Aggregator
+from _wialonips.listener import AckPolicy
+from _wialonips.protocol import DevPacket
+from _wialonips.server import Device, DeviceCredentials
+from _wialonips.sink import MemorySink
+from _wialonips.types import PacketType
+
+START = datetime(2025, 2, 24, 8, 0, 0)
+
+
+def message(seconds: int, lat: float = 50.45, speed=0, inputs=0, adc=None) -> DevPacket:
+    at = START + timedelta(seconds=seconds)
+    deg = int(lat)
+    return DevPacket(PacketType.DEV_EXTENDED_DATA, date=at.strftime("%d%m%y"), time=at.strftime("%H%M%S"),
+                     lat_deg=f"{deg * 100 + (lat - deg) * 60:.6f}", lat_sign="N", lon_deg="03031.200000",
+                     lon_sign="E", speed=speed, inputs=inputs, adc=adc)
+
+
+def test_bucket_aggregates():
+    aggregator = Aggregator(bucket=3600, idle_speed=3, ignition_bit=0)
+    aggregator.update("1", message(0, speed=0, inputs=0b1))
+    aggregator.update("1", message(60, lat=50.46, speed=50, inputs=0b1))
+    aggregator.update("1", message(120, lat=50.47, speed=30, inputs=0))
+    aggregator.update("1", message(90, lat=51.0))  # late, left out
+    snapshot = aggregator.snapshot("1")
+    assert snapshot["messages"] == 3
+    assert snapshot["distance"] == pytest.approx(2224, rel=0.01)
+    assert snapshot["speed_max"] == 50 and snapshot["speed_avg"] == pytest.approx(80 / 3)
+    assert snapshot["idle"] == 60  # ignition on and standing from 0 to 60
+    assert snapshot["inputs_on"] == {0: 120}
+
+
+def test_resent_last_message_is_not_counted_again():
+    aggregator = Aggregator()
+    aggregator.update("1", message(0, speed=10))
+    aggregator.update("1", message(60, speed=50))
+    aggregator.update("1", message(60, speed=50))  # resent after a lost ack
+    aggregator.update("1", message(60, speed=20))  # same second, other content
+    snapshot = aggregator.snapshot("1")
+    assert snapshot["messages"] == 3
+    assert snapshot["speed_avg"] == pytest.approx(80 / 3)
+
+
+def test_gaps_are_not_counted():
+    aggregator = Aggregator(max_gap=300)
+    aggregator.update("1", message(0, inputs=0b10))
+    aggregator.update("1", message(1000, inputs=0b10))
+    assert aggregator.snapshot("1")["inputs_on"] == {}
+
+
+def test_adc_channels_keep_their_index():
+    aggregator = Aggregator()
+    aggregator.update("1", message(0, adc=[12.0, "NA", 3.0]))
+    aggregator.update("1", message(10, adc=[11.0, 5.0, 4.0]))
+    aggregator.update("1", message(20, adc=[None, 7.0]))
+    snapshot = aggregator.snapshot("1")
+    assert snapshot["adc_min"] == {0: 11.0, 1: 5.0, 2: 3.0}
+    assert snapshot["adc_max"] == {0: 12.0, 1: 7.0, 2: 4.0}
+
+
+def test_export_writes_changed_and_completed_buckets():
+    aggregator = Aggregator(bucket=3600)
+    sink = MemorySink()
+    aggregator.update("1", message(0))
+    aggregator.update("1", message(3600))
+    aggregator.update("2", message(0))
+    assert aggregator.export(sink, force=True) == 3
+    assert sorted((imei, s["start"] % 86400 // 3600, s["complete"]) for imei, s in sink.snapshots) == [
+        ("1", 8, True), ("1", 9, False), ("2", 8, False)]
+    assert aggregator.export(sink, force=True) == 0
+    assert aggregator.export(sink) == 0  # before the interval
+
+
+class FailingSink(MemorySink):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def write(self, imei, packet):
+        self._fail()
+        super().write(imei, packet)
+
+    def write_snapshot(self, imei, snapshot):
+        self._fail()
+        super().write_snapshot(imei, snapshot)
+
+    def _fail(self):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+
+
+def test_snapshots_are_kept_when_the_sink_fails():
+    aggregator = Aggregator(bucket=3600)
+    aggregator.update("1", message(0))
+    aggregator.update("1", message(3600))
+    sink = FailingSink(failures=1)
+    with pytest.raises(OSError):
+        aggregator.export(sink, force=True)
+    assert aggregator.export(sink, force=True) == 2
+    assert [s["complete"] for _, s in sink.snapshots] == [True, False]
+
+
+def test_messages_are_aggregated_once_stored():
+    aggregator = Aggregator()
+    a, b = socket.socketpair()
+    dev = Device(a, DeviceCredentials("1"), sink=FailingSink(failures=1), ack_policy=AckPolicy.AFTER_WRITE,
+                 aggregates=aggregator)
+    packets = [message(0, speed=10), message(60, speed=50)]
+    dev.store(packets, b"#AB#2\r\n")  # the sink fails, not acked
+    assert aggregator.snapshot("1") is None
+    dev.store(packets, b"#AB#2\r\n")  # resent
+    assert aggregator.snapshot("1")["messages"] == 2
+    a.close()
+    b.close()
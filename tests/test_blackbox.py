@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip("ujson")
+
+from fsm import Priority, Record  # noqa: E402
+from blackbox import BlackBox, record_size  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the cache file is relative to the working directory
+    return tmp_path
+
+
+def record(priority, n):
+    return Record(priority, {"date": "240225", "time": f"{n:06d}"}, (None, None))
+
+
+def test_evicts_lowest_priority_first():
+    box = BlackBox(max_records=3)
+    box.on_record(record(Priority.PANIC, 1))
+    box.on_record(record(Priority.LOW, 2))
+    box.on_record(record(Priority.HIGH, 3))
+    box.on_record(record(Priority.LOW, 4))
+    box.on_record(record(Priority.HIGH, 5))
+    assert len(box.queue) == 3
+    assert box.evicted == {Priority.LOW: 2}
+    assert box.peek(3) == [record(p, n).full for p, n in ((Priority.PANIC, 1), (Priority.HIGH, 3),
+                                                           (Priority.HIGH, 5))]
+
+
+def test_evicts_oldest_within_a_priority():
+    box = BlackBox(max_records=2)
+    for n in range(4):
+        box.on_record(record(Priority.LOW, n))
+    assert box.peek(2) == [record(Priority.LOW, 2).full, record(Priority.LOW, 3).full]
+    assert box.dropped == 2
+
+
+def test_byte_budget():
+    size = len(record(Priority.LOW, 0).full)
+    box = BlackBox(max_bytes=3 * (size + 32))
+    for n in range(5):
+        box.on_record(record(Priority.LOW, n))
+    assert len(box.queue) == 3
+    assert box.size == sum(record_size(r) for r in box.queue) <= box.max_bytes
+
+
+def test_confirm_pops_in_priority_order_and_frees_bytes():
+    box = BlackBox()
+    box.on_record(record(Priority.LOW, 1))
+    box.on_record(record(Priority.PANIC, 2))
+    assert [r.record for r in box.confirm()] == [record(Priority.PANIC, 2).full]
+    assert box.size == sum(record_size(r) for r in box.queue)
+
+
+def test_limits_apply_to_the_loaded_cache():
+    box = BlackBox()
+    for n in range(5):
+        box.on_record(record(Priority.HIGH if n == 0 else Priority.LOW, n))
+    box = BlackBox(max_records=2)
+    assert box.peek(2) == [record(Priority.HIGH, 0).full, record(Priority.LOW, 4).full]
+    assert box.evicted == {Priority.LOW: 3}
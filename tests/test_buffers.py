@@ -0,0 +1,53 @@
+import threading
+import time
+
+from conftest import credentials, login, wait_for
+from _wialonips.buffers import BufferPool
+from _wialonips.guard import ClientLimits
+from _wialonips.listener import Listener
+from _wialonips.protocol import Protocol
+
+DATA = Protocol().build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+
+
+def test_buffers_are_reused_up_to_max_free():
+    pool = BufferPool(size=64, max_free=1)
+    a, b = pool.acquire(), pool.acquire()
+    assert len(a) == 64 and pool.allocated == 2
+    pool.release(a)
+    pool.release(b)  # over max_free, left to the garbage collector
+    assert pool.acquire() is a
+    pool.acquire()
+    assert pool.allocated == 3
+
+
+def test_pool_is_thread_safe():
+    pool = BufferPool(max_free=8)
+
+    def work():
+        for _ in range(1000):
+            pool.release(pool.acquire())
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert pool.allocated <= 8
+
+
+def test_idle_connections_hold_no_receive_buffer(serve):
+    listener = Listener(port=0, credentials=credentials(*map(str, range(20))),
+                        client_limits=ClientLimits(max_unauthenticated=None))
+    server = serve(listener)
+    clients = [login(listener.port, str(d)) for d in range(20)]
+    for c in clients:
+        c.sendall(DATA)
+        assert c.recv(64) == b"#ASD#1\r\n"
+    time.sleep(0.1)  # every connection waits for its next packet
+    # reads happen one after the other here, a few buffers serve all connections
+    assert server.buffers.allocated < len(clients)
+    assert len(server.buffers._free) == server.buffers.allocated
+    for c in clients:
+        c.close()
+    assert wait_for(lambda: not server._open)
@@ -0,0 +1,108 @@
+import os
+import threading
+
+from _wialonips import ddd
+from _wialonips.ddd import DddReassembler
+from _wialonips.protocol import DevPacket
+from _wialonips.spool import ChunkSpool
+from _wialonips.types import PacketType
+
+BLOCK_SIZE = 16
+
+
+class Reassembler(DddReassembler):
+    def __init__(self, spool):
+        super().__init__(spool, workers=2)
+        self.files = []
+        self.done = threading.Event()
+
+    def on_file(self, imei, path, size):
+        self.files.append((imei, path, size))
+        self.done.set()
+
+
+def blocks(data: bytes, file_id: str = "1"):
+    count = (len(data) + BLOCK_SIZE - 1) // BLOCK_SIZE
+    return [DevPacket(PacketType.DEV_DDD, file_id=file_id, size=BLOCK_SIZE, index=i, count=count,
+                      payload=data[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE]) for i in range(count)]
+
+
+def info(name: str, file_id: str = "1"):
+    return DevPacket(PacketType.DEV_DDD_INFO, file_id=file_id, name=name)
+
+
+def parts(directory):
+    return [name for name in os.listdir(directory) if name.endswith((".part", ".meta"))]
+
+
+def test_file_reassembled_out_of_order(tmp_path):
+    reassembler = Reassembler(ChunkSpool(str(tmp_path)))
+    data = os.urandom(BLOCK_SIZE * 4 + 5)
+    acks = []
+    reassembler.on_info("1", info("card.ddd"), acks.append)
+    packets = blocks(data)
+    for packet in packets[2:] + packets[:2]:
+        reassembler.on_block("1", packet, acks.append)
+    assert reassembler.done.wait(5)
+    reassembler.close()
+
+    (imei, path, size), = reassembler.files
+    assert (imei, os.path.basename(path), size) == ("1", "1_card.ddd", len(data))
+    with open(path, "rb") as f:
+        assert f.read() == data
+    assert sorted(acks[1:]) == sorted(b"#AT#%d;1\r\n" % i for i in range(len(packets)))
+    assert not parts(tmp_path)
+
+
+def test_resend_after_completion_is_acked_without_a_new_transfer(tmp_path):
+    reassembler = Reassembler(ChunkSpool(str(tmp_path)))
+    packets = blocks(os.urandom(BLOCK_SIZE * 3))
+    acks = []
+    for packet in packets:
+        reassembler.on_block("1", packet, acks.append)
+    assert reassembler.done.wait(5)
+
+    reassembler.on_block("1", packets[-1], acks.append)  # the last ack got lost
+    reassembler.close()
+    assert acks[-1] == b"#AT#2;1\r\n"
+    assert len(reassembler.files) == 1
+    assert not parts(tmp_path)
+
+
+def test_info_starts_a_new_file_under_the_same_id(tmp_path):
+    reassembler = Reassembler(ChunkSpool(str(tmp_path)))
+    for name in ("a.ddd", "b.ddd"):
+        reassembler.done.clear()
+        reassembler.on_info("1", info(name), lambda ack: None)
+        for packet in blocks(os.urandom(BLOCK_SIZE * 2)):
+            reassembler.on_block("1", packet, lambda ack: None)
+        assert reassembler.done.wait(5)
+    reassembler.close()
+    assert [os.path.basename(path) for _, path, _ in reassembler.files] == ["1_a.ddd", "1_b.ddd"]
+
+
+def test_names_of_unfinished_files_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(ddd, "MAX_NAMES", 2)
+    reassembler = Reassembler(ChunkSpool(str(tmp_path)))
+    for file_id in "123":  # a device that keeps starting files and never finishes them
+        reassembler.on_info("1", info(f"{file_id}.ddd", file_id), lambda ack: None)
+    assert list(reassembler._names) == ["1_ddd_2", "1_ddd_3"]
+    for packet in blocks(os.urandom(BLOCK_SIZE), "1"):
+        reassembler.on_block("1", packet, lambda ack: None)
+    assert reassembler.done.wait(5)
+    reassembler.close()
+    assert os.path.basename(reassembler.files[0][1]) == "1_ddd_1.ddd"  # its name was dropped
+
+
+def test_close_releases_unfinished_transfers(tmp_path):
+    spool = ChunkSpool(str(tmp_path))
+    reassembler = Reassembler(spool)
+    packets = blocks(os.urandom(BLOCK_SIZE * 3))
+    reassembler.on_block("1", packets[0], lambda ack: None)
+    reassembler.close()
+    assert not spool._open
+    assert sorted(parts(tmp_path)) == ["1_ddd_1.meta", "1_ddd_1.part"]  # resumed by the next server
+
+    acks = []
+    reassembler.on_block("1", packets[1], acks.append)
+    assert acks == [b"#AT#1;0\r\n"]
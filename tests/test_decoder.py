@@ -0,0 +1,89 @@
+import pytest
+
+from conftest import credentials, login
+from _wialonips.decoder import ConnectionDecoder, DecoderV1, DecoderV2, create_decoder, login_version
+from _wialonips.listener import Listener
+from _wialonips.protocol import Protocol
+from _wialonips.types import (
+    ExtendedDataResponseCode, LoginResponseCode, PacketType, ResultCode, ShortDataResponseCode,
+)
+
+protocol = Protocol()
+LOGIN_V2 = protocol.build_packet(PacketType.DEV_LOGIN, ["2.0", "865432100012345", "secret"])
+LOGIN_V1 = b"#L#865432100012345;secret\r\n"
+EXTENDED = protocol.build_data_packet(None, 50.45, 30.52, 60, 90, 150, 9, 1.2, 5, 0, [12.4], "NA", fuel=34.5)
+
+
+def v1(packet: bytes) -> bytes:
+    """The packet as 1.1 sends it: no separator and CRC before CRLF."""
+    return packet[:packet.rindex(b";")] + b"\r\n"
+
+
+def test_base_decoder_is_abstract():
+    with pytest.raises(TypeError):
+        ConnectionDecoder()
+
+
+@pytest.mark.parametrize("login, version, cls", [
+    (LOGIN_V1, "1.1", DecoderV1),
+    (LOGIN_V2, "2.0", DecoderV2),
+    (b"#P#\r\n", "2.0", DecoderV2),
+])
+def test_decoder_is_picked_from_the_login(login, version, cls):
+    assert login_version(login) == version
+    assert type(create_decoder(login_version(login))) is cls
+
+
+def test_v1_login_and_data():
+    decoder = create_decoder("1.1")
+    login = decoder.decode(LOGIN_V1)
+    assert (login.imei, login.password, login.protocol_version) == ("865432100012345", "secret", "1.1")
+    data = decoder.decode(v1(EXTENDED))
+    assert data.code is None
+    assert data.params["fuel"] == 34.5
+
+
+def test_v2_checks_the_crc():
+    decoder = create_decoder("2.0")
+    assert decoder.decode(EXTENDED).code is None
+    bad = EXTENDED.replace(b"150", b"151")
+    assert decoder.decode(bad).code is ExtendedDataResponseCode.CRC_ERROR
+    assert decoder.decode(v1(EXTENDED)).code is not None
+
+
+def test_repeated_header_skips_the_type_lookup():
+    decoder = create_decoder("2.0")
+    for _ in range(3):
+        assert decoder.decode(EXTENDED).type is PacketType.DEV_EXTENDED_DATA
+    assert (decoder.misses, decoder.hits) == (1, 2)
+
+
+@pytest.mark.parametrize("version, frame, code", [
+    ("1.1", b"#L#\xff;pw\r\n", LoginResponseCode.ERROR),
+    ("1.1", b"#SD#" + b"NA;" * 9 + b"\xff\r\n", ShortDataResponseCode.STRUCT_ERROR),
+    ("1.1", b"#M#\xff\xfe\r\n", ResultCode.ERROR),
+    ("2.0", protocol.build_packet(PacketType.DEV_LOGIN, ["2.0", "\u00ff", "pw"]), LoginResponseCode.ERROR),
+    ("2.0", protocol.build_packet(PacketType.DEV_SHORT_DATA, ["NA"] * 9 + ["\u00ff"]),
+     ShortDataResponseCode.STRUCT_ERROR),
+    ("2.0", b"#AM#\xff\r\n", ResultCode.ERROR),
+])
+def test_undecodable_fields_are_malformed(version, frame, code):
+    assert create_decoder(version).decode(frame).code is code
+
+
+@pytest.mark.parametrize("version", ["1.1", "2.0"])
+def test_driver_message_is_utf8(version):
+    frame = Protocol(version).build_driver_message("Повертайтесь на базу")
+    message = create_decoder(version).decode(frame)
+    assert message.code is None and message.message == "Повертайтесь на базу"
+
+
+def test_undecodable_frame_does_not_drop_the_connection(serve):
+    listener = Listener(port=0, credentials=credentials("1"))
+    serve(listener)
+    c = login(listener.port, "1")
+    c.sendall(protocol.build_packet(PacketType.DEV_SHORT_DATA, ["NA"] * 9 + ["\u00ff"]))
+    assert c.recv(64) == b"#ASD#-1\r\n"
+    c.sendall(b"#P#\r\n")
+    assert c.recv(64) == b"#AP#\r\n"
+    c.close()
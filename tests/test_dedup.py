@@ -0,0 +1,121 @@
+import random
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+
+from _wialonips.decoder import create_decoder
+from _wialonips.dedup import BloomFilter, Deduplicator
+from _wialonips.listener import AckPolicy
+from _wialonips.protocol import Protocol
+from _wialonips.server import Device, DeviceCredentials
+from _wialonips.sink import MemorySink
+from _wialonips.types import PacketType
+
+protocol = Protocol()
+decoder = create_decoder("2.0")
+START = datetime(2025, 2, 24, 8, 0, 0)
+
+
+def body(i: int, lat: float = 50.45) -> str:
+    packet = protocol.build_data_packet(
+        date_time=START + timedelta(seconds=10 * i), lat=lat + i * 1e-4, lon=30.52, speed=40, course=90,
+        alt=150, sats=9, hdop=1.0, inputs=0b101, outputs=0, adc=[12.4], ibutton="NA", battery=80)
+    return packet[3:packet.rindex(b";") + 1].decode("ascii")  # body without CRC
+
+
+def live(i: int):
+    return decoder.decode(protocol.build_packet(PacketType.DEV_EXTENDED_DATA, [body(i)[:-1]]))
+
+
+def blackbox(bodies):
+    return decoder.decode(protocol.build_black_box_packet(bodies))
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 1e-4)
+    keys = random.sample(range(1 << 62), 1000)
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert all(bloom.add(key) for key in keys)
+    assert bloom.count <= 1000
+
+
+def test_blackbox_resend_of_live_messages_is_recognized():
+    dedup = Deduplicator()
+    assert not any(dedup.seen("1", live(i)) for i in range(5))
+    assert all(dedup.seen("1", packet) for packet in blackbox([body(i) for i in range(5)]).packets)
+    assert not dedup.seen("2", live(0))  # other device
+    assert not dedup.seen("1", blackbox([body(2, lat=48.0)]).packets[0])  # same time, other content
+    assert dedup.duplicates == 5 and dedup.filtered == 0
+
+
+def test_filter_catches_resends_after_the_window_is_evicted():
+    dedup = Deduplicator(window=4, max_devices=1)
+    for i in range(10):
+        dedup.seen("1", live(i))
+    dedup.seen("2", live(0))  # takes the only window
+    assert dedup.seen("1", live(3))
+    assert dedup.filtered == 1
+
+
+def test_nbytes_counts_the_generations_that_exist():
+    dedup = Deduplicator(capacity=4)
+    one = dedup._current.nbytes
+    assert dedup.nbytes == one
+    for i in range(5):  # the fifth key rolls over to a new generation
+        dedup.seen("1", live(i))
+    assert dedup._previous is not None and dedup.nbytes == 2 * one
+
+
+def test_fresh_records_nothing():
+    dedup = Deduplicator()
+    packets = blackbox([body(0), body(1), body(0)]).packets
+    fresh = dedup.fresh("1", packets)
+    assert [p.time for p in fresh] == [packets[0].time, packets[1].time]  # the repeat within the packet goes
+    assert dedup.fresh("1", packets[:2]) == packets[:2]
+    dedup.add("1", fresh)
+    assert dedup.fresh("1", packets) == []
+
+
+class FailingSink(MemorySink):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def write(self, imei, packet):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        super().write(imei, packet)
+
+
+@pytest.fixture
+def device_pair():
+    a, b = socket.socketpair()
+    b.settimeout(1)
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_resend_after_sink_failure_is_written(device_pair):
+    a, b = device_pair
+    sink = FailingSink(failures=1)
+    dev = Device(a, DeviceCredentials("1"), sink=sink, ack_policy=AckPolicy.AFTER_WRITE, dedup=Deduplicator())
+    packet = blackbox([body(0), body(1)])
+
+    dev.on_message_received(packet)  # the first write fails, no ack
+    b.setblocking(False)
+    with pytest.raises(BlockingIOError):
+        b.recv(64)
+    b.setblocking(True)
+
+    dev.on_message_received(blackbox([body(0), body(1)]))  # resent
+    assert b.recv(64) == b"#AB#2\r\n"
+    assert [p.time for _, p in sink.packets] == [p.time for p in packet.packets]
+
+    dev.on_message_received(blackbox([body(0), body(1)]))  # the ack got lost
+    assert b.recv(64) == b"#AB#2\r\n"
+    assert len(sink.packets) == 2
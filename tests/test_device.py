@@ -0,0 +1,66 @@
+import pytest
+
+pytest.importorskip("ujson")
+pytest.importorskip("geocoder")
+
+import os  # noqa: E402
+
+from _wialonips.framing import Framer, compress_frame  # noqa: E402
+from _wialonips.protocol import Protocol  # noqa: E402
+from blackbox import BlackBox  # noqa: E402
+from device import Device, compress  # noqa: E402
+from fsm import IOObserver, Priority, Record  # noqa: E402
+from track import ReportingPolicy  # noqa: E402
+
+
+@pytest.fixture
+def blackbox(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the cache file is relative to the working directory
+    box = BlackBox()
+    for i in range(10):  # a straight track, the middle points are redundant
+        box.on_record(Record(Priority.LOW, {"date": "240225", "time": f"{i:06d}", "lat": "5027.000", "ns": "N",
+                                            "lon": f"03031.{i:03d}", "ew": "E"}, (None, None)))
+    return box
+
+
+class Sent(Device):
+    def send_batch(self):
+        self.blackbox.confirm(len(self.blackbox.queue))
+
+
+@pytest.mark.parametrize("policy, left", [
+    (None, 10),
+    (ReportingPolicy(), 10),
+    (ReportingPolicy(simplify_tolerance=20), 2),
+])
+def test_backlog_is_simplified_only_when_the_policy_asks(blackbox, policy, left):
+    device = Sent(IOObserver(), blackbox, policy, batch_size=10)
+    device.send_records()
+    assert blackbox.simplified == 10 - left
+
+
+class Captured(Device):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+@pytest.mark.parametrize("compress_threshold", [None, 0])
+def test_batch_is_framed_like_the_server_expects(blackbox, compress_threshold):
+    # the firmware keeps its own copy of the #B# and compressed framing, this pins it to _wialonips
+    device = Captured(IOObserver(), blackbox, batch_size=10, compress_threshold=compress_threshold)
+    bodies = blackbox.peek(10)
+    device.resp_queue.put(b"#AB#10\r\n")
+    device.send_batch()
+    packet, = device.sent
+    assert packet.startswith(b"\xff") == (compress_threshold is not None)
+    assert Framer().feed(packet) == [Protocol().build_black_box_packet(bodies)]
+    assert len(blackbox.queue) == 0
+
+
+@pytest.mark.parametrize("packet", [b"#P#\r\n", b"#SD#" + b"NA;" * 200 + b"\r\n", os.urandom(512)])
+def test_compress_matches_the_server(packet):
+    assert compress(packet) == compress_frame(packet)
@@ -0,0 +1,85 @@
+import zlib
+
+import pytest
+
+from _wialonips.framing import COMPRESSED_MARKER, Framer, FramingError, compress_frame, inflate
+from _wialonips.protocol import Protocol
+
+protocol = Protocol()
+DATA = protocol.build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+PING = b"#P#\r\n"
+
+
+def test_splits_packets_across_reads():
+    framer = Framer()
+    stream = DATA + PING + DATA
+    frames = []
+    for i in range(0, len(stream), 7):
+        frames += framer.feed(stream[i:i + 7])
+    assert frames == [DATA, PING, DATA]
+    assert framer.buffered == 0
+
+
+def test_keeps_an_incomplete_frame():
+    framer = Framer()
+    assert framer.feed(DATA[:-1]) == []
+    assert framer.buffered == len(DATA) - 1
+    assert framer.feed(DATA[-1:]) == [DATA]
+
+
+def test_binary_block_follows_its_header():
+    block = b"\r\n\x00\xff" * 4
+    image = b"#I#%d;0;1;NA;NA;a.jpg;\r\n" % len(block) + block
+    framer = Framer()
+    assert framer.feed(image[:30]) == []
+    assert framer.feed(image[30:] + PING) == [image, PING]
+
+
+def test_compressed_frame_holds_several_packets():
+    frame = protocol.build_black_box_packet([DATA[4:DATA.rindex(b";") + 1].decode("ascii")] * 20)
+    wire = compress_frame(frame + PING)
+    assert wire[0] == COMPRESSED_MARKER and len(wire) < len(frame)
+    framer = Framer()
+    assert framer.feed(wire[:2]) == []  # header not complete
+    assert framer.feed(wire[2:]) == [frame, PING]
+
+
+def test_compress_frame_keeps_frames_it_cannot_shrink():
+    assert compress_frame(PING) == PING
+
+
+def test_frame_too_long():
+    framer = Framer(max_frame_len=64)
+    with pytest.raises(FramingError):
+        framer.feed(b"#D#" + b"1;" * 40)
+
+
+def test_binary_block_too_long():
+    framer = Framer(max_frame_len=64)
+    with pytest.raises(FramingError):
+        framer.feed(b"#I#100000;0;1;NA;NA;a.jpg;\r\n")
+
+
+def test_malformed_binary_size_is_left_to_the_parser():
+    frame = b"#I#x;0;1;NA;NA;a.jpg;\r\n"
+    assert Framer().feed(frame) == [frame]
+
+
+def test_invalid_compressed_frame():
+    with pytest.raises(FramingError, match="Invalid compressed frame"):
+        Framer().feed(bytes((COMPRESSED_MARKER, 4, 0)) + b"nope")
+
+
+def test_truncated_packet_in_compressed_frame():
+    data = zlib.compress(PING + b"#P#")
+    with pytest.raises(FramingError, match="Truncated"):
+        Framer().feed(bytes((COMPRESSED_MARKER,)) + len(data).to_bytes(2, "little") + data)
+
+
+def test_decompression_bomb():
+    bomb = zlib.compress(b"\r\n" * 100_000)
+    with pytest.raises(FramingError, match="exceeds"):
+        inflate(bomb, limit=1024)
+    framer = Framer(max_decompressed_len=1024)
+    with pytest.raises(FramingError, match="exceeds"):
+        framer.feed(bytes((COMPRESSED_MARKER,)) + len(bomb).to_bytes(2, "little") + bomb)
@@ -0,0 +1,54 @@
+from fsm import IOElement, IOObserver, Operand, Priority
+
+
+def observer():
+    o = IOObserver()
+    o.inputs.extend(IOElement(value=0, priority=Priority.LOW, operand=Operand.ON_CHANGE) for _ in range(8))
+    o.inputs[3].priority = Priority.HIGH
+    o.outputs.extend(IOElement(value=0, priority=Priority.LOW) for _ in range(4))
+    o.adc.extend(IOElement(value=0.0, priority=Priority.LOW, operand=Operand.ON_DELTA_CHANGE, hi_lvl=1.0)
+                 for _ in range(2))
+    o.params["fuel"] = IOElement(value=10.0, priority=Priority.LOW)
+    o.params["door"] = IOElement(priority=Priority.HIGH, operand=Operand.ON_CHANGE, event_only=True)
+    o.positional["ibutton"] = IOElement(priority=Priority.HIGH, operand=Operand.ON_CHANGE)
+    return o
+
+
+def drive(o):
+    records = []
+    o.on_event = records.append
+    for i in range(40):
+        o.upd_positional("220225", f"{i:06d}", "5027.282", "N", f"03031.{i % 4:03d}", "E", i % 90, 90, 100, 7)
+        o.upd_inputs_mask((i * 2654435761) & 0xFF)
+        o.upd_output(i % 4, i & 1)
+        o.upd_adc(i % 2, i * 0.4)
+        o.upd_params(fuel=float(i % 3), door=i % 5 == 0)
+        if i % 7 == 0:
+            o.upd_positional(ibutton=f"driver{i % 2}")
+        o.event()
+    return records
+
+
+def test_compiled_matches_plain_observer():
+    expected = drive(observer())
+    got = drive(observer().compile())
+    assert [(r.priority, r.positional, r.io, r.adc, r.params, r.full, r.short) for r in got] == \
+           [(r.priority, r.positional, r.io, r.adc, r.params, r.full, r.short) for r in expected]
+
+
+def test_positional_priority_triggers_an_event():
+    o = observer().compile()
+    records = []
+    o.on_event = records.append
+    o.upd_positional("220225", "000001")
+    assert records == []
+    o.upd_positional(ibutton="driver")
+    assert [r.priority for r in records] == [Priority.HIGH]
+    assert records[0].positional["ibutton"] == "driver"
+
+
+def test_io_follows_mask_updates():
+    o = observer().compile()
+    o.upd_inputs_mask(0b1010_0101)
+    o.upd_output(2, 1)
+    assert o.io == (0b1010_0101, 0b0100)
@@ -0,0 +1,66 @@
+import pytest
+
+from _wialonips.geofence import ENTER, EXIT, Circle, GeofenceEngine, Polygon
+from _wialonips.protocol import DevPacket
+from _wialonips.types import PacketType
+
+
+def at(lat: float, lon: float) -> DevPacket:
+    def nmea(value, width):
+        deg = int(value)
+        return f"{deg * 100 + (value - deg) * 60:0{width}.6f}"
+
+    return DevPacket(PacketType.DEV_SHORT_DATA, lat_deg=nmea(lat, 11), lat_sign="N",
+                     lon_deg=nmea(lon, 12), lon_sign="E")
+
+
+class Recording(GeofenceEngine):
+    def __init__(self, *args, **kwargs):
+        self.events = []
+        super().__init__(*args, **kwargs)
+
+    def on_event(self, event):
+        self.events.append((event.imei, event.fence, event.event))
+
+
+def test_circle_and_polygon_contain():
+    circle = Circle("depot", 50.45, 30.52, 500)
+    assert circle.contains(50.45, 30.52) and circle.contains(50.454, 30.52)  # ~445 m north
+    assert not circle.contains(50.455, 30.52)  # ~556 m
+    square = Polygon("yard", [(50.0, 30.0), (50.0, 30.1), (50.1, 30.1), (50.1, 30.0)])
+    assert square.contains(50.05, 30.05)
+    assert not square.contains(50.05, 30.15) and not square.contains(49.99, 30.05)
+    with pytest.raises(ValueError):
+        Polygon("line", [(50.0, 30.0), (50.1, 30.1)])
+
+
+def test_enter_and_exit_events():
+    engine = Recording([Circle("depot", 50.45, 30.52, 500),
+                        Polygon("city", [(50.3, 30.3), (50.3, 30.7), (50.6, 30.7), (50.6, 30.3)])])
+    assert engine.update("1", at(51.0, 31.0)) == []
+    engine.update("1", at(50.40, 30.40))
+    engine.update("1", at(50.45, 30.52))
+    engine.update("1", at(50.45, 30.52))  # no change, no event
+    engine.update("1", at(51.0, 31.0))
+    assert engine.events[:2] == [("1", "city", ENTER), ("1", "depot", ENTER)]
+    assert sorted(engine.events[2:]) == [("1", "city", EXIT), ("1", "depot", EXIT)]  # one update, any order
+    assert engine.inside("1") == set()
+
+
+def test_fences_spanning_many_cells_are_found_in_each():
+    engine = GeofenceEngine([Circle("big", 50.45, 30.52, 20_000)], cell=0.01)
+    assert engine.fences_at(50.45, 30.52) == {"big"}
+    assert engine.fences_at(50.60, 30.52) == {"big"}  # ~17 km north, another cell
+    assert engine.fences_at(50.70, 30.52) == set()
+
+
+def test_removed_and_replaced_fences():
+    engine = Recording([Circle("depot", 50.45, 30.52, 500)])
+    engine.update("1", at(50.45, 30.52))
+    engine.remove("depot")
+    assert engine.fences_at(50.45, 30.52) == set()
+    engine.update("1", at(50.45, 30.52))
+    assert engine.events == [("1", "depot", ENTER)]  # no exit from a removed fence
+    engine.add(Circle("depot", 10.0, 10.0, 500))
+    engine.add(Circle("depot", 50.45, 30.52, 500))  # replaces the first one
+    assert len(engine) == 1 and engine.fences_at(10.0, 10.0) == set()
@@ -0,0 +1,172 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from _wialonips.guard import (
+    IDLE_TIMEOUTS, LOGIN_TIMEOUTS, SLOW_CLIENTS, ClientLimits, Unauthenticated, Watchdog, send_timeout,
+    set_send_timeout,
+)
+from _wialonips.listener import Listener
+from _wialonips.protocol import Protocol
+from _wialonips.types import PacketType
+from conftest import credentials, login, wait_for
+
+LIMITS = ClientLimits(login_timeout=10, idle_timeout=60, min_rate=100, rate_grace=5)
+
+
+def test_login_deadline():
+    watchdog = Watchdog(LIMITS, now=0)
+    assert watchdog.timeout(now=0) == 10
+    assert watchdog.expired(now=9.9) is None
+    assert watchdog.expired(now=10) == LOGIN_TIMEOUTS
+    watchdog.logged_in = True
+    assert watchdog.expired(now=10) is None
+
+
+def test_idle_deadline_moves_with_every_read():
+    watchdog = Watchdog(LIMITS, now=0)
+    watchdog.logged_in = True
+    watchdog.received(50, 1, 0, now=40)
+    assert watchdog.timeout(now=40) == 60
+    assert watchdog.expired(now=99) is None
+    assert watchdog.expired(now=100) == IDLE_TIMEOUTS
+
+
+def test_incomplete_frame_must_keep_the_minimum_rate():
+    watchdog = Watchdog(LIMITS, now=0)
+    watchdog.logged_in = True
+    watchdog.received(10, 0, 10, now=1)  # a frame starts
+    assert watchdog.expired(now=5.9) is None  # rate_grace
+    assert watchdog.expired(now=6) == SLOW_CLIENTS
+    for t in range(2, 12):  # 100 bytes/s keeps it alive past the grace period
+        watchdog.received(100, 0, 10 + 100 * (t - 1), now=t)
+    assert watchdog.expired(now=11) is None
+    watchdog.received(5, 1, 0, now=11.5)  # completed, only the idle limit is left
+    assert watchdog.frame_start is None
+    assert watchdog.expired(now=70) is None
+
+
+def test_limits_can_be_disabled():
+    watchdog = Watchdog(ClientLimits(None, None, None, 0, None, None), now=0)
+    watchdog.received(1, 0, 1, now=0)
+    assert watchdog.timeout(now=0) is None
+    assert watchdog.expired(now=1e9) is None
+
+
+def test_unauthenticated_per_ip():
+    unauthenticated = Unauthenticated(2)
+    assert unauthenticated.acquire("10.0.0.1") and unauthenticated.acquire("10.0.0.1")
+    assert not unauthenticated.acquire("10.0.0.1")
+    assert unauthenticated.acquire("10.0.0.2")
+    unauthenticated.release("10.0.0.1")
+    assert unauthenticated.acquire("10.0.0.1")
+    assert len(unauthenticated) == 3
+
+
+def test_send_timeout_keeps_the_socket_blocking():
+    a, b = socket.socketpair()
+    with a, b:
+        assert send_timeout(a) is None
+        set_send_timeout(a, 0.2)
+        assert send_timeout(a) == pytest.approx(0.2)
+        assert a.gettimeout() is None
+        t = time.monotonic()
+        with pytest.raises(BlockingIOError):
+            while True:
+                a.send(b"x" * 65536)  # nobody reads b
+        assert time.monotonic() - t < 2
+        with pytest.raises(BlockingIOError):
+            a.send(b"x", socket.MSG_DONTWAIT)  # returns at once, not after the timeout
+        set_send_timeout(a, None)
+        assert send_timeout(a) is None
+
+
+def closed(c: socket.socket, timeout: float) -> bool:
+    c.settimeout(timeout)
+    try:
+        return c.recv(64) == b""
+    except ConnectionResetError:
+        return True
+    except socket.timeout:
+        return False
+
+
+def test_server_closes_clients_that_break_the_limits(serve):
+    limits = ClientLimits(login_timeout=0.5, idle_timeout=1, min_rate=50, rate_grace=0.5, max_unauthenticated=2)
+    listener = Listener(port=0, credentials=credentials("1", "2"), client_limits=limits)
+    server = serve(listener)
+    port = listener.port
+
+    silent = socket.create_connection(("127.0.0.1", port))  # never logs in
+    idle = login(port, "1")
+    assert closed(silent, 3)
+    assert closed(idle, 3)
+    slow = login(port, "2")
+    slow.sendall(b"#D#")  # a frame that never completes
+    assert closed(slow, 3)
+    metrics = server.metrics.snapshot()[listener.name]
+    assert metrics[LOGIN_TIMEOUTS] == 1
+    assert metrics[IDLE_TIMEOUTS] == 1
+    assert metrics[SLOW_CLIENTS] == 1
+    for c in (silent, idle, slow):
+        c.close()
+
+
+def test_server_caps_connections_without_a_login(serve):
+    listener = Listener(port=0, credentials=credentials("1"), client_limits=ClientLimits(max_unauthenticated=2))
+    server = serve(listener)
+    scanners = [socket.create_connection(("127.0.0.1", listener.port)) for _ in range(3)]
+    assert closed(scanners[2], 3)
+    assert not closed(scanners[0], 0.2)
+    assert server.metrics.snapshot()[listener.name]["rejected_unauthenticated"] == 1
+    for c in scanners:
+        c.close()
+    login(listener.port, "1").close()  # closed scanners gave their slots back
+
+
+def test_rollout_and_broadcast_with_client_limits(serve, tmp_path):
+    """Send timeouts must not turn the sockets non-blocking under sendfile and MSG_DONTWAIT."""
+    imeis = [str(i) for i in range(4)]
+    limits = ClientLimits(send_timeout=2)
+    listener = Listener(port=0, credentials=credentials(*imeis), client_limits=limits)
+    server = serve(listener)
+    devices = [login(listener.port, imei) for imei in imeis]
+
+    path = tmp_path / "firmware.bin"
+    firmware = os.urandom(4 * 2 ** 20)
+    path.write_bytes(firmware)
+    received = {}
+
+    def read(imei, c):
+        buf = bytearray()
+        while len(buf) < len(firmware) + 32 and not buf.endswith(firmware):
+            chunk = c.recv(256 * 1024)
+            if not chunk:
+                break
+            buf += chunk
+        received[imei] = bytes(buf)
+
+    readers = [threading.Thread(target=read, args=item) for item in zip(imeis, devices)]
+    for r in readers:
+        r.start()
+    report = server.rollout(str(path))
+    for r in readers:
+        r.join(10)
+    assert report.failed == {}
+    assert sorted(report.completed) == imeis
+    assert all(data.startswith(b"#US#%d;" % len(firmware)) and data.endswith(firmware)
+               for data in received.values())
+
+    broadcast = server.broadcast("hello")
+    message = Protocol().build_driver_message("hello")
+    for c in devices:
+        assert c.recv(64) == message
+        c.sendall(b"#AM#1\r\n")
+    assert broadcast.wait(5)
+    assert broadcast.failed == {}
+    assert sorted(broadcast.delivered) == imeis
+    for c in devices:
+        c.close()
@@ -0,0 +1,104 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from conftest import credentials, login, wait_for
+from _wialonips import handoff
+from _wialonips.handoff import TAKEOVER, Session
+from _wialonips.listener import Listener
+from _wialonips.protocol import Protocol
+from _wialonips.server import Server
+
+DATA = Protocol().build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "handoff.sock")
+
+
+def start(tmp_path, handoff_path, port=0) -> Server:
+    server = Server(listeners=[Listener(port=port, name="main", credentials=credentials("1", "2"))],
+                    image_dir=str(tmp_path / "images"), ddd_dir=str(tmp_path / "ddd"), handoff_path=handoff_path)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    server.thread = thread
+    return server
+
+
+def test_session_round_trip():
+    session = Session("main", "1", "2.0", b"#D#\x00partial")
+    assert Session.from_json(session.to_json()) == session
+
+
+def test_connections_move_to_the_successor(tmp_path, path):
+    old = start(tmp_path, path)
+    assert wait_for(lambda: os.path.exists(path) and old.listeners[0].sock is not None)
+    device = login(old.listeners[0].port, "1")
+
+    new = Server(listeners=[Listener(port=0, name="main", credentials=credentials("1", "2"))],
+                 image_dir=str(tmp_path / "images"), ddd_dir=str(tmp_path / "ddd"), handoff_path=path)
+    try:
+        assert new.take_over()
+        assert new.listeners[0].sock is not None
+        threading.Thread(target=new.run, daemon=True).start()
+        old.thread.join(5)
+        assert not old.thread.is_alive()
+        assert wait_for(lambda: "1" in new.connections)
+
+        device.sendall(DATA)
+        assert device.recv(64) == b"#ASD#1\r\n"
+        assert new.metrics.snapshot()["main"]["taken_over"] == 1
+        assert old.metrics.snapshot()["main"]["handed_off"] == 1
+        assert "1" not in old.connections
+        assert wait_for(lambda: os.path.exists(path))  # kept for the next restart
+    finally:
+        device.close()
+        new.stop()
+
+
+def test_successor_lost_while_draining(tmp_path, path):
+    old = start(tmp_path, path)
+    assert wait_for(lambda: os.path.exists(path) and old.listeners[0].sock is not None)
+    devices = [login(old.listeners[0].port, imei) for imei in ("1", "2")]
+
+    successor = handoff.connect(path)
+    successor.sendall(TAKEOVER)
+    message, fds = handoff.recv_message(successor)
+    assert message == {"listeners": ["main"]}
+    for fd in fds:
+        os.close(fd)
+    successor.close()  # goes away before the connections follow
+
+    old.thread.join(5)
+    assert not old.thread.is_alive()
+    assert wait_for(lambda: not old._draining)
+    assert old._detached.empty()
+    metrics = old.metrics.snapshot()["main"]
+    # handed off before the successor closed: the fd went down with its socket
+    closed = metrics.get("handoff_dropped", 0) + metrics.get("handed_off", 0)
+    served = 0
+    for device in devices:
+        try:
+            device.sendall(DATA)
+            served += device.recv(64) == b"#ASD#1\r\n"  # not detached yet, stays with the old server
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # closed, the device reconnects to whoever listens now
+        device.close()
+    assert closed + served == len(devices)
+    old.stop()
+
+
+def test_probe_does_not_hand_off(tmp_path, path):
+    old = start(tmp_path, path)
+    assert wait_for(lambda: os.path.exists(path) and old.listeners[0].sock is not None)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.connect(path)
+    probe.close()
+    device = login(old.listeners[0].port, "1")
+    device.sendall(DATA)
+    assert device.recv(64) == b"#ASD#1\r\n"
+    device.close()
+    old.stop()
@@ -0,0 +1,81 @@
+import os
+
+from _wialonips.image import ImageReceiver
+from _wialonips.protocol import DevPacket
+from _wialonips.spool import ChunkSpool, safe_name
+from _wialonips.types import PacketType
+
+BLOCK_SIZE = 16
+
+
+class Receiver(ImageReceiver):
+    def __init__(self, spool):
+        super().__init__(spool)
+        self.images = []
+
+    def on_image(self, imei, name, path):
+        self.images.append((imei, name, path))
+
+
+def blocks(data: bytes, name: str = "cam1.jpg"):
+    count = (len(data) + BLOCK_SIZE - 1) // BLOCK_SIZE
+    return [DevPacket(PacketType.DEV_IMAGE, name=name, size=BLOCK_SIZE, index=i, count=count,
+                      payload=data[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE]) for i in range(count)]
+
+
+def read(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_image_spooled_block_by_block(tmp_path):
+    receiver = Receiver(ChunkSpool(str(tmp_path)))
+    data = os.urandom(BLOCK_SIZE * 3 + 7)
+    packets = blocks(data)
+    answers = [receiver.on_block("1", packet) for packet in packets]
+    assert answers[:-1] == [b"#AI#%d;1\r\n" % i for i in range(3)]
+    assert answers[-1] == b"#AI#3;1\r\n#AI#1\r\n"
+    (imei, name, path), = receiver.images
+    assert (imei, name) == ("1", "cam1.jpg") and read(path) == data
+
+
+def test_last_block_first_waits_for_its_offset(tmp_path):
+    receiver = Receiver(ChunkSpool(str(tmp_path)))
+    data = os.urandom(BLOCK_SIZE * 2 + 3)
+    packets = blocks(data)
+    assert receiver.on_block("1", packets[-1]) == b"#AI#2;0\r\n"  # its offset is not known yet
+    receiver.on_block("1", packets[0])
+    receiver.on_block("1", packets[-1])
+    receiver.on_block("1", packets[0])  # duplicates are not written twice
+    receiver.on_block("1", packets[1])
+    assert read(receiver.images[0][2]) == data
+
+
+def test_transfer_resumes_after_a_restart(tmp_path):
+    data = os.urandom(BLOCK_SIZE * 4)
+    packets = blocks(data)
+    spool = ChunkSpool(str(tmp_path))
+    first = Receiver(spool)
+    for packet in packets[:2]:
+        first.on_block("1", packet)
+    spool.close()
+
+    second = Receiver(ChunkSpool(str(tmp_path)))
+    for packet in packets[2:]:
+        second.on_block("1", packet)
+    assert read(second.images[0][2]) == data
+    assert sorted(os.listdir(tmp_path)) == ["1_cam1.jpg"]
+
+
+def test_bad_index_is_rejected(tmp_path):
+    receiver = Receiver(ChunkSpool(str(tmp_path)))
+    packet = blocks(b"x" * BLOCK_SIZE)[0]
+    packet.index = 5
+    assert receiver.on_block("1", packet) == b"#AI#5;0\r\n"
+    packet.index = None
+    assert receiver.on_block("1", packet) == b"#AI#0;0\r\n"
+
+
+def test_device_names_cannot_leave_the_spool():
+    assert safe_name("../../etc/passwd") == "_.._etc_passwd"
+    assert safe_name("..") == "_"
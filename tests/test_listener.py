@@ -0,0 +1,79 @@
+import socket
+
+from conftest import credentials, login, wait_for
+from _wialonips.listener import AckPolicy, Listener
+from _wialonips.protocol import Protocol
+from _wialonips.sink import MemorySink, Sink
+from _wialonips.types import PacketType
+
+DATA = Protocol().build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+
+
+def test_listeners_keep_their_own_devices_and_sinks(serve):
+    fleet = Listener(port=0, name="fleet", credentials=credentials("1"), sink=MemorySink())
+    rental = Listener(port=0, name="rental", credentials=credentials("2"), sink=MemorySink(),
+                      ack_policy=AckPolicy.NONE)
+    server = serve(fleet, rental)
+    assert fleet.port != rental.port
+
+    a = login(fleet.port, "1")
+    b = login(rental.port, "2")
+    a.sendall(DATA)
+    assert a.recv(64) == b"#ASD#1\r\n"
+    b.sendall(DATA)
+    b.sendall(b"#P#\r\n")
+    assert b.recv(64) == b"#AP#\r\n"  # data is not acked on this listener
+    assert wait_for(lambda: rental.sink.packets)
+    assert [imei for imei, _ in fleet.sink.packets] == ["1"]
+    assert [imei for imei, _ in rental.sink.packets] == ["2"]
+
+    metrics = server.metrics.snapshot()
+    assert metrics["fleet"]["packets"] == 2 and metrics["rental"]["packets"] == 3
+    a.close()
+    b.close()
+
+
+def test_unknown_device_is_refused_on_the_other_listener(serve):
+    fleet = Listener(port=0, name="fleet", credentials=credentials("1"))
+    rental = Listener(port=0, name="rental", credentials=credentials("2"))
+    serve(fleet, rental)
+    c = socket.create_connection(("127.0.0.1", rental.port))
+    c.settimeout(5)
+    c.sendall(Protocol().build_packet(PacketType.DEV_LOGIN, ["2.0", "1", "pw"]))
+    assert c.recv(64) != b"#AL#1\r\n"
+    c.close()
+
+
+def test_listener_added_while_running(serve):
+    fleet = Listener(port=0, name="fleet", credentials=credentials("1"))
+    server = serve(fleet)
+    late = Listener(port=0, name="late", credentials=credentials("3"))
+    server.add_listener(late)
+    assert wait_for(lambda: late.sock is not None)
+    c = login(late.port, "3")
+    c.sendall(DATA)
+    assert c.recv(64) == b"#ASD#1\r\n"
+    c.close()
+
+
+class FailingSink(Sink):
+    def write(self, imei, packet):
+        raise OSError("disk full")
+
+
+def test_sink_failure_after_an_immediate_ack_is_counted(serve):
+    immediate = Listener(port=0, name="immediate", credentials=credentials("1"), sink=FailingSink())
+    after_write = Listener(port=0, name="after_write", credentials=credentials("2"), sink=FailingSink(),
+                           ack_policy=AckPolicy.AFTER_WRITE)
+    server = serve(immediate, after_write)
+    a = login(immediate.port, "1")
+    b = login(after_write.port, "2")
+    a.sendall(DATA)
+    assert a.recv(64) == b"#ASD#1\r\n"  # acked before the sink failed, the device does not resend
+    b.sendall(DATA)
+    b.sendall(b"#P#\r\n")
+    assert b.recv(64) == b"#AP#\r\n"  # not acked, the device resends
+    assert wait_for(lambda: server.metrics.get("sink_dropped", "immediate") == 1)
+    assert server.metrics.get("sink_dropped", "after_write") == 0
+    a.close()
+    b.close()
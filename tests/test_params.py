@@ -0,0 +1,51 @@
+from _wialonips.params import ParamSchemaCache, Params, parse_params, shared_schema
+
+TEXT = "battery:1:80,fuel:2:31.5,driver:3:Ivan,SOS:1:1,mcc:1:255,wifi_mac_1:3:aa:bb,temp:1:NA"
+
+
+def test_values_are_typed_and_grouped():
+    params, lbs, wifi, alarm = parse_params(TEXT)
+    assert dict(params) == {"battery": 80, "fuel": 31.5, "driver": "Ivan", "temp": None}
+    assert lbs == {"mcc": 255}
+    assert wifi == {"wifi_mac_1": "aa:bb"}
+    assert alarm is True
+
+
+def test_params_is_a_read_only_mapping():
+    params = parse_params("battery:1:80,fuel:2:31.5")[0]
+    assert isinstance(params, Params)
+    assert params["fuel"] == 31.5 and len(params) == 2 and list(params) == ["battery", "fuel"]
+    assert params == {"battery": 80, "fuel": 31.5}
+
+
+def test_repeated_key_keeps_the_last_value():
+    params = parse_params("battery:1:80,fuel:2:31.5,battery:2:79.5")[0]
+    assert len(params) == 2 and list(params) == ["battery", "fuel"]
+    assert params["battery"] == 79.5
+    assert params == {"battery": 80, "fuel": 31.5, "battery": 79.5}  # noqa: F601, as a dict takes them
+
+
+def test_malformed_items_are_skipped():
+    params = parse_params("battery:1:80,junk,speed:9:1,fuel:2:x")[0]
+    assert dict(params) == {"battery": 80, "fuel": "x"}  # a value that does not convert stays text
+
+
+def test_cache_reuses_the_schema_of_a_repeated_layout():
+    cache = ParamSchemaCache(max_schemas=2)
+    first = cache.parse("battery:1:80,fuel:2:31.5")[0]
+    second = cache.parse("battery:1:79,fuel:2:30.0")[0]
+    assert dict(second) == {"battery": 79, "fuel": 30.0}
+    assert first.schema is second.schema
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.parse("a:1:1")
+    cache.parse("b:1:1")  # evicts the first layout
+    cache.parse("battery:1:1,fuel:2:1")
+    assert cache.misses == 4
+
+
+def test_keys_are_shared_across_connections():
+    a = ParamSchemaCache().parse("battery:1:80,fuel:2:31.5")[0]
+    b = ParamSchemaCache().parse("battery:1:10,fuel:2:1.5")[0]
+    assert a.schema is b.schema is shared_schema(("battery:1:", "fuel:2:"))
+    assert a.schema.keys[0] is b.schema.keys[0]
@@ -0,0 +1,113 @@
+import glob
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import wait_for
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from _wialonips.listener import AckPolicy, Listener  # noqa: E402
+from _wialonips.parquet import ParquetSink, imei_bucket  # noqa: E402
+from _wialonips.protocol import DevPacket  # noqa: E402
+from _wialonips.types import PacketType  # noqa: E402
+
+START = datetime(2025, 2, 24, 23, 59, 0)
+
+
+def message(seconds: int, speed: int = 40) -> DevPacket:
+    at = START + timedelta(seconds=seconds)
+    return DevPacket(PacketType.DEV_EXTENDED_DATA, date=at.strftime("%d%m%y"), time=at.strftime("%H%M%S"),
+                     lat_deg="5027.282000", lat_sign="N", lon_deg="03031.428000", lon_sign="E", speed=speed,
+                     adc=[12.5, "NA"], params={"fuel": 31.5, "driver": "Ivan"})
+
+
+def files(directory) -> list:
+    return sorted(glob.glob(os.path.join(str(directory), "**", "*.parquet"), recursive=True))
+
+
+def test_rows_are_partitioned_by_day_and_imei(tmp_path):
+    sink = ParquetSink(str(tmp_path), batch_size=4)
+    for i in range(10):
+        sink.write(str(i % 2), message(i * 10))  # past midnight from i = 6
+    sink.close()
+    table = pq.read_table(str(tmp_path))
+    assert table.num_rows == 10
+    dirs = {os.path.relpath(os.path.dirname(path), tmp_path) for path in files(tmp_path)}
+    assert dirs == {os.path.join(f"date={day}", f"imei_bucket={imei_bucket(imei):02d}")
+                    for day in ("2025-02-24", "2025-02-25") for imei in "01"}
+    row = pq.read_table(files(tmp_path)[0]).to_pylist()[0]
+    assert row["adc"] == [12.5] and dict(row["params"]) == {"fuel": 31.5}
+    assert dict(row["params_text"]) == {"driver": "Ivan"}
+
+
+def test_write_does_not_wait_for_the_file(tmp_path, monkeypatch):
+    sink = ParquetSink(str(tmp_path), batch_size=2)
+    started, release = threading.Event(), threading.Event()
+    write_batch = sink._write_batch
+
+    def slow(*args):
+        started.set()
+        release.wait(5)
+        write_batch(*args)
+
+    monkeypatch.setattr(sink, "_write_batch", slow)
+    sink.write("1", message(0))
+    sink.write("1", message(1))
+    assert started.wait(5)
+    t = time.perf_counter()
+    sink.write("1", message(2))  # the writer is busy with the first batch
+    assert time.perf_counter() - t < 0.5
+    release.set()
+    sink.close()
+    assert pq.read_table(str(tmp_path)).num_rows == 3
+
+
+def test_small_batches_are_written_after_the_delay(tmp_path):
+    sink = ParquetSink(str(tmp_path), max_delay=0.1, max_file_age=0.2)
+    sink.write("1", message(0))
+    assert wait_for(lambda: files(tmp_path) and sink.stats()["open_files"] == 0)  # closed with its footer
+    assert pq.read_table(files(tmp_path)[0]).num_rows == 1
+    sink.write("1", message(1))
+    sink.close()
+    assert len(files(tmp_path)) == 2
+    assert pq.read_table(str(tmp_path)).num_rows == 2
+
+
+def test_files_roll_over_at_their_size(tmp_path):
+    sink = ParquetSink(str(tmp_path), batch_size=1, max_file_bytes=1)
+    for i in range(3):
+        sink.write("1", message(i))
+    sink.flush()
+    assert len(files(tmp_path)) == 3
+    assert sink.stats()["open_files"] == 0
+    sink.close()
+    assert pq.read_table(str(tmp_path)).num_rows == 3
+
+
+def test_writer_errors_are_raised(tmp_path, monkeypatch):
+    sink = ParquetSink(str(tmp_path), batch_size=1)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(sink, "_write_batch", fail)
+    sink.write("1", message(0))
+    with pytest.raises(OSError):
+        sink.flush()
+    sink.flush()  # raised once
+    sink.close()
+    with pytest.raises(ValueError):
+        sink.write("1", message(1))
+
+
+def test_after_write_is_refused(tmp_path):
+    sink = ParquetSink(str(tmp_path))
+    with pytest.raises(ValueError):
+        Listener(port=0, sink=sink, ack_policy=AckPolicy.AFTER_WRITE)  # rows are not stored when acked
+    Listener(port=0, sink=sink)
+    sink.close()
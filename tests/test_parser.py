@@ -0,0 +1,139 @@
+import pytest
+
+from _wialonips.crc16 import crc16
+from _wialonips.parser import PacketParser, parse_packet
+from _wialonips.protocol import DevPacket, Protocol
+from _wialonips.types import (
+    ExtendedDataResponseCode, LoginResponseCode, PacketType, ShortDataResponseCode,
+)
+
+protocol = Protocol()
+LOGIN = protocol.build_packet(PacketType.DEV_LOGIN, ["2.0", "865432100012345", "secret"])
+SHORT = protocol.build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+EXTENDED = protocol.build_data_packet(None, 50.45, 30.52, 60, 90, 150, 9, 1.2, 5, 0, [12.4, 0.5], "NA",
+                                      battery=87, driver="john")
+
+
+def with_crc(header: bytes, body: bytes) -> bytes:
+    return header + body + b"%X" % crc16(body) + b"\r\n"
+
+
+def corrupt_crc(packet: bytes) -> bytes:
+    body_end = max(packet.rfind(b";"), packet.rfind(b"|")) + 1
+    crc = int(packet[body_end:-2], 16) ^ 1
+    return packet[:body_end] + b"%X" % crc + b"\r\n"
+
+
+def test_crc16():
+    assert crc16(b"123456789") == 0xBB3D  # CRC-16/ARC check value
+    assert crc16(memoryview(b"123456789")) == 0xBB3D
+
+
+@pytest.mark.parametrize("packet", [LOGIN, SHORT, EXTENDED])
+def test_valid_packets_match_the_legacy_parser(packet):
+    fast = parse_packet(packet)
+    legacy = DevPacket.parse_from_bytes(packet)
+    assert fast.code is None
+    assert (fast.type, fast.imei, fast.lat_deg, fast.lon_deg) == \
+           (legacy.type, legacy.imei, legacy.lat_deg, legacy.lon_deg)
+
+
+@pytest.mark.parametrize("packet, code", [
+    (LOGIN, LoginResponseCode.CRC_ERROR),
+    (SHORT, ShortDataResponseCode.CRC_ERROR),
+    (EXTENDED, ExtendedDataResponseCode.CRC_ERROR),
+])
+def test_crc_mismatch(packet, code):
+    assert parse_packet(corrupt_crc(packet)).code is code
+
+
+@pytest.mark.parametrize("packet, code", [
+    (b"#SD#NA;NA;NA;\r\n", ShortDataResponseCode.STRUCT_ERROR),  # no CRC, too few fields
+    (b"#D#1;2;3;zz\r\n", ExtendedDataResponseCode.STRUCT_ERROR),  # CRC is not hex
+    (b"#D#1;2;3;12345\r\n", ExtendedDataResponseCode.STRUCT_ERROR),  # CRC longer than 4 digits
+    (b"#L#2.0;imei;pw;", LoginResponseCode.ERROR),  # no frame end
+])
+def test_malformed(packet, code):
+    assert parse_packet(packet).code is code
+
+
+@pytest.mark.parametrize("packet, answer", [
+    (with_crc(b"#L#", b"2.0;\xff\xfe;pw;"), b"#AL#0\r\n"),
+    (with_crc(b"#D#", b"NA;" * 15 + b"a:1:\xff;"), b"#AD#-1\r\n"),
+    (with_crc(b"#B#", b"NA;" * 15 + b"a:1:\xff|"), b"#AB#0\r\n"),
+    (with_crc(b"#M#", b"\xff\xfe;"), b"#AM#0\r\n"),  # not UTF-8 either
+])
+def test_non_ascii_fields_are_malformed(packet, answer):
+    parsed = parse_packet(packet)
+    assert protocol.build_error_response(parsed) == answer
+
+
+def test_driver_message_is_utf8():
+    parsed = parse_packet(protocol.build_driver_message("Повертайтесь на базу"))
+    assert parsed.code is None and parsed.message == "Повертайтесь на базу"
+
+
+@pytest.mark.parametrize("packet", [b"", b"garbage\r\n", b"#XYZ#1;\r\n", b"#TOOLONG#1;\r\n"])
+def test_unknown_packets_are_marked(packet):
+    parsed = parse_packet(packet)
+    assert parsed.type is PacketType.UNKNOWN
+    assert parsed.code is not None
+
+
+def test_body_length_is_bounded():
+    parser = PacketParser(max_body_len=64)
+    assert parser.parse(b"#D#" + b"1;" * 40 + b"\r\n").code is ExtendedDataResponseCode.STRUCT_ERROR
+    assert parser.parse(SHORT).code is None
+
+
+def test_blackbox_crc():
+    body = SHORT[4:SHORT.rindex(b";") + 1].decode("ascii")
+    packet = protocol.build_black_box_packet([body, body])
+    assert len(parse_packet(packet).packets) == 2
+    assert parse_packet(corrupt_crc(packet)).code is not None
+
+
+@pytest.mark.parametrize("packet, answer", [
+    (corrupt_crc(LOGIN), b"#AL#10\r\n"),
+    (corrupt_crc(SHORT), b"#ASD#13\r\n"),
+    (corrupt_crc(EXTENDED), b"#AD#16\r\n"),
+    (b"#B#;\r\n", b"#AB#0\r\n"),
+    (b"#I#4;3;5;NA;NA;a.jpg;FFFF\r\nabcd", b"#AI#3;0\r\n"),
+    (b"#T#file;4;7;9;FFFF\r\nabcd", b"#AT#7;0\r\n"),
+    (b"#IT#file;\r\n", b"#AIT#0\r\n"),
+    (b"#M#hello;FFFF\r\n", b"#AM#0\r\n"),
+])
+def test_error_answer_per_type(packet, answer):
+    parsed = parse_packet(packet)
+    assert parsed.code is not None
+    assert protocol.build_error_response(parsed) == answer
+
+
+@pytest.mark.parametrize("packet", [
+    b"#P#junk\r\n",  # #AP# has no error code
+    b"#I#4;x;5;NA;NA;a.jpg;FFFF\r\nabcd",  # no block index to answer with
+    b"#XYZ#1;\r\n",
+])
+def test_no_error_answer(packet):
+    parsed = parse_packet(packet)
+    assert parsed.code is not None
+    assert protocol.build_error_response(parsed) is None
+
+
+def test_connection_decoder_answers_the_same():
+    decoder = protocol.connection_decoder(LOGIN)
+    parsed = decoder.decode(b"#T#file;4;7;9;FFFF\r\nabcd")
+    assert protocol.build_error_response(parsed) == b"#AT#7;0\r\n"
+
+
+@pytest.mark.parametrize("packet", [
+    b"#L#2.0;\xff\xfe;pw;\r\n",
+    with_crc(b"#L#", b"2.0;\xff\xfe;pw;"),
+    with_crc(b"#SD#", b"NA;" * 9 + b"\xff;"),
+    b"\xff\xfe\r\n",
+    b"#D#1;2;3;zz\r\n",
+])
+def test_protocol_answers_whatever_the_legacy_parser_answered(packet):
+    legacy = DevPacket.parse_from_bytes(packet)
+    assert legacy.code is not None
+    assert Protocol().parse_incoming_packet_from_dev(packet).code is not None
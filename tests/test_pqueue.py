@@ -0,0 +1,50 @@
+import pytest
+
+from fsm import Priority
+from pqueue import BucketQueue, PrioritizedRecord
+
+
+def records(*priorities):
+    return [PrioritizedRecord(p, ts, f"rec{ts}") for ts, p in enumerate(priorities)]
+
+
+def test_highest_priority_first_oldest_first_within_a_level():
+    q = BucketQueue()
+    for r in records(Priority.LOW, Priority.PANIC, Priority.LOW, Priority.HIGH, Priority.PANIC):
+        q.push(r)
+    assert [r.timestamp for r in q.peek(5)] == [1, 4, 3, 0, 2]
+    assert [r.timestamp for r in q] == [1, 4, 3, 0, 2]
+
+
+def test_peek_leaves_the_queue_pop_removes():
+    q = BucketQueue()
+    for r in records(Priority.LOW, Priority.HIGH, Priority.LOW):
+        q.push(r)
+    assert [r.timestamp for r in q.peek(2)] == [1, 0]
+    assert len(q) == 3
+    assert [r.timestamp for r in q.pop(2)] == [1, 0]
+    assert len(q) == 1
+    assert [r.timestamp for r in q.pop(5)] == [2]
+    assert not q
+    assert q.pop() == []
+
+
+def test_pop_lowest_takes_the_oldest_of_the_lowest_level():
+    q = BucketQueue()
+    for r in records(Priority.HIGH, Priority.LOW, Priority.PANIC, Priority.LOW):
+        q.push(r)
+    assert q.pop_lowest().timestamp == 1
+    assert q.pop_lowest().timestamp == 3
+    assert q.pop_lowest().timestamp == 0
+    assert q.pop_lowest().timestamp == 2
+    with pytest.raises(IndexError):
+        q.pop_lowest()
+
+
+def test_replace_keeps_the_length():
+    q = BucketQueue()
+    for r in records(Priority.LOW, Priority.LOW, Priority.LOW, Priority.HIGH):
+        q.push(r)
+    q.replace(Priority.LOW, list(q.bucket(Priority.LOW))[::2])
+    assert len(q) == 3
+    assert [r.timestamp for r in q] == [3, 0, 2]
@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+from conftest import credentials, login
+from _wialonips.listener import Listener
+from _wialonips.protocol import Protocol
+from _wialonips.ratelimit import DeviceBuckets, RateLimit, Throttle, TokenBucket
+
+
+def test_bucket_goes_into_debt():
+    bucket = TokenBucket(10, burst=5)
+    now = bucket.stamp
+    assert bucket.take(5, now) == 0
+    assert bucket.take(5, now) == pytest.approx(0.5)  # 5 tokens short at 10/s
+    assert bucket.take(0, now + 0.5) == 0
+    assert bucket.take(0, now + 10) == 0 and bucket.tokens == 5  # saved up to the burst only
+
+
+def test_throttle_waits_for_the_slowest_bucket():
+    throttle = Throttle(RateLimit(packets=100, bytes=1000))
+    assert throttle.delay(1, 100) == 0
+    assert throttle.delay(1, 2000) == pytest.approx(1.1, abs=0.01)
+    assert Throttle().delay(10 ** 6, 10 ** 9) == 0
+
+
+def test_device_buckets_survive_reconnects_and_are_bounded():
+    buckets = DeviceBuckets(RateLimit(packets=1), max_devices=2)
+    first = buckets.get("1")
+    assert buckets.get("1") is first
+    buckets.get("2")
+    buckets.get("3")
+    assert buckets.get("1") is not first
+
+
+def test_flooding_device_is_slowed_down(serve):
+    listener = Listener(port=0, credentials=credentials("1"), device_limit=RateLimit(packets=20, burst=0.5))
+    server = serve(listener)
+    c = login(listener.port, "1")
+    data = Protocol().build_short_data_packet(None, 50.45, 30.52, 60, 90, 150, 9)
+    t = time.perf_counter()
+    for _ in range(30):
+        c.sendall(data)
+        assert c.recv(64) == b"#ASD#1\r\n"
+    elapsed = time.perf_counter() - t
+    c.close()
+    assert elapsed > 0.8  # 30 packets at 20/s after a burst of 10 take ~1 s
+    assert server.metrics.snapshot()[listener.name]["throttled"] > 0
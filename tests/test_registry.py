@@ -0,0 +1,131 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from _wialonips.guard import set_send_timeout
+from _wialonips.protocol import Protocol
+from _wialonips.registry import ConnectionRegistry
+
+
+class Target:
+    def __init__(self, connection, version="2.0"):
+        self.connection = connection
+        self.send_lock = threading.Lock()
+        self.protocol = Protocol(version)
+
+
+@pytest.fixture
+def pairs():
+    """Connected socket pairs (server side, device side), closed after the test."""
+    made = []
+
+    def make(n):
+        new = [socket.socketpair() for _ in range(n)]
+        made.extend(new)
+        return new
+
+    yield make
+    for a, b in made:
+        a.close()
+        b.close()
+
+
+def fill(sock):
+    """Fills the send buffer of `sock`."""
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.send(b"x" * 65536)
+    except BlockingIOError:
+        pass
+    sock.setblocking(True)
+
+
+def test_broadcast_is_delivered_and_acked(pairs):
+    registry = ConnectionRegistry()
+    connected = pairs(3)
+    for i, (a, _) in enumerate(connected):
+        registry.add(str(i), Target(a, "1.1" if i == 0 else "2.0"))
+
+    broadcast = registry.broadcast("Return to base", ["0", "1", "2", "9"])
+    assert broadcast.targets == 4
+    assert broadcast.failed == {"9": "not connected"}
+    assert broadcast.pending == {"0", "1", "2"}
+    for i, (_, b) in enumerate(connected):
+        assert b.recv(256) == Protocol("1.1" if i == 0 else "2.0").build_driver_message("Return to base")
+
+    registry.on_ack("0", "1")
+    registry.on_ack("1", "0")
+    assert not broadcast.wait(0)
+    registry.remove("2")
+    assert broadcast.wait(0)
+    assert broadcast.delivered == {"0"}
+    assert broadcast.rejected == {"1": "0", "2": "disconnected"}
+
+
+def test_acks_are_matched_in_order(pairs):
+    registry = ConnectionRegistry()
+    (a, _), = pairs(1)
+    registry.add("1", Target(a))
+    first = registry.broadcast("one")
+    second = registry.broadcast("two")
+    registry.on_ack("1", "1")
+    assert first.delivered == {"1"} and second.pending == {"1"}
+    registry.on_ack("1", "0")
+    assert second.rejected == {"1": "0"}
+
+
+@pytest.mark.parametrize("timeout", ["settimeout", "SO_SNDTIMEO", None])
+def test_full_send_buffer_is_retried_without_blocking(pairs, timeout):
+    registry = ConnectionRegistry()
+    (a, b), = pairs(1)
+    fill(a)
+    if timeout == "settimeout":
+        a.settimeout(10)  # Python polls for this long before a send, even with MSG_DONTWAIT
+    elif timeout == "SO_SNDTIMEO":
+        set_send_timeout(a, 10)
+    registry.add("1", Target(a))
+
+    def drain():
+        time.sleep(0.2)
+        b.setblocking(False)
+        try:
+            while True:
+                b.recv(1 << 20)
+        except BlockingIOError:
+            pass
+
+    reader = threading.Thread(target=drain)
+    start = time.monotonic()
+    reader.start()
+    broadcast = registry.broadcast("hello", timeout=5)
+    reader.join()
+    assert time.monotonic() - start < 5
+    assert broadcast.pending == {"1"} and not broadcast.failed
+
+
+def test_stalled_device_times_out(pairs):
+    registry = ConnectionRegistry()
+    (a, _), = pairs(1)
+    fill(a)
+    a.settimeout(10)
+    registry.add("1", Target(a))
+    start = time.monotonic()
+    broadcast = registry.broadcast("hello", timeout=0.2)
+    assert time.monotonic() - start < 2
+    assert broadcast.failed == {"1": "send timed out"}
+    assert broadcast.wait(0)
+    assert not registry._awaiting.get("1")
+
+
+def test_broken_connection_fails(pairs):
+    registry = ConnectionRegistry()
+    (a, _), = pairs(1)
+    a.shutdown(socket.SHUT_WR)  # sends fail with EPIPE
+    registry.add("1", Target(a))
+    broadcast = registry.broadcast("hello")
+    assert list(broadcast.failed) == ["1"]
+    assert not broadcast.pending and broadcast.wait(0)
+    assert not registry._awaiting.get("1")
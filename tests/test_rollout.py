@@ -0,0 +1,130 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from _wialonips.crc16 import crc16
+from _wialonips.guard import send_timeout, set_send_timeout
+from _wialonips.rollout import Rollout, upload_header
+from _wialonips.types import PacketType
+
+SIZE = 4 * 2 ** 20
+
+
+class Target:
+    def __init__(self, connection):
+        self.connection = connection
+        self.send_lock = threading.Lock()
+
+
+@pytest.fixture
+def firmware(tmp_path):
+    path = tmp_path / "firmware.bin"
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+@pytest.fixture
+def pairs():
+    """TCP connections over loopback, (server side, device side)."""
+    made = []
+
+    def make(n):
+        with socket.create_server(("127.0.0.1", 0)) as server:
+            for _ in range(n):
+                device = socket.create_connection(server.getsockname())
+                made.append((server.accept()[0], device))
+        return made[-n:]
+
+    yield make
+    for a, b in made:
+        a.close()
+        b.close()
+
+
+def reader(sock, expected, into, delay=0.0):
+    def read():
+        time.sleep(delay)
+        buf = bytearray()
+        while len(buf) < expected:
+            chunk = sock.recv(256 * 1024)
+            if not chunk:
+                break
+            buf += chunk
+        into.append(bytes(buf))
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    return thread
+
+
+def run(rollout, targets, readers):
+    report = rollout.run(targets)
+    for r in readers:
+        r.join(10)
+    return report
+
+
+def expected_bytes(path, packet_type=PacketType.SRV_UPLOAD_SOFTWARE):
+    data = path.read_bytes()
+    return upload_header(packet_type, len(data), crc16(data)) + data
+
+
+@pytest.mark.parametrize("setup", [
+    lambda sock: None,  # blocking
+    lambda sock: sock.settimeout(1),  # non-blocking under the hood, sendfile gets EAGAIN
+    lambda sock: set_send_timeout(sock, 0.05),  # blocking, sendfile gives up every 50 ms
+], ids=["blocking", "settimeout", "SO_SNDTIMEO"])
+def test_slow_readers_get_the_whole_file(firmware, pairs, setup):
+    expected = expected_bytes(firmware)
+    received = []
+    targets, readers = {}, []
+    for i, (a, b) in enumerate(pairs(3)):
+        setup(a)
+        targets[str(i)] = Target(a)
+        readers.append(reader(b, len(expected), received, delay=0.3 * i))
+    report = run(Rollout(str(firmware), stall_timeout=5), targets, readers)
+    assert report.failed == {}
+    assert sorted(report.completed) == ["0", "1", "2"]
+    assert report.bytes_sent == 3 * len(expected)
+    assert received == [expected] * 3
+
+
+def test_stalled_target_is_given_up(firmware, pairs):
+    (a, b), (c, d) = pairs(2)
+    expected = expected_bytes(firmware, PacketType.SRV_UPLOAD_CONFIGURATION)
+    received = []
+    readers = [reader(d, len(expected), received)]
+    t = time.monotonic()
+    rollout = Rollout(str(firmware), PacketType.SRV_UPLOAD_CONFIGURATION, stall_timeout=0.5)
+    report = run(rollout, {"stalled": Target(a), "ok": Target(c)}, readers)
+    assert time.monotonic() - t < 5
+    assert report.completed == ["ok"]
+    assert report.failed == {"stalled": "send buffer stalled"}
+    assert received == [expected]
+    assert send_timeout(a) is None  # the bound the rollout put on the socket is gone
+
+
+def test_stalled_target_is_shut_down(firmware, pairs):
+    (a, b), = pairs(1)
+    report = Rollout(str(firmware), stall_timeout=0.3).run({"1": Target(a)})
+    assert report.failed == {"1": "send buffer stalled"}
+    with pytest.raises(OSError):
+        a.sendall(b"#AD#1\r\n")  # nothing else goes out after the half sent file
+    b.settimeout(5)
+    got = 0
+    while True:
+        chunk = b.recv(256 * 1024)
+        if not chunk:
+            break  # the device sees the connection end
+        got += len(chunk)
+    assert got < len(expected_bytes(firmware))
+
+
+def test_not_connected_and_bad_type(firmware):
+    report = Rollout(str(firmware)).run({}, ["1"])
+    assert report.failed == {"1": "not connected"}
+    with pytest.raises(ValueError):
+        Rollout(str(firmware), PacketType.DEV_PING)
@@ -0,0 +1,135 @@
+import socket
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from _wialonips.dedup import Deduplicator
+from _wialonips.listener import AckPolicy
+from _wialonips.protocol import DevPacket
+from _wialonips.server import Device, DeviceCredentials
+from _wialonips.store import SQLiteStore
+from _wialonips.types import PacketType
+
+START = datetime(2025, 2, 24, 8, 0, 0)
+
+
+def message(seconds: int, speed: int = 40) -> DevPacket:
+    at = START + timedelta(seconds=seconds)
+    return DevPacket(PacketType.DEV_EXTENDED_DATA, date=at.strftime("%d%m%y"), time=at.strftime("%H%M%S"),
+                     lat_deg="5027.282000", lat_sign="N", lon_deg="03031.428000", lon_sign="E", speed=speed,
+                     adc=[12.5], params={"fuel": 31.5})
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / "telemetry.db"), max_delay=0.01)
+    yield store
+    store.close()
+
+
+def fail_once(store, monkeypatch):
+    insert = store._insert
+    failures = [sqlite3.OperationalError("disk I/O error")]
+
+    def flaky(conn, rows):
+        if failures:
+            raise failures.pop()
+        insert(conn, rows)
+
+    monkeypatch.setattr(store, "_insert", flaky)
+
+
+def test_range_and_latest(store):
+    for i in range(5):
+        store.write("1", message(60 * i, speed=i))
+    store.write("2", message(0))
+    store.flush()
+    start = START.timestamp()
+    assert [m["speed"] for m in store.range("1", start + 60, start + 180)] == [1, 2]
+    assert [m["speed"] for m in store.latest("1", 2)] == [4, 3]
+    latest, = store.latest("2")
+    assert latest["adc"] == [12.5] and latest["params"] == {"fuel": 31.5} and latest["lat"] == pytest.approx(50.4547)
+    assert store.range("9", start, start + 3600) == []
+    assert store.count() == 6
+
+
+def test_commit_waits_for_the_rows_of_its_thread(store):
+    store.write("1", message(0))
+    store.commit()
+    assert store.count() == 1
+    store.commit()  # nothing new
+
+
+def test_commit_raises_when_the_transaction_failed(store, monkeypatch):
+    fail_once(store, monkeypatch)
+    store.write("1", message(0))
+    with pytest.raises(sqlite3.OperationalError):
+        store.commit()
+    store.write("1", message(0))
+    store.commit()
+    assert store.count() == 1
+
+
+def test_failure_is_reported_to_the_threads_whose_rows_it_held(store, monkeypatch):
+    store.write("1", message(0))
+    store.commit()
+    fail_once(store, monkeypatch)
+    errors = []
+
+    def other():
+        store.write("2", message(0))
+        try:
+            store.commit()
+        except sqlite3.Error as exc:
+            errors.append(exc)
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    thread.join()
+    store.commit()  # this thread's rows were all stored before
+    assert len(errors) == 1
+
+
+def test_close_closes_the_readers_of_every_thread(tmp_path):
+    store = SQLiteStore(str(tmp_path / "telemetry.db"))
+    thread = threading.Thread(target=store.count)
+    thread.start()
+    thread.join()
+    store.count()
+    readers = list(store._readers)
+    assert len(readers) == 2
+    store.close()
+    for conn in readers:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    with pytest.raises(ValueError):
+        store.write("1", message(0))
+
+
+@pytest.fixture
+def device_pair():
+    a, b = socket.socketpair()
+    b.settimeout(5)
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_after_write_acks_only_stored_messages(store, device_pair, monkeypatch):
+    a, b = device_pair
+    dev = Device(a, DeviceCredentials("1"), sink=store, ack_policy=AckPolicy.AFTER_WRITE, dedup=Deduplicator())
+    fail_once(store, monkeypatch)
+    packet = DevPacket(PacketType.DEV_BLACKBOX, packets=[message(0), message(10)])
+
+    dev.on_message_received(packet)  # the transaction fails, no ack
+    b.setblocking(False)
+    with pytest.raises(BlockingIOError):
+        b.recv(64)
+    b.setblocking(True)
+    assert store.count() == 0
+
+    dev.on_message_received(packet)  # resent, not taken for a duplicate
+    assert b.recv(64) == b"#AB#2\r\n"
+    assert store.count() == 2  # committed before the ack
@@ -0,0 +1,54 @@
+import pytest
+
+import track
+from _wialonips import utils
+from track import ReportingPolicy, ddmm2dec, haversine, record_coords, simplify
+
+
+def test_first_sample_and_heartbeat_are_reported():
+    policy = ReportingPolicy(min_interval=5, max_interval=60)
+    assert policy.should_report(0, 50.45, 30.52, 0, 0)
+    assert not policy.should_report(30, 50.45, 30.52, 0, 0)  # parked
+    assert policy.should_report(60, 50.45, 30.52, 0, 0)
+
+
+def test_thresholds():
+    policy = ReportingPolicy(min_interval=5, distance=100, heading=15, speed=10)
+    policy.should_report(0, 50.45, 30.52, 50, 90)
+    assert not policy.should_report(2, 50.46, 30.52, 50, 90)  # under min_interval
+    assert policy.should_report(10, 50.46, 30.52, 50, 90)  # ~1.1 km
+    assert policy.should_report(20, 50.46, 30.52, 65, 90)  # speed
+    assert not policy.should_report(30, 50.46, 30.52, 65, 100)
+    assert policy.should_report(40, 50.46, 30.52, 65, 110)  # course
+    assert policy.should_report(50, 50.46, 30.52, 2, 200)  # speed dropped by 63
+
+
+def test_course_is_ignored_when_slow():
+    policy = ReportingPolicy(min_interval=0, heading_min_speed=5)
+    policy.should_report(0, 50.45, 30.52, 1, 0)
+    assert not policy.should_report(1, 50.45, 30.52, 1, 180)
+
+
+def test_simplify_keeps_the_corners_of_a_track():
+    straight = [(50.45, 30.52 + i * 0.001) for i in range(10)]
+    north = [(50.45 + i * 0.001, 30.529) for i in range(1, 10)]
+    assert simplify(straight + north, 20) == [0, 9, 18]
+    assert simplify(straight[:2], 20) == [0, 1]
+
+
+def test_haversine():
+    assert haversine(50.45, 30.52, 50.45, 30.52) == 0
+    assert haversine(0, 0, 1, 0) == pytest.approx(111_195, rel=1e-3)
+
+
+def test_haversine_matches_the_server_copy():
+    assert track.haversine.__module__ == "track"  # the firmware runs without the server package
+    assert track.EARTH_RADIUS == utils.EARTH_RADIUS
+    assert haversine(50.45, 30.52, 48.0, 35.0) == utils.haversine(50.45, 30.52, 48.0, 35.0)
+
+
+def test_record_coords():
+    assert ddmm2dec("5027.000", "N") == pytest.approx(50.45)
+    assert ddmm2dec("03031.200", "W") == pytest.approx(-30.52)
+    assert record_coords("240225;120000;5027.000;N;03031.200;E;NA;NA;") == pytest.approx((50.45, 30.52))
+    assert record_coords("240225;120000;NA;NA;NA;NA;NA;NA;") is None